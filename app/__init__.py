@@ -16,6 +16,11 @@ def create_app():
     app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # Write-behind de hechos: un hilo escritor agrupa los POST /api/facts
+    app.config["FACTS_WRITE_BEHIND"] = os.environ.get("FACTS_WRITE_BEHIND", "0") == "1"
+    app.config["FACTS_WRITE_BEHIND_MAX_ROWS"] = int(os.environ.get("FACTS_WRITE_BEHIND_MAX_ROWS", 500))
+    app.config["FACTS_WRITE_BEHIND_MAX_MS"] = int(os.environ.get("FACTS_WRITE_BEHIND_MAX_MS", 20))
+
     # Extensiones
     db.init_app(app)
     migrate.init_app(app, db)
@@ -54,6 +59,12 @@ def create_app():
 
     # ✅ API de hechos (coma decimal)
     from app.facts.routes import facts_bp
+    from app.facts.writer import init_app as init_fact_writer
     app.register_blueprint(facts_bp)
+    init_fact_writer(app)
+
+    # ✅ API de cubo (consultas multidimensionales)
+    from app.cube.routes import cube_bp
+    app.register_blueprint(cube_bp)
 
     return app
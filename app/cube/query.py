@@ -0,0 +1,391 @@
+import re
+from collections import defaultdict
+from sqlalchemy import select, func, literal, union_all, exists
+from app.extensions import db
+from app.generations import current_generation
+from app.models import HechoFinanciero
+from app.dimensions.models import Dimension, Hierarchy, HierarchyClosure, HierarchyEdge, Member
+from app.dimensions.rollup import FACT_COLUMN
+from app.dimensions.services import DimensionError
+from app.dimensions.formulas import formula_cache, is_formula
+from app.dimensions.utils import from_minor_units, resolve_member_codes
+from app.facts.fx import Converter
+from app.facts.timeintel import (PREFIX_GENERATION, parse_dynamic, prefix_cache, prefix_sums,
+                                 time_code, window, years_needed)
+
+# "CODE", "children(CODE)", "descendants(CODE)", "idescendants(CODE)" (incluye CODE), "level0(CODE)"
+_SPEC = re.compile(r'^\s*(children|descendants|idescendants|level0)\s*\(\s*(.+?)\s*\)\s*$', re.I)
+_DYNAMIC_NAMES = {'YTD': 'Acumulado del año', 'QTD': 'Acumulado del trimestre',
+                  'R12': 'Últimos 12 meses'}
+
+
+class DynamicTimeMember:
+    """
+    Miembro TIME calculado (YTD/QTD/R12 a un mes): no existe en members ni
+    en la clausura, se evalúa restando sumas prefijas mensuales.
+    """
+
+    def __init__(self, fn: str, año: int, mes: int):
+        self.fn, self.año, self.mes = fn, año, mes
+        self.code = self.id = f'{fn}({time_code(año, mes)})'
+        self.name = f'{_DYNAMIC_NAMES[fn]} a {time_code(año, mes)}'
+
+
+class CubeAxis:
+    """
+    Conjunto de miembros de una dimensión ya expandido, con la jerarquía
+    con la que se consolida y el orden de salida.
+    """
+
+    def __init__(self, dim: Dimension, hierarchy_id: int | None, members: list[Member]):
+        self.dim = dim
+        self.hierarchy_id = hierarchy_id
+        self.members = members
+        self.column = FACT_COLUMN.get(dim.code)
+        if not self.column:
+            raise DimensionError(f'la dimensión {dim.code} no tiene columna en hecho_financiero')
+
+    @property
+    def ids(self) -> list[int]:
+        """Miembros almacenados (los que se resuelven por la clausura)."""
+        return [m.id for m in self.members
+                if not isinstance(m, DynamicTimeMember) and not is_formula(m)]
+
+    @property
+    def dynamic(self) -> list[DynamicTimeMember]:
+        return [m for m in self.members if isinstance(m, DynamicTimeMember)]
+
+
+def _dimension(code: str) -> Dimension:
+    d = Dimension.query.filter_by(code=str(code).strip().upper()).first()
+    if not d:
+        raise DimensionError(f'dimension no existe: {code}')
+    return d
+
+
+def _hierarchy_id(dim: Dimension, code: str | None) -> int | None:
+    q = Hierarchy.query.filter_by(dimension_id=dim.id)
+    h = (q.filter_by(code=code) if code else q.filter_by(is_primary=True)).order_by(Hierarchy.id).first()
+    if code and not h:
+        raise DimensionError(f'hierarchy no existe en {dim.code}: {code}')
+    return h.id if h else None
+
+
+def _member(dim: Dimension, code: str) -> Member:
+    m = Member.query.filter_by(dimension_id=dim.id, code=str(code).strip()).first()
+    if not m:
+        raise ValueError(f'member no existe en {dim.code}: {code}')
+    return m
+
+
+def _expand(dim: Dimension, hierarchy_id: int | None, spec: str) -> list[Member]:
+    """Expande un elemento del conjunto (código o función) a miembros."""
+    if dim.code == 'TIME':
+        dyn = parse_dynamic(spec)
+        if dyn:
+            return [DynamicTimeMember(*dyn)]
+    match = _SPEC.match(str(spec))
+    if not match:
+        return [_member(dim, spec)]
+    fn, code = match.group(1).lower(), match.group(2)
+    root = _member(dim, code)
+    if hierarchy_id is None:
+        return [root] if fn in ('idescendants', 'level0') else []
+
+    c = HierarchyClosure
+    q = (select(c.descendant_id, func.min(c.depth).label('depth'))
+         .where(c.hierarchy_id == hierarchy_id, c.ancestor_id == root.id)
+         .group_by(c.descendant_id))
+    if fn == 'children':
+        q = q.where(c.depth == 1)
+    elif fn == 'descendants':
+        q = q.where(c.depth > 0)
+    elif fn == 'level0':
+        q = q.where(~exists().where(HierarchyEdge.hierarchy_id == hierarchy_id,
+                                    HierarchyEdge.parent_member_id == c.descendant_id))
+    depth = dict(db.session.execute(q).all())
+    if fn in ('idescendants', 'level0') and not depth:
+        # miembro fuera de la jerarquía: es su propio nivel 0
+        return [root]
+    mems = Member.query.filter(Member.id.in_(depth)).all() if depth else []
+    return sorted(mems, key=lambda m: (depth[m.id], m.code))
+
+
+def build_axis(spec: dict | str) -> CubeAxis:
+    """
+    Eje de filas/columnas: {"dimension": "ACCOUNT", "members": [...],
+    "hierarchy": "PRIMARY"} (hierarchy opcional, por defecto la primaria).
+    """
+    if not isinstance(spec, dict) or not spec.get('dimension'):
+        raise ValueError('cada eje requiere dimension y members')
+    dim = _dimension(spec['dimension'])
+    hierarchy_id = _hierarchy_id(dim, spec.get('hierarchy'))
+    items = spec.get('members') or []
+    if isinstance(items, str):
+        items = [items]
+    seen, members = set(), []
+    for item in items:
+        for m in _expand(dim, hierarchy_id, item):
+            if m.id not in seen:
+                seen.add(m.id)
+                members.append(m)
+    if not members:
+        raise ValueError(f'el eje {dim.code} quedó sin miembros')
+    return CubeAxis(dim, hierarchy_id, members)
+
+
+def _contributions(axis: CubeAxis):
+    """
+    Subconsulta (ancestor_id, descendant_id, factor): qué miembros hoja
+    aportan a cada miembro del eje y con qué signo, desde la clausura.
+    Los miembros que no están en la jerarquía aportan solo a sí mismos.
+    """
+    c = HierarchyClosure
+    in_closure = set()
+    parts = []
+    if axis.hierarchy_id is not None:
+        in_closure = set(db.session.execute(
+            select(c.ancestor_id).where(c.hierarchy_id == axis.hierarchy_id, c.depth == 0,
+                                        c.ancestor_id.in_(axis.ids))
+        ).scalars().all())
+        if in_closure:
+            parts.append(
+                select(c.ancestor_id.label('ancestor_id'), c.descendant_id.label('descendant_id'),
+                       (c.sign * c.primary_paths).label('factor'))
+                .where(c.hierarchy_id == axis.hierarchy_id, c.ancestor_id.in_(in_closure), c.sign != 0,
+                       c.primary_paths > 0))
+    for mid in axis.ids:
+        if mid not in in_closure:
+            parts.append(select(literal(mid).label('ancestor_id'), literal(mid).label('descendant_id'),
+                                literal(1).label('factor')))
+    q = parts[0] if len(parts) == 1 else union_all(*parts)
+    return q.subquery()
+
+
+class FormulaPlan:
+    """
+    Fórmulas de un eje: agrega al eje (ocultos, al final) los insumos que
+    no estaban y evalúa el DAG cacheado de la dimensión sobre los vectores
+    de la grilla, en orden topológico.
+    """
+
+    def __init__(self, axis: CubeAxis):
+        self.visible = len(axis.members)
+        self.graph = formula_cache.graph(axis.dim.id)
+        inputs, self.order = self.graph.plan(m.id for m in axis.members if is_formula(m))
+        present = {m.id for m in axis.members}
+        hidden = [mid for mid in inputs + self.order if mid not in present]
+        if hidden:
+            by_id = {m.id: m for m in Member.query.filter(Member.id.in_(hidden)).all()}
+            axis.members.extend(by_id[mid] for mid in hidden)
+
+    @classmethod
+    def for_axis(cls, axis: CubeAxis):
+        return cls(axis) if any(is_formula(m) for m in axis.members) else None
+
+    def apply_rows(self, grid: list, pos: dict) -> None:
+        n = len(grid[0]) if grid else 0
+        out = self.graph.evaluate(self.order, {mid: grid[i] for mid, i in pos.items()}, n)
+        for mid, vector in out.items():
+            grid[pos[mid]] = vector
+
+    def apply_columns(self, grid: list, pos: dict) -> None:
+        vectors = {mid: [row[j] for row in grid] for mid, j in pos.items()}
+        out = self.graph.evaluate(self.order, vectors, len(grid))
+        for mid, vector in out.items():
+            j = pos[mid]
+            for row, v in zip(grid, vector):
+                row[j] = v
+
+
+def _aggregate(conds: list, group_axes: list[CubeAxis], filter_axes: list[CubeAxis],
+               extra=()) -> list:
+    """
+    SELECT ... GROUP BY sobre hecho_financiero unido a la clausura de cada
+    eje. Filas: (ancestro de cada eje de group_axes..., moneda, *extra, total).
+    """
+    t = HechoFinanciero.__table__
+    src, factor = t, 1
+    subs = []
+    for axis in [*group_axes, *filter_axes]:
+        sub = _contributions(axis)
+        src = src.join(sub, sub.c.descendant_id == t.c[axis.column])
+        factor = factor * sub.c.factor
+        subs.append(sub)
+    keys = [sub.c.ancestor_id for sub in subs[:len(group_axes)]] + [t.c.moneda, *extra]
+    stmt = (select(*keys, func.sum(t.c.monto_minor * factor))
+            .select_from(src).where(*conds).group_by(*keys))
+    return db.session.execute(stmt).all()
+
+
+def _scenario_scope(axes: list[CubeAxis]) -> frozenset | None:
+    """Escenarios hoja que aportan a la consulta (None = todos)."""
+    for axis in axes:
+        if axis.dim.code != 'SCENARIO':
+            continue
+        ids = set(axis.ids)
+        if axis.hierarchy_id is not None:
+            c = HierarchyClosure
+            ids |= set(db.session.execute(
+                select(c.descendant_id).where(c.hierarchy_id == axis.hierarchy_id,
+                                              c.ancestor_id.in_(axis.ids))
+            ).scalars().all())
+        return frozenset(ids)
+    return None
+
+
+def _time_prefix(usuario_id: int, moneda: str | None, conds: list, out_axes: list[CubeAxis],
+                 pov_axes: list[CubeAxis], año: int, fx: Converter | None = None) -> dict:
+    """
+    Sumas prefijas mensuales de un año {(moneda, *ids de out_axes): [13]},
+    desde un GROUP BY por mes hoja; cacheadas por usuario, escenarios, ejes,
+    pov y conversión (con `fx` los meses se convierten antes de acumular).
+    Retorna (sumas, grupos sin tasa).
+    """
+    key = (usuario_id, _scenario_scope(out_axes + pov_axes), 'cube', moneda,
+           tuple((a.dim.id, a.hierarchy_id, tuple(a.ids)) for a in out_axes),
+           tuple((a.dim.id, a.hierarchy_id, a.ids[0]) for a in pov_axes), año,
+           fx.signature if fx else None)
+
+    def build():
+        times = resolve_member_codes('TIME', [time_code(año, m) for m in range(1, 13)])
+        month_of = {tid: int(code[-2:]) for code, tid in times.items()}
+        monthly = defaultdict(lambda: [0] * 12)
+        missing = set(fx.missing) if fx else set()
+        if month_of:
+            t = HechoFinanciero.__table__
+            n = len(out_axes)
+            rows = _aggregate(conds + [t.c.time_id.in_(list(month_of))], out_axes, pov_axes,
+                              extra=[t.c.time_id])
+            if fx:
+                fx.preload(month_of)
+            for row in rows:
+                cur, time_id, total = row[n], row[n + 1], int(row[n + 2] or 0)
+                if fx:
+                    total = fx.convert(total, cur, time_id)
+                    if total is None:
+                        continue
+                    cur = fx.destino
+                monthly[(cur, *row[:n])][month_of[time_id] - 1] += total
+        sin_tasa = frozenset(fx.missing - missing) if fx else frozenset()
+        return {k: prefix_sums(v) for k, v in monthly.items()}, sin_tasa
+
+    return prefix_cache.get_or_build(key, build, current_generation(PREFIX_GENERATION))
+
+
+def _dynamic_values(member: DynamicTimeMember, usuario_id: int, moneda: str | None, conds: list,
+                    out_axes: list[CubeAxis], pov_axes: list[CubeAxis],
+                    fx: Converter | None = None) -> dict:
+    """{(moneda, *ids de out_axes): total} de un miembro dinámico, en O(1) por celda."""
+    prefix = {}
+    for y in years_needed(member.fn, member.año):
+        prefix[y], sin_tasa = _time_prefix(usuario_id, moneda, conds, out_axes, pov_axes, y, fx)
+        if fx:
+            fx.missing |= sin_tasa
+    cur, prev = prefix[member.año], prefix.get(member.año - 1, {})
+    empty = [0] * 13
+    return {k: window(member.fn, member.mes, cur.get(k, empty), prev.get(k))
+            for k in cur.keys() | prev.keys()}
+
+
+def run_query(pov: dict, rows: dict, columns: dict) -> dict:
+    """
+    Consulta de cubo: punto de vista (usuario_id, moneda y un miembro por
+    dimensión, que puede ser consolidado) más ejes de filas y columnas.
+    Con pov.moneda_reporte (y pov.tipo_cambio, promedio por defecto) todo
+    se convierte a esa moneda con la tasa del período de cada hecho.
+    Los miembros almacenados se resuelven en un único SELECT ... GROUP BY
+    sobre hecho_financiero unido a la clausura de cada dimensión; los
+    miembros TIME dinámicos (YTD/QTD/R12), desde sumas prefijas mensuales.
+    Los miembros fórmula se calculan al final sobre filas (o columnas)
+    completas de la grilla; con fórmulas en ambos ejes, las de columnas
+    se aplican sobre el resultado de las de filas.
+    Retorna los ejes y una grilla por moneda (None = sin datos).
+    """
+    pov = dict(pov or {})
+    if not pov.get('usuario_id'):
+        raise ValueError('pov.usuario_id es requerido')
+    row_axis, col_axis = build_axis(rows), build_axis(columns)
+    if row_axis.dim.id == col_axis.dim.id:
+        raise ValueError('filas y columnas deben ser dimensiones distintas')
+    row_plan, col_plan = FormulaPlan.for_axis(row_axis), FormulaPlan.for_axis(col_axis)
+
+    t = HechoFinanciero.__table__
+    usuario_id = int(pov.pop('usuario_id'))
+    conds = [t.c.usuario_id == usuario_id]
+    moneda = (pov.pop('moneda', None) or '').strip() or None
+    if moneda:
+        conds.append(t.c.moneda == moneda)
+    destino = (pov.pop('moneda_reporte', None) or '').strip()
+    tipo_cambio = pov.pop('tipo_cambio', None)
+    fx = Converter(destino, tipo_cambio) if destino else None
+
+    pov_axes, pov_time = [], None
+    for dim_code, mem_code in pov.items():
+        dim = _dimension(dim_code)
+        if dim.id in (row_axis.dim.id, col_axis.dim.id):
+            raise ValueError(f'{dim.code} ya está en filas o columnas')
+        dyn = parse_dynamic(mem_code) if dim.code == 'TIME' else None
+        if dyn:
+            pov_time = DynamicTimeMember(*dyn)
+            continue
+        member = _member(dim, mem_code)
+        if is_formula(member):
+            raise ValueError(f'{member.code} es un miembro fórmula: úsalo en filas o columnas')
+        pov_axes.append(CubeAxis(dim, _hierarchy_id(dim, None), [member]))
+
+    r_pos = {m.id: i for i, m in enumerate(row_axis.members)}
+    c_pos = {m.id: i for i, m in enumerate(col_axis.members)}
+    grids = defaultdict(lambda: [[None] * len(c_pos) for _ in r_pos])
+
+    def put(cur, r_id, c_id, total):
+        grids[cur][r_pos[r_id]][c_pos[c_id]] = from_minor_units(total, cur)
+
+    if pov_time:
+        # todo el cubo es un acumulado: sumas prefijas por (fila, columna)
+        values = _dynamic_values(pov_time, usuario_id, moneda, conds, [row_axis, col_axis],
+                                 pov_axes, fx)
+        for (cur, r_id, c_id), total in values.items():
+            put(cur, r_id, c_id, total)
+    else:
+        if row_axis.ids and col_axis.ids and fx:
+            # conversión: se agrupa además por período hoja y cada grupo usa su tasa
+            rows = _aggregate(conds, [row_axis, col_axis], pov_axes, extra=[t.c.time_id])
+            for (cur, r_id, c_id), total in fx.convert_rows(rows, 2).items():
+                put(cur, r_id, c_id, total)
+        elif row_axis.ids and col_axis.ids:
+            for r_id, c_id, cur, total in _aggregate(conds, [row_axis, col_axis], pov_axes):
+                put(cur, r_id, c_id, total)
+        for member in col_axis.dynamic:
+            values = _dynamic_values(member, usuario_id, moneda, conds, [row_axis], pov_axes, fx)
+            for (cur, r_id), total in values.items():
+                put(cur, r_id, member.id, total)
+        for member in row_axis.dynamic:
+            values = _dynamic_values(member, usuario_id, moneda, conds, [col_axis], pov_axes, fx)
+            for (cur, c_id), total in values.items():
+                put(cur, member.id, c_id, total)
+
+    for grid in grids.values():
+        if row_plan:
+            row_plan.apply_rows(grid, r_pos)
+        if col_plan:
+            col_plan.apply_columns(grid, c_pos)
+    # fuera los insumos ocultos de las fórmulas
+    n_rows = row_plan.visible if row_plan else len(r_pos)
+    n_cols = col_plan.visible if col_plan else len(c_pos)
+    for cur, grid in grids.items():
+        grids[cur] = [row[:n_cols] for row in grid[:n_rows]]
+    del row_axis.members[n_rows:], col_axis.members[n_cols:]
+
+    def members(axis):
+        return [{'id': m.id, 'code': m.code, 'name': m.name} for m in axis.members]
+
+    result = {
+        'rows': {'dimension': row_axis.dim.code, 'members': members(row_axis)},
+        'columns': {'dimension': col_axis.dim.code, 'members': members(col_axis)},
+        'monedas': dict(grids),
+    }
+    if fx:
+        result['moneda_reporte'] = fx.destino
+        result['sin_tasa'] = fx.missing_report()
+    return result
@@ -0,0 +1,114 @@
+import time
+from flask import Blueprint, request, jsonify
+from app.dimensions.services import DimensionError
+from app.cube.query import run_query
+
+cube_bp = Blueprint('cube', __name__, url_prefix='/api')
+
+@cube_bp.post('/cube/query')
+def cube_query():
+    """
+    Consulta multidimensional en una sola agregación.
+    Cuerpo:
+      {"pov": {"usuario_id": 1, "moneda": "CLP", "SCENARIO": "ACTUAL"},
+       "rows": {"dimension": "ACCOUNT", "members": ["descendants(NET)"]},
+       "columns": {"dimension": "TIME", "members": ["level0(2025)"]}}
+    Conjuntos: "CODE", "children(X)", "descendants(X)", "idescendants(X)", "level0(X)".
+    TIME acepta además miembros dinámicos "YTD(2025M05)", "QTD(2025M05)" y
+    "R12(2025M05)", en un eje o en el pov. Con pov.moneda_reporte (y
+    pov.tipo_cambio) la grilla se convierte a esa moneda.
+    """
+    t0 = time.perf_counter()
+    data = request.get_json(silent=True) or {}
+    try:
+        result = run_query(data.get('pov'), data.get('rows'), data.get('columns'))
+    except DimensionError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 404 if 'no existe' in str(e) else 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify({
+        'ok': True,
+        **result,
+        'monedas': {(cur or ''): [[None if v is None else str(v) for v in row] for row in grid]
+                    for cur, grid in result['monedas'].items()},
+        'ms': round((time.perf_counter() - t0) * 1000, 2),
+    })
+
+@cube_bp.get('/cube/pivot')
+def budget_actual_pivot():
+    """
+    Grilla presupuesto vs real por mes para un usuario y año.
+    Parámetros: usuario_id, año, presupuesto (escenario, AOP), real
+    (escenario, ACTUAL), filas=categoria|account, moneda,
+    vista=mes|ytd|qtd|r12 (acumulado a cada mes) y moneda_reporte /
+    tipo_cambio=promedio|cierre (conversión con la tasa de cada mes).
+    """
+    from app.facts.pivot import budget_actual_grid, BUDGET_SCENARIO, ACTUAL_SCENARIO
+    t0 = time.perf_counter()
+    args = request.args
+    try:
+        grid = budget_actual_grid(
+            int(args['usuario_id']), int(args['año']),
+            budget=args.get('presupuesto') or BUDGET_SCENARIO,
+            actual=args.get('real') or ACTUAL_SCENARIO,
+            rows=(args.get('filas') or 'categoria').lower(),
+            moneda=(args.get('moneda') or '').strip() or None,
+            vista=(args.get('vista') or 'mes').lower(),
+            moneda_reporte=(args.get('moneda_reporte') or '').strip() or None,
+            tipo_cambio=args.get('tipo_cambio'),
+        )
+    except KeyError as e:
+        return jsonify({'ok': False, 'error': f'falta campo requerido: {e}'}), 400
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    def fmt(values):
+        return [str(v) for v in values]
+
+    for fila in grid['filas']:
+        for k in ('presupuesto', 'real', 'variacion'):
+            fila[k] = fmt(fila[k])
+        for k in ('total_presupuesto', 'total_real', 'total_variacion'):
+            fila[k] = str(fila[k])
+    return jsonify({'ok': True, **grid, 'ms': round((time.perf_counter() - t0) * 1000, 2)})
+
+@cube_bp.get('/cube/variance')
+def scenario_variance():
+    """
+    Comparación de escenarios (variación absoluta y %, favorable según el
+    tipo de categoría y alertas por umbral).
+    Parámetros: usuario_id, año, base (AOP), comparar (ACTUAL), meses
+    (lista separada por coma, por defecto el año), nivel=interseccion|categoria|account,
+    moneda, umbral_abs, umbral_pct (coma decimal) y solo_alertas=1.
+    """
+    from app.dimensions.utils import parse_decimal_comma
+    from app.facts.pivot import BUDGET_SCENARIO, ACTUAL_SCENARIO
+    from app.facts.variance import compare_scenarios
+    t0 = time.perf_counter()
+    args = request.args
+    try:
+        meses = [int(m) for m in (args.get('meses') or '').split(',') if m.strip()]
+        result = compare_scenarios(
+            int(args['usuario_id']), args.get('base') or BUDGET_SCENARIO,
+            args.get('comparar') or ACTUAL_SCENARIO, int(args['año']), meses,
+            nivel=(args.get('nivel') or 'interseccion').lower(),
+            moneda=(args.get('moneda') or '').strip() or None,
+            umbral_abs=parse_decimal_comma(args['umbral_abs']) if args.get('umbral_abs') else None,
+            umbral_pct=parse_decimal_comma(args['umbral_pct']) if args.get('umbral_pct') else None,
+            solo_alertas=args.get('solo_alertas') in ('1', 'true', 'si'),
+        )
+    except KeyError as e:
+        return jsonify({'ok': False, 'error': f'falta campo requerido: {e}'}), 400
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    def fmt(v):
+        return None if v is None else str(v)
+
+    for fila in result['filas']:
+        for k in ('base', 'comparado', 'variacion', 'variacion_pct'):
+            fila[k] = fmt(fila[k])
+    for tot in result['resumen']['totales'].values():
+        for k in tot:
+            tot[k] = fmt(tot[k])
+    return jsonify({'ok': True, **result, 'ms': round((time.perf_counter() - t0) * 1000, 2)})
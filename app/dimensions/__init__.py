@@ -20,3 +20,110 @@ def init_app(app):
         from .seed import seed_dimensions
         seed_dimensions()
         click.echo("Seed OK")
+
+    # Comando CLI para carga masiva de hechos (CSV / NDJSON)
+    @app.cli.command("load-facts")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None,
+                  help="Formato del archivo (por defecto según extensión).")
+    @click.option("--chunk-size", default=5000, show_default=True, help="Filas por commit.")
+    @click.option("--usuario-id", type=int, default=None, help="usuario_id para filas que no lo traen.")
+    @click.option("--upsert", is_flag=True, help="Actualiza por intersección en vez de solo insertar.")
+    @with_appcontext
+    def load_facts_cmd(path, fmt, chunk_size, usuario_id, upsert):
+        """Carga hechos financieros desde un archivo, por bloques y en streaming."""
+        from app.facts.loader import load_facts_file
+        res = load_facts_file(path, fmt=fmt, chunk_size=chunk_size,
+                              usuario_id=usuario_id, upsert=upsert, echo=click.echo)
+        for err in res['errores']:
+            click.echo(f"  fila {err['fila']}: {err['error']}", err=True)
+        click.echo(f"Leídas {res['leidas']} · insertadas {res['insertadas']} · "
+                   f"actualizadas {res['actualizadas']} · sin cambios {res['sin_cambios']} · "
+                   f"con error {res['con_error']} · {res['segundos']} s · "
+                   f"{res['filas_por_segundo']} filas/s")
+
+    # Comando CLI para reconstruir la clausura de jerarquías
+    @app.cli.command("rebuild-closure")
+    @click.option("--hierarchy-id", type=int, default=None, help="Solo esta jerarquía (por defecto todas).")
+    @with_appcontext
+    def rebuild_closure_cmd(hierarchy_id):
+        """Recalcula hierarchy_closure desde hierarchy_edges."""
+        from app.extensions import db
+        from .closure import rebuild_closure
+        from .services import DimensionError
+        try:
+            n = rebuild_closure(hierarchy_id)
+        except DimensionError as e:
+            raise click.ClickException(str(e))
+        db.session.commit()
+        click.echo(f"Clausura OK: {n} filas")
+
+    # Comando CLI para recalcular las celdas agregadas materializadas
+    @app.cli.command("refresh-agg")
+    @with_appcontext
+    def refresh_agg_cmd():
+        """Recalcula todas las filas de agg_cell desde hecho_financiero."""
+        import time
+        from app.extensions import db
+        from app.facts.aggregates import refresh_cells
+        t0 = time.perf_counter()
+        n = refresh_cells()
+        db.session.commit()
+        click.echo(f"Celdas OK: {n} recalculadas en {time.perf_counter() - t0:.3f} s")
+
+    # Modo incremental de agregados (triggers sobre hecho_financiero)
+    @app.cli.command("agg-incremental")
+    @click.argument("estado", type=click.Choice(["on", "off", "status"]))
+    @with_appcontext
+    def agg_incremental_cmd(estado):
+        """Activa/desactiva la propagación de deltas a agg_balance."""
+        import time
+        from app.extensions import db
+        from app.facts import balances
+        if estado == "status":
+            click.echo("Modo incremental: " + ("activo" if balances.is_enabled() else "inactivo"))
+            return
+        t0 = time.perf_counter()
+        balances.enable() if estado == "on" else balances.disable()
+        db.session.commit()
+        click.echo(f"Modo incremental {estado} ({time.perf_counter() - t0:.3f} s)")
+
+    @app.cli.command("verify-agg")
+    @with_appcontext
+    def verify_agg_cmd():
+        """Compara agg_balance (incremental) contra un recálculo completo."""
+        import time
+        from app.facts import balances
+        if not balances.is_enabled():
+            raise click.ClickException("el modo incremental no está activo (flask agg-incremental on)")
+        t0 = time.perf_counter()
+        res = balances.verify_balances()
+        for d in res['ejemplos']:
+            click.echo(f"  {d}", err=True)
+        click.echo(f"Saldos: {res['filas']} filas · {res['diferencias']} diferencias · "
+                   f"{time.perf_counter() - t0:.3f} s")
+        if res['diferencias']:
+            raise SystemExit(1)
+
+    # Consolidación ENTITY en paralelo (subárboles en procesos)
+    @app.cli.command("consolidate")
+    @click.option("--workers", default=1, show_default=True, help="Procesos (1 = en el proceso actual).")
+    @click.option("--usuario-id", type=int, default=None, help="Solo los hechos de este usuario.")
+    @click.option("--scenario", default=None, help="Código SCENARIO (por defecto todos).")
+    @click.option("--moneda", default=None, help="Solo esta moneda.")
+    @click.option("--verificar", is_flag=True, help="Compara contra la consolidación SQL por la clausura.")
+    @with_appcontext
+    def consolidate_cmd(workers, usuario_id, scenario, moneda, verificar):
+        """Consolida la jerarquía ENTITY partiéndola en subárboles independientes."""
+        from .consolidate import consolidate_entities, verify_consolidation
+        res = consolidate_entities(workers=workers, usuario_id=usuario_id,
+                                   scenario_code=scenario, moneda=moneda)
+        claves = sum(len(v) for v in res['valores'].values())
+        click.echo(f"Consolidación: {len(res['valores'])} entidades · {claves} claves · "
+                   f"{res['particiones']} particiones · {res['superiores']} superiores · "
+                   f"{workers} workers · {res['segundos']} s")
+        if verificar:
+            diferencias = verify_consolidation(res)
+            click.echo(f"Verificación: {diferencias} entidades con diferencias")
+            if diferencias:
+                raise SystemExit(1)
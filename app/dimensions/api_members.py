@@ -2,6 +2,10 @@
 from flask import Blueprint, request, jsonify
 from app.extensions import db
 from app.dimensions.models import Member, HierarchyEdge  # ajusta si tus nombres difieren
+from app.dimensions.utils import member_resolver
+from app.dimensions.closure import rebuild_for_member
+from app.dimensions.services import DimensionError
+from app.dimensions.formulas import FormulaError, validate_formula
 from sqlalchemy import text, bindparam
 
 
@@ -17,6 +21,8 @@ def get_member(member_id: int):
         "code": m.code,
         "name": m.name,
         "agg_op": m.agg_op,
+        "data_type": m.data_type,
+        "formula": m.formula,
         "is_active": m.is_active
     })
 
@@ -24,11 +30,31 @@ def get_member(member_id: int):
 def update_member(member_id: int):
     m = Member.query.get_or_404(member_id)
     data = request.get_json(silent=True) or {}
+    old_agg_op = m.agg_op
     # Solo campos permitidos
     for field in ("name", "agg_op", "is_active"):
         if field in data:
             setattr(m, field, data[field])
+    if "data_type" in data or "formula" in data:
+        if "data_type" in data:
+            m.data_type = (data["data_type"] or "").strip() or None
+        try:
+            # al dejar de ser fórmula sin enviar formula, se descarta la anterior
+            previa = m.formula if m.data_type == "formula" else None
+            m.formula = validate_formula(m, data.get("formula", previa))
+        except FormulaError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+    if m.agg_op != old_agg_op:
+        # el agg_op entra en el signo de los caminos de la clausura
+        db.session.flush()
+        try:
+            rebuild_for_member(m.id)
+        except DimensionError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 409
     db.session.commit()
+    member_resolver.invalidate(m.dimension.code, m.code)
     return jsonify({"status": "ok"})
 
 @api_members_bp.delete("/api/members/<int:member_id>")
@@ -60,8 +86,10 @@ def delete_member(member_id: int):
             )
         }), 400
 
+    dim_code, code = m.dimension.code, m.code
     db.session.delete(m)
     db.session.commit()
+    member_resolver.invalidate(dim_code, code)
     current_app.logger.info(f"[members.delete] OK: eliminado member_id=%s", member_id)
     return jsonify({"status": "ok"})
 @api_members_bp.get("/api/members/usage")
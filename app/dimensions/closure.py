@@ -0,0 +1,274 @@
+from sqlalchemy import text, select, func
+from app.extensions import db
+from .models import HierarchyClosure, HierarchyEdge, Member
+from .services import DimensionError, edge_factor, has_cycle
+
+_SIGN_SQL = "CASE trim(ifnull({}, '+')) WHEN '-' THEN -1 WHEN '~' THEN 0 ELSE 1 END"
+
+# Todos los caminos de las jerarquías (o de una, con :h) en un solo
+# WITH RECURSIVE; `paths` cuenta caminos repetidos (miembros compartidos)
+# y `primary_paths` los que solo recorren vínculos primarios. Cada paso
+# busca los padres por ix_edge_child (sin él la recursión es cuadrática).
+# Sin tope fijo de profundidad: :max_depth es la cantidad de vínculos (un
+# camino sin ciclos no puede ser más largo) y rebuild_closure rechaza
+# antes las jerarquías con ciclos.
+REBUILD_SQL = text(f"""
+    WITH RECURSIVE
+    nodes(hierarchy_id, member_id) AS (
+        SELECT hierarchy_id, child_member_id FROM hierarchy_edges
+         WHERE :h IS NULL OR hierarchy_id = :h
+        UNION
+        SELECT hierarchy_id, parent_member_id FROM hierarchy_edges
+         WHERE parent_member_id IS NOT NULL AND (:h IS NULL OR hierarchy_id = :h)
+    ),
+    walk(hierarchy_id, ancestor_id, descendant_id, depth, sign, prim) AS (
+        SELECT hierarchy_id, member_id, member_id, 0, 1, 1 FROM nodes
+        UNION ALL
+        SELECT w.hierarchy_id, e.parent_member_id, w.descendant_id, w.depth + 1,
+               w.sign * {_SIGN_SQL.format('e.unary_op')} * {_SIGN_SQL.format('m.agg_op')},
+               w.prim * (CASE WHEN e.is_primary THEN 1 ELSE 0 END)
+          FROM walk w
+          JOIN hierarchy_edges e
+            ON e.hierarchy_id = w.hierarchy_id AND e.child_member_id = w.ancestor_id
+          JOIN members m ON m.id = e.child_member_id
+         WHERE e.parent_member_id IS NOT NULL AND w.depth < :max_depth
+    )
+    INSERT INTO hierarchy_closure (hierarchy_id, ancestor_id, descendant_id, depth, sign, paths,
+                                   primary_paths)
+    SELECT hierarchy_id, ancestor_id, descendant_id, depth, sign, COUNT(*), SUM(prim)
+      FROM walk
+     GROUP BY hierarchy_id, ancestor_id, descendant_id, depth, sign
+""")
+
+_SELF_SQL = text("""
+    INSERT INTO hierarchy_closure (hierarchy_id, ancestor_id, descendant_id, depth, sign, paths,
+                                   primary_paths)
+    VALUES (:h, :m, :m, 0, 1, 1, 1)
+    ON CONFLICT DO NOTHING
+""")
+
+# Caminos nuevos al agregar parent -> child: (ancestros de parent) x
+# (descendientes de child), incluidas las filas propias de ambos. Son
+# primarios solo si el vínculo lo es (:prim) y ambos tramos también.
+_CROSS_SQL = """
+    SELECT a.ancestor_id AS ancestor_id, d.descendant_id AS descendant_id,
+           a.depth + d.depth + 1 AS depth, a.sign * :f * d.sign AS sign,
+           SUM(a.paths * d.paths) AS n, :prim * SUM(a.primary_paths * d.primary_paths) AS np
+      FROM hierarchy_closure a
+      JOIN hierarchy_closure d ON d.hierarchy_id = :h AND d.ancestor_id = :c
+     WHERE a.hierarchy_id = :h AND a.descendant_id = :p
+     GROUP BY 1, 2, 3, 4
+"""
+
+_ADD_SQL = text(f"""
+    INSERT INTO hierarchy_closure (hierarchy_id, ancestor_id, descendant_id, depth, sign, paths,
+                                   primary_paths)
+    SELECT :h, ancestor_id, descendant_id, depth, sign, n, np FROM ({_CROSS_SQL}) WHERE true
+    ON CONFLICT (hierarchy_id, ancestor_id, descendant_id, depth, sign)
+    DO UPDATE SET paths = paths + excluded.paths,
+                  primary_paths = primary_paths + excluded.primary_paths
+""")
+
+_REMOVE_SQL = text(f"""
+    UPDATE hierarchy_closure AS c SET paths = c.paths - x.n, primary_paths = c.primary_paths - x.np
+      FROM ({_CROSS_SQL}) AS x
+     WHERE c.hierarchy_id = :h AND c.ancestor_id = x.ancestor_id
+       AND c.descendant_id = x.descendant_id AND c.depth = x.depth AND c.sign = x.sign
+""")
+
+# Filas propias de miembros que ya no participan en ningún vínculo
+_ORPHANS_SQL = text("""
+    DELETE FROM hierarchy_closure
+     WHERE hierarchy_id = :h AND depth = 0 AND ancestor_id IN (:p, :c)
+       AND NOT EXISTS (
+           SELECT 1 FROM hierarchy_edges e
+            WHERE e.hierarchy_id = :h
+              AND (e.child_member_id = hierarchy_closure.ancestor_id
+                   OR e.parent_member_id = hierarchy_closure.ancestor_id))
+""")
+
+
+def _invalidate_cells(hierarchy_id: int, member_ids=None):
+    # las celdas agregadas de esos miembros (y sus ancestros) cambian
+    from app.facts.aggregates import invalidate_hierarchy
+    invalidate_hierarchy(hierarchy_id, member_ids)
+
+
+def closure_add_edge(hierarchy_id: int, parent_id: int | None, child_id: int, factor: int,
+                     primary: bool = True):
+    """
+    Incorpora el vínculo parent -> child (ya agregado a la sesión) a la
+    clausura. No hace commit.
+    """
+    db.session.execute(_SELF_SQL, {'h': hierarchy_id, 'm': child_id})
+    if parent_id is None:
+        return
+    db.session.execute(_SELF_SQL, {'h': hierarchy_id, 'm': parent_id})
+    db.session.execute(_ADD_SQL, {'h': hierarchy_id, 'p': parent_id, 'c': child_id, 'f': factor,
+                                  'prim': int(bool(primary))})
+    _invalidate_cells(hierarchy_id, [parent_id])
+
+
+def closure_remove_edge(hierarchy_id: int, parent_id: int | None, child_id: int, factor: int,
+                        primary: bool = True):
+    """
+    Quita de la clausura los caminos que pasaban por parent -> child.
+    Debe llamarse con el vínculo ya borrado (flush). No hace commit.
+    """
+    params = {'h': hierarchy_id, 'p': parent_id, 'c': child_id, 'f': factor,
+              'prim': int(bool(primary))}
+    if parent_id is not None:
+        db.session.execute(_REMOVE_SQL, params)
+        db.session.execute(
+            text("DELETE FROM hierarchy_closure WHERE hierarchy_id = :h AND paths <= 0"), params)
+        _invalidate_cells(hierarchy_id, [parent_id])
+    db.session.execute(_ORPHANS_SQL, params)
+
+
+def closure_set_primary(hierarchy_id: int, parent_id: int, child_id: int, factor: int,
+                        primary: bool):
+    """
+    Cambia el vínculo parent -> child entre primario y referencia (ya
+    actualizado en la sesión): sus caminos se quitan con el estado
+    anterior y se vuelven a agregar con el nuevo. No hace commit.
+    """
+    params = {'h': hierarchy_id, 'p': parent_id, 'c': child_id, 'f': factor}
+    db.session.execute(_REMOVE_SQL, {**params, 'prim': int(not primary)})
+    db.session.execute(_ADD_SQL, {**params, 'prim': int(bool(primary))})
+    _invalidate_cells(hierarchy_id, [parent_id])
+
+
+def sync_shared_flag(member_id: int) -> None:
+    """Member.is_shared refleja si el miembro tiene vínculos de referencia."""
+    m = db.session.get(Member, member_id)
+    if m is None:
+        return
+    m.is_shared = db.session.execute(
+        select(HierarchyEdge.id).where(HierarchyEdge.child_member_id == member_id,
+                                       HierarchyEdge.parent_member_id.is_not(None),
+                                       HierarchyEdge.is_primary.is_(False)).limit(1)
+    ).first() is not None
+
+
+def set_primary_edge(edge: HierarchyEdge) -> HierarchyEdge | None:
+    """
+    Hace primario `edge` y pasa a referencia el vínculo primario anterior
+    de su hijo en la jerarquía (si había). No hace commit. Retorna el anterior.
+    """
+    if edge.is_primary or edge.parent_member_id is None:
+        return None
+    prev = HierarchyEdge.query.filter(
+        HierarchyEdge.hierarchy_id == edge.hierarchy_id,
+        HierarchyEdge.child_member_id == edge.child_member_id,
+        HierarchyEdge.parent_member_id.is_not(None),
+        HierarchyEdge.is_primary.is_(True),
+        HierarchyEdge.id != edge.id,
+    ).first()
+    agg_op = edge.child.agg_op
+    for e, primary in ((prev, False), (edge, True)):
+        if e is None:
+            continue
+        e.is_primary = primary
+        db.session.flush()
+        closure_set_primary(e.hierarchy_id, e.parent_member_id, e.child_member_id,
+                            edge_factor(e.unary_op, agg_op), primary)
+    sync_shared_flag(edge.child_member_id)
+    return prev
+
+
+def rebuild_closure(hierarchy_id: int | None = None) -> int:
+    """
+    Recalcula desde hierarchy_edges la clausura de una jerarquía (o de
+    todas). No hace commit. Retorna las filas generadas. Lanza
+    DimensionError si alguna tiene ciclos (datos previos al chequeo de
+    create_edge): la clausura no se puede armar.
+    """
+    edges = select(HierarchyEdge.hierarchy_id, func.count())
+    if hierarchy_id is not None:
+        edges = edges.where(HierarchyEdge.hierarchy_id == hierarchy_id)
+    counts = dict(db.session.execute(edges.group_by(HierarchyEdge.hierarchy_id)).all())
+    cyclic = sorted(h for h in counts if has_cycle(h))
+    if cyclic:
+        raise DimensionError(f"jerarquía con ciclos, no se reconstruye la clausura: "
+                             f"{', '.join(map(str, cyclic))}")
+    q = HierarchyClosure.query
+    if hierarchy_id is not None:
+        q = q.filter_by(hierarchy_id=hierarchy_id)
+    q.delete(synchronize_session=False)
+    db.session.execute(REBUILD_SQL, {'h': hierarchy_id, 'max_depth': max(counts.values(), default=0)})
+    if hierarchy_id is None:
+        from app.facts.aggregates import invalidate_all
+        invalidate_all()
+    else:
+        _invalidate_cells(hierarchy_id)
+    return q.count()
+
+
+def rebuild_for_member(member_id: int) -> list[int]:
+    """
+    Recalcula las jerarquías donde el miembro cuelga de un padre (su
+    agg_op forma parte del signo de esos caminos). Retorna sus ids.
+    """
+    hier_ids = db.session.execute(
+        select(HierarchyEdge.hierarchy_id).distinct()
+        .where(HierarchyEdge.child_member_id == member_id,
+               HierarchyEdge.parent_member_id.is_not(None))
+    ).scalars().all()
+    for h in hier_ids:
+        rebuild_closure(h)
+    return hier_ids
+
+
+def descendants(hierarchy_id: int, member_id: int) -> list[tuple[int, int]]:
+    """Descendientes de un miembro como [(member_id, depth mínima)]."""
+    c = HierarchyClosure
+    return db.session.execute(
+        select(c.descendant_id, func.min(c.depth))
+        .where(c.hierarchy_id == hierarchy_id, c.ancestor_id == member_id, c.depth > 0)
+        .group_by(c.descendant_id).order_by(func.min(c.depth), c.descendant_id)
+    ).all()
+
+
+def ancestors(hierarchy_id: int, member_id: int) -> list[tuple[int, int]]:
+    """Ancestros de un miembro como [(member_id, depth mínima)]."""
+    c = HierarchyClosure
+    return db.session.execute(
+        select(c.ancestor_id, func.min(c.depth))
+        .where(c.hierarchy_id == hierarchy_id, c.descendant_id == member_id, c.depth > 0)
+        .group_by(c.ancestor_id).order_by(func.min(c.depth), c.ancestor_id)
+    ).all()
+
+
+def is_descendant(hierarchy_id: int, ancestor_id: int, member_id: int) -> bool:
+    """True si `member_id` está bajo `ancestor_id` en la jerarquía."""
+    c = HierarchyClosure
+    return db.session.execute(
+        select(c.id).where(c.hierarchy_id == hierarchy_id, c.ancestor_id == ancestor_id,
+                           c.descendant_id == member_id, c.depth > 0).limit(1)
+    ).first() is not None
+
+
+def creates_cycle(hierarchy_id: int, parent_id: int | None, child_id: int) -> bool:
+    """
+    True si agregar parent -> child cierra un ciclo: parent ya cuelga de
+    child. Una búsqueda por índice en la clausura, sin recorrer vínculos.
+    """
+    if parent_id is None:
+        return False
+    return parent_id == child_id or is_descendant(hierarchy_id, child_id, parent_id)
+
+
+def descendant_factors(hierarchy_id: int, member_id: int) -> dict[int, int]:
+    """
+    Coeficiente neto con que cada descendiente (y el propio miembro)
+    consolida en `member_id`: suma de sign * primary_paths. Los
+    descendientes que solo llegan por caminos ignorados ('~') o por
+    referencias a miembros compartidos quedan fuera.
+    """
+    c = HierarchyClosure
+    rows = db.session.execute(
+        select(c.descendant_id, func.sum(c.sign * c.primary_paths))
+        .where(c.hierarchy_id == hierarchy_id, c.ancestor_id == member_id)
+        .group_by(c.descendant_id)
+    ).all()
+    return {mid: int(f) for mid, f in rows if f}
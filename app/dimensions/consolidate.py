@@ -0,0 +1,193 @@
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+# Consolidación ENTITY en paralelo: el bosque de vínculos que aportan
+# (factor != 0; cada miembro tiene a lo sumo uno, el primario) se parte
+# en subárboles independientes. Cada subárbol se lee y consolida en un
+# proceso con su propia conexión SQLite de solo lectura; el proceso
+# principal suma los resultados en los padres de nivel superior.
+# Clave de los valores consolidados (el resto de dimensiones a nivel hoja):
+KEY_COLS = ('usuario_id', 'account_id', 'scenario_id', 'time_id', 'moneda')
+# Subárboles por worker: más particiones que procesos para repartir carga
+PARTITIONS_PER_WORKER = 4
+
+
+def partition_forest(edges: list[tuple], workers: int, members=()) -> tuple[list[dict], set, list[tuple]]:
+    """
+    edges: (padre, hijo, factor) de abajo hacia arriba (HierarchyGraph.edges);
+    members: miembros de la jerarquía (incluye raíces sin hijos).
+    Retorna (particiones [{'members', 'edges'}], miembros superiores,
+    aristas superiores de abajo hacia arriba). Se parte siempre el
+    subárbol más grande hasta tener workers * PARTITIONS_PER_WORKER.
+    """
+    children, parent_of, members = defaultdict(list), {}, set(members)
+    for parent, child, factor in edges:
+        members.update((parent, child))
+        if factor:
+            children[parent].append(child)
+            parent_of[child] = parent
+
+    def subtree(root):
+        out, stack = [], [root]
+        while stack:
+            m = stack.pop()
+            out.append(m)
+            stack.extend(children.get(m, ()))
+        return out
+
+    roots = sorted(m for m in members if m not in parent_of)
+    parts = {r: subtree(r) for r in roots}
+    top = set()
+    target = max(1, workers) * PARTITIONS_PER_WORKER
+    while len(parts) < target:
+        splittable = [r for r in parts if children.get(r)]
+        if not splittable:
+            break
+        r = max(splittable, key=lambda k: len(parts[k]))
+        del parts[r]
+        top.add(r)
+        for ch in children[r]:
+            parts[ch] = subtree(ch)
+
+    part_of = {m: r for r, ms in parts.items() for m in ms}
+    by_part = defaultdict(list)
+    top_edges = []
+    for parent, child, factor in edges:
+        if not factor:
+            continue
+        if parent in top:
+            top_edges.append((parent, child, factor))
+        else:
+            by_part[part_of[parent]].append((parent, child, factor))
+    partitions = [{'members': ms, 'edges': by_part.get(r, [])}
+                  for r, ms in sorted(parts.items(), key=lambda kv: -len(kv[1]))]
+    if top:
+        # hechos cargados directamente en los miembros superiores
+        partitions.append({'members': sorted(top), 'edges': []})
+    return partitions, top, top_edges
+
+
+def rollup_vectors(values: dict, edges: list[tuple]) -> dict:
+    """Suma {miembro: {clave: monto}} de hijos a padres en una pasada."""
+    for parent, child, factor in edges:
+        src = values.get(child)
+        if not src:
+            continue
+        dst = values.setdefault(parent, defaultdict(int))
+        for k, v in src.items():
+            dst[k] += factor * v
+    return values
+
+
+def consolidate_partition(task: tuple) -> dict:
+    """
+    Worker: (ruta de la base, WHERE extra, parámetros, miembros, aristas).
+    Lee los hechos del subárbol con una conexión de solo lectura y lo
+    consolida. Retorna {miembro: {clave: monto_minor}}.
+    """
+    db_path, where, params, members, edges = task
+    con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        con.execute('PRAGMA query_only = 1')
+        marks = ','.join('?' * len(members))
+        sql = (f"SELECT entity_id, {', '.join(KEY_COLS)}, SUM(monto_minor) FROM hecho_financiero "
+               f"WHERE entity_id IN ({marks}){' AND ' + where if where else ''} "
+               f"GROUP BY entity_id, {', '.join(KEY_COLS)}")
+        values = {}
+        for mid, *key, total in con.execute(sql, [*members, *params]):
+            values.setdefault(mid, defaultdict(int))[tuple(key)] += total or 0
+    finally:
+        con.close()
+    return {m: dict(v) for m, v in rollup_vectors(values, edges).items()}
+
+
+def consolidate(db_path: str, edges: list[tuple], where: str = '', params=(), workers: int = 1,
+                members=()) -> dict:
+    """
+    Consolida la jerarquía `edges` sobre hecho_financiero de `db_path`.
+    Con workers > 1 los subárboles corren en un ProcessPoolExecutor.
+    Retorna {'valores': {miembro: {clave: monto_minor}}, 'particiones',
+    'superiores', 'segundos'}.
+    """
+    t0 = time.perf_counter()
+    partitions, top, top_edges = partition_forest(edges, workers, members)
+    tasks = [(db_path, where, tuple(params), p['members'], p['edges']) for p in partitions]
+    values = {}
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial in pool.map(consolidate_partition, tasks):
+                values.update(partial)
+    else:
+        for task in tasks:
+            values.update(consolidate_partition(task))
+    # los superiores no se repiten entre particiones: se suman aquí
+    values = {m: defaultdict(int, v) for m, v in values.items()}
+    rollup_vectors(values, top_edges)
+    return {
+        'valores': {m: {k: v for k, v in vals.items() if v} for m, vals in values.items()},
+        'particiones': len(partitions),
+        'superiores': len(top),
+        'segundos': round(time.perf_counter() - t0, 4),
+    }
+
+
+def consolidate_entities(workers: int = 1, usuario_id: int | None = None,
+                         scenario_code: str | None = None, moneda: str | None = None) -> dict:
+    """
+    Consolida la jerarquía primaria de ENTITY de la base de la app.
+    Filtros opcionales: usuario_id, escenario (código) y moneda.
+    """
+    from app.extensions import db
+    from app.facts.aggregates import primary_hierarchies
+    from .rollup import load_hierarchy
+    from .services import DimensionError
+    from .utils import get_member_id
+
+    hierarchy_id = primary_hierarchies().get('entity_id')
+    if hierarchy_id is None:
+        raise DimensionError('ENTITY no tiene jerarquía primaria')
+    graph = load_hierarchy(hierarchy_id)
+    conds, params = [], []
+    if usuario_id is not None:
+        conds.append('usuario_id = ?')
+        params.append(int(usuario_id))
+    if scenario_code:
+        conds.append('scenario_id = ?')
+        params.append(get_member_id('SCENARIO', scenario_code))
+    if moneda:
+        conds.append('moneda = ?')
+        params.append(moneda)
+    db_path = db.engine.url.database
+    # los workers abren su conexión: soltar la transacción de lectura
+    db.session.rollback()
+    where = ' AND '.join(conds)
+    result = consolidate(db_path, graph.edges, where, params, workers, graph.members)
+    result.update(hierarchy_id=hierarchy_id, where=where, params=params)
+    return result
+
+
+def verify_consolidation(result: dict) -> int:
+    """
+    Miembros cuyos valores difieren de la consolidación SQL por la
+    clausura (sign * primary_paths) con los mismos filtros.
+    """
+    from app.extensions import db
+    where = ' AND '.join('h.' + c for c in result['where'].split(' AND ')) if result['where'] else ''
+    rows = db.session.connection().exec_driver_sql(f"""
+        SELECT c.ancestor_id, {', '.join('h.' + k for k in KEY_COLS)},
+               SUM(h.monto_minor * c.sign * c.primary_paths)
+        FROM hecho_financiero h
+        JOIN hierarchy_closure c ON c.descendant_id = h.entity_id
+         AND c.hierarchy_id = ? AND c.primary_paths > 0
+        {'WHERE ' + where if where else ''}
+        GROUP BY c.ancestor_id, {', '.join('h.' + k for k in KEY_COLS)}
+    """, (result['hierarchy_id'], *result['params'])).all()
+    values = result['valores']
+    expected = defaultdict(dict)
+    for mid, *key, total in rows:
+        if total:
+            expected[mid][tuple(key)] = total
+    members = set(expected) | set(values)
+    return sum(expected.get(m, {}) != values.get(m, {}) for m in members)
@@ -0,0 +1,295 @@
+import ast
+import re
+import threading
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app.extensions import db
+from .models import Dimension, Member
+
+# Miembros fórmula (data_type 'formula'): la expresión se parsea una vez
+# con `ast` (solo + - * / unarios, números y paréntesis) y referencia
+# otros miembros de la misma dimensión por código: REVENUE - COGS, o
+# [500100] - [500200] para códigos que no son identificadores. Las
+# fórmulas de una dimensión forman un DAG que se compila en orden
+# topológico y se cachea; se evalúa sobre vectores completos de celdas.
+
+FORMULA_TYPE = 'formula'
+_BRACKET = re.compile(r'\[([^\[\]]+)\]')
+_ASSIGN = re.compile(r'^\s*([^=]+?)\s*=(?!=)\s*(.+)$', re.S)
+_DIV_PLACES = Decimal('0.000001')
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def is_formula(member) -> bool:
+    return (getattr(member, 'data_type', None) or '').strip().lower() == FORMULA_TYPE
+
+
+def _add(a, b):
+    return a + b
+
+
+def _sub(a, b):
+    return a - b
+
+
+def _mul(a, b):
+    return a * b
+
+
+def _div(a, b):
+    if not b:
+        return None
+    q = (a / b).quantize(_DIV_PLACES)
+    return q.quantize(Decimal(1)) if q == q.to_integral_value() else q.normalize()
+
+
+_BINOPS = {ast.Add: _add, ast.Sub: _sub, ast.Mult: _mul, ast.Div: _div}
+
+
+class Formula:
+    """Expresión parseada: códigos referenciados y función vectorial."""
+
+    def __init__(self, text: str, code: str | None = None):
+        self.text = str(text or '').strip()
+        expr = self.text
+        m = _ASSIGN.match(expr)
+        if m:
+            # forma "GROSS_MARGIN = REVENUE - COGS": el lado izquierdo es el propio miembro
+            if code is not None and m.group(1).strip('[] ') != code:
+                raise FormulaError(f'la fórmula asigna a {m.group(1).strip()} y no a {code}')
+            expr = m.group(2)
+        if not expr.strip():
+            raise FormulaError('fórmula vacía')
+        names = {}
+
+        def bracket(match):
+            names[f'__m{len(names)}'] = match.group(1).strip()
+            return f'__m{len(names) - 1}'
+
+        try:
+            tree = ast.parse(_BRACKET.sub(bracket, expr), mode='eval')
+        except SyntaxError as e:
+            raise FormulaError(f'fórmula inválida: {e.msg}') from None
+        self.refs = set()
+        self._fn, _ = self._compile(tree.body, names)
+
+    def _compile(self, node, names):
+        """
+        Nodo ast -> (función(vectores, n) -> lista de n valores, es_constante).
+        None = sin dato; las constantes no convierten un "sin dato" en dato.
+        """
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            value = Decimal(str(node.value))
+            return (lambda env, n: [value] * n), True
+        if isinstance(node, ast.Name):
+            code = names.get(node.id, node.id)
+            self.refs.add(code)
+            return (lambda env, n: env.get(code) or [None] * n), False
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            inner, const = self._compile(node.operand, names)
+            if isinstance(node.op, ast.UAdd):
+                return inner, const
+            return (lambda env, n: [None if v is None else -v for v in inner(env, n)]), const
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+            op = _BINOPS[type(node.op)]
+            (left, lc), (right, rc) = self._compile(node.left, names), self._compile(node.right, names)
+
+            def binop(env, n):
+                # sin dato en los lados no constantes -> sin dato; en uno solo, cuenta como 0
+                return [None if (a is None or lc) and (b is None or rc) else op(a or 0, b or 0)
+                        for a, b in zip(left(env, n), right(env, n))]
+            if lc and rc:
+                return (lambda env, n: [op(a, b) for a, b in zip(left(env, n), right(env, n))]), True
+            return binop, False
+        what = type(getattr(node, 'op', node)).__name__
+        raise FormulaError(f'elemento no permitido en la fórmula: {what}')
+
+    def evaluate(self, env: dict, n: int) -> list:
+        try:
+            return self._fn(env, n)
+        except (InvalidOperation, ArithmeticError):
+            return [None] * n
+
+
+def topological_order(deps: dict, names: dict | None = None) -> list:
+    """Kahn sobre {nodo: dependencias}; lanza FormulaError si hay ciclo."""
+    pending = {k: {d for d in v if d in deps} for k, v in deps.items()}
+    users = {k: [] for k in deps}
+    for k, ds in pending.items():
+        for d in ds:
+            users[d].append(k)
+    ready = sorted(k for k, ds in pending.items() if not ds)
+    order = []
+    while ready:
+        k = ready.pop()
+        order.append(k)
+        for u in users[k]:
+            pending[u].discard(k)
+            if not pending[u]:
+                ready.append(u)
+    if len(order) < len(deps):
+        ciclo = sorted(str((names or {}).get(k, k)) for k in deps if k not in order)
+        raise FormulaError(f"ciclo entre fórmulas: {', '.join(ciclo)}")
+    return order
+
+
+class FormulaGraph:
+    """
+    DAG de fórmulas de una dimensión compilado: {member_id: Formula}, ids
+    de las referencias y orden topológico. Las referencias a códigos que
+    no existen se evalúan como sin dato.
+    """
+
+    def __init__(self, dimension_id: int, formulas: dict, code_to_id: dict):
+        self.dimension_id = dimension_id
+        self.formulas = formulas
+        self.code_to_id = code_to_id
+        self.codes = {mid: code for code, mid in code_to_id.items()}
+        self.deps = {mid: {code_to_id[c] for c in f.refs if c in code_to_id}
+                     for mid, f in formulas.items()}
+        self.order = topological_order(self.deps, self.codes)
+        self.referenced = {c for f in formulas.values() for c in f.refs}
+
+    def plan(self, member_ids) -> tuple[list[int], list[int]]:
+        """
+        Para las fórmulas `member_ids`: (miembros almacenados que hay que
+        leer, fórmulas a evaluar en orden topológico incluidas las intermedias).
+        """
+        needed, stack = set(), [mid for mid in member_ids if mid in self.formulas]
+        while stack:
+            mid = stack.pop()
+            if mid not in needed:
+                needed.add(mid)
+                stack.extend(d for d in self.deps[mid] if d in self.formulas)
+        inputs = sorted({d for mid in needed for d in self.deps[mid] if d not in self.formulas})
+        return inputs, [mid for mid in self.order if mid in needed]
+
+    def evaluate(self, order: list[int], vectors: dict, n: int) -> dict:
+        """
+        Evalúa `order` en una pasada: vectors {member_id: [n valores]} de
+        los insumos; cada fórmula queda disponible para las siguientes.
+        """
+        env = {self.codes[mid]: v for mid, v in vectors.items() if mid in self.codes}
+        out = {}
+        for mid in order:
+            out[mid] = env[self.codes[mid]] = self.formulas[mid].evaluate(env, n)
+        return out
+
+
+def build_graph(dimension_id: int, overrides: dict | None = None) -> FormulaGraph:
+    rows = db.session.execute(
+        select(Member.id, Member.code, Member.data_type, Member.formula)
+        .where(Member.dimension_id == dimension_id)).all()
+    code_to_id = {code: mid for mid, code, _, _ in rows}
+    formulas = {}
+    for mid, code, data_type, text in rows:
+        if (data_type or '').strip().lower() == FORMULA_TYPE and text:
+            formulas[mid] = Formula(text, code)
+    for mid, f in (overrides or {}).items():
+        if f is None:
+            formulas.pop(mid, None)
+        else:
+            formulas[mid] = f
+    return FormulaGraph(dimension_id, formulas, code_to_id)
+
+
+class FormulaCache:
+    """
+    Cache de proceso de FormulaGraph por dimensión. Se invalida al
+    cambiar un miembro fórmula o un miembro que alguna fórmula referencia.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def graph(self, dimension_id: int) -> FormulaGraph:
+        with self._lock:
+            g = self._data.get(dimension_id)
+            if g is not None:
+                self.hits += 1
+                return g
+        g = build_graph(dimension_id)
+        with self._lock:
+            self._data[dimension_id] = g
+            self.builds += 1
+        return g
+
+    def peek(self, dimension_id: int) -> FormulaGraph | None:
+        with self._lock:
+            return self._data.get(dimension_id)
+
+    def invalidate(self, dimension_ids=None) -> None:
+        with self._lock:
+            if dimension_ids is None:
+                self._data.clear()
+            else:
+                for d in dimension_ids:
+                    self._data.pop(d, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'dimensiones': len(self._data), 'hits': self.hits, 'builds': self.builds}
+
+
+formula_cache = FormulaCache()
+
+
+def validate_formula(member: Member, text: str | None) -> str | None:
+    """
+    Valida la fórmula de `member` (ya con id: referencias existentes en su
+    dimensión y sin ciclos con las demás fórmulas). Retorna el texto.
+    """
+    if not is_formula(member):
+        if text:
+            raise FormulaError("solo los miembros data_type 'formula' llevan fórmula")
+        return None
+    if not (text or '').strip():
+        raise FormulaError("los miembros 'formula' requieren formula")
+    f = Formula(text, member.code)
+    if member.code in f.refs:
+        raise FormulaError('la fórmula se referencia a sí misma')
+    g = build_graph(member.dimension_id, {member.id: f})
+    missing = sorted(c for c in f.refs if c not in g.code_to_id)
+    if missing:
+        raise FormulaError(f"member no existe en la dimensión: {', '.join(missing)}")
+    return f.text
+
+
+# ---------- invalidación ----------
+
+@event.listens_for(Session, 'after_flush')
+def _formula_members_flushed(session, flush_context):
+    dims = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Dimension) and obj in session.deleted:
+            dims.add(obj.id)
+        if not isinstance(obj, Member):
+            continue
+        g = formula_cache.peek(obj.dimension_id)
+        if g is None:
+            continue
+        if obj.id in g.formulas or is_formula(obj) or obj.code in g.referenced \
+                or obj.id in g.codes and g.codes[obj.id] in g.referenced:
+            dims.add(obj.dimension_id)
+    if dims:
+        session.info.setdefault('formula_pending', set()).update(dims)
+
+
+@event.listens_for(Session, 'after_commit')
+def _discard_formulas(session):
+    dims = session.info.pop('formula_pending', None)
+    if dims:
+        formula_cache.invalidate(dims)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_formulas(session):
+    session.info.pop('formula_pending', None)
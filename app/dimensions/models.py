@@ -25,6 +25,9 @@ class Member(db.Model, TimestampMixin):
     name = db.Column(db.String(256), nullable=False)
     agg_op = db.Column(db.String(2), default='+')
     data_type = db.Column(db.String(64))
+    # Expresión de los miembros data_type 'formula' (p. ej. REVENUE - COGS);
+    # se evalúa al consultar, ver formulas.py
+    formula = db.Column(db.Text)
     is_shared = db.Column(db.Boolean, default=False, nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     start_date = db.Column(db.Date)
@@ -42,6 +45,9 @@ class Hierarchy(db.Model, TimestampMixin):
     code = db.Column(db.String(64), nullable=False)
     name = db.Column(db.String(128), nullable=False)
     is_primary = db.Column(db.Boolean, default=True, nullable=False)
+    # Versión del árbol: sube con cada cambio de vínculos (o de código/nombre
+    # de sus miembros); es el ETag de GET /api/hierarchies/<id>/tree
+    version = db.Column(db.Integer, default=1, nullable=False, server_default='1')
 
     __table_args__ = (UniqueConstraint('dimension_id','code', name='uq_hier_dim_code'),)
 
@@ -55,11 +61,42 @@ class HierarchyEdge(db.Model, TimestampMixin):
     child_member_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
     order_nbr = db.Column(db.Integer, default=0, nullable=False)
     unary_op = db.Column(db.String(2), default='+')
+    # Vínculo primario del hijo: por él consolida su valor. Los demás
+    # vínculos del mismo hijo (miembro compartido) son solo referencias.
+    is_primary = db.Column(db.Boolean, default=True, nullable=False, server_default=db.true())
 
     parent = db.relationship('Member', foreign_keys=[parent_member_id], lazy='joined')
     child = db.relationship('Member', foreign_keys=[child_member_id], lazy='joined')
 
-    __table_args__ = (UniqueConstraint('hierarchy_id','parent_member_id','child_member_id', name='uq_edge_unique'),)
+    __table_args__ = (UniqueConstraint('hierarchy_id','parent_member_id','child_member_id', name='uq_edge_unique'),
+                      # padres de un hijo: clausura, ciclos y vínculos primarios
+                      db.Index('ix_edge_child', 'hierarchy_id', 'child_member_id'))
+
+class HierarchyClosure(db.Model):
+    """
+    Clausura transitiva de una jerarquía: una fila por camino
+    ancestro -> descendiente (incluye la fila propia con depth 0).
+    `sign` es el producto de los factores de consolidación del camino
+    (+1, -1 o 0) y `paths` cuántos caminos distintos comparten
+    (ancestro, descendiente, depth, sign). `primary_paths` cuenta los que
+    solo usan vínculos primarios: es el índice con que se consolida
+    (cada miembro suma una vez, por su camino primario). Se mantiene
+    desde create_edge y delete_edge (ver closure.py).
+    """
+    __tablename__ = 'hierarchy_closure'
+    id = db.Column(db.Integer, primary_key=True)
+    hierarchy_id = db.Column(db.Integer, db.ForeignKey('hierarchies.id'), nullable=False)
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+    sign = db.Column(db.Integer, nullable=False, default=1)
+    paths = db.Column(db.Integer, nullable=False, default=1)
+    primary_paths = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        UniqueConstraint('hierarchy_id', 'ancestor_id', 'descendant_id', 'depth', 'sign', name='uq_closure_path'),
+        db.Index('ix_closure_descendant', 'hierarchy_id', 'descendant_id', 'ancestor_id'),
+    )
 
 class MemberAlias(db.Model, TimestampMixin):
     __tablename__ = 'member_aliases'
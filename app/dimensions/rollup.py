@@ -0,0 +1,120 @@
+from collections import defaultdict
+from sqlalchemy import select, func
+from app.extensions import db
+from app.models import HechoFinanciero
+from app.facts.services import DIM_FIELDS, fact_filters
+from .models import Dimension, Hierarchy, HierarchyEdge, Member
+from .services import DimensionError, edge_factor
+from .utils import from_minor_units
+
+# dimension.code -> columna de hecho_financiero
+FACT_COLUMN = {dim_code: col for col, dim_code, _ in DIM_FIELDS}
+
+
+class HierarchyGraph:
+    """
+    Estructura de una jerarquía cargada en una sola consulta.
+    `edges` queda en orden topológico inverso (hijos antes que padres),
+    listo para acumular de las hojas hacia la raíz en una pasada. Los
+    vínculos de referencia (miembros compartidos) llevan factor 0: el
+    valor sube una sola vez, por el vínculo primario.
+    """
+
+    def __init__(self, hierarchy: Hierarchy, dim_code: str, rows):
+        self.hierarchy = hierarchy
+        self.dim_code = dim_code
+        self.members = {}
+        children = defaultdict(list)
+        parents_count = defaultdict(int)
+        for e_parent, e_child, unary_op, order_nbr, child_agg, is_primary in rows:
+            self.members.setdefault(e_child, None)
+            if e_parent is None:
+                continue
+            self.members.setdefault(e_parent, None)
+            factor = edge_factor(unary_op, child_agg) if is_primary else 0
+            children[e_parent].append((e_child, factor, order_nbr))
+            parents_count[e_child] += 1
+        self.children = dict(children)
+        self.edges = self._bottom_up_edges(children, parents_count)
+
+    def _bottom_up_edges(self, children, parents_count):
+        # Kahn iterativo desde las raíces; luego se invierte
+        pending = dict(parents_count)
+        stack = [m for m in self.members if not pending.get(m)]
+        order = []
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for child, _, _ in children.get(node, ()):
+                pending[child] -= 1
+                if pending[child] == 0:
+                    stack.append(child)
+        if len(order) != len(self.members):
+            raise DimensionError(f'la jerarquía {self.hierarchy.id} tiene ciclos')
+        return [(parent, child, factor)
+                for parent in reversed(order)
+                for child, factor, _ in children.get(parent, ())]
+
+
+def load_hierarchy(hierarchy_id: int) -> HierarchyGraph:
+    h = db.session.get(Hierarchy, hierarchy_id)
+    if not h:
+        raise DimensionError('hierarchy no existe')
+    dim_code = db.session.get(Dimension, h.dimension_id).code
+    child = db.aliased(Member)
+    rows = db.session.execute(
+        select(HierarchyEdge.parent_member_id, HierarchyEdge.child_member_id,
+               HierarchyEdge.unary_op, HierarchyEdge.order_nbr, child.agg_op,
+               HierarchyEdge.is_primary)
+        .join(child, child.id == HierarchyEdge.child_member_id)
+        .where(HierarchyEdge.hierarchy_id == hierarchy_id)
+    ).all()
+    return HierarchyGraph(h, dim_code, rows)
+
+
+def leaf_amounts(dim_code: str, pov: dict) -> dict:
+    """
+    Suma de hechos por miembro de `dim_code` (y moneda) bajo el punto de
+    vista `pov`, en un único GROUP BY sobre enteros (monto_minor).
+    Retorna {moneda: {member_id: total_minor}}.
+    """
+    col = FACT_COLUMN.get(dim_code)
+    if not col:
+        raise DimensionError(f'la dimensión {dim_code} no tiene columna en hecho_financiero')
+    t = HechoFinanciero.__table__
+    rows = db.session.execute(
+        select(t.c[col], t.c.moneda, func.sum(t.c.monto_minor))
+        .where(t.c[col].is_not(None), *fact_filters(pov, skip=(col,)))
+        .group_by(t.c[col], t.c.moneda)
+    ).all()
+    out = defaultdict(dict)
+    for mid, moneda, total in rows:
+        out[moneda][mid] = int(total or 0)
+    return out
+
+
+def rollup_values(graph: HierarchyGraph, amounts: dict[int, int]) -> dict[int, int]:
+    """
+    Consolida `amounts` (member_id -> monto) hacia todos los ancestros en
+    una pasada por las aristas ya ordenadas de abajo hacia arriba.
+    """
+    values = dict.fromkeys(graph.members, 0)
+    values.update(amounts)
+    for parent, child, factor in graph.edges:
+        if factor:
+            values[parent] = values.get(parent, 0) + factor * values[child]
+    return values
+
+
+def rollup_hierarchy(hierarchy_id: int, pov: dict) -> dict:
+    """
+    Valor consolidado de cada miembro de la jerarquía bajo un punto de vista
+    (usuario_id, moneda y filtros <dim>_id / <dim>_code de las demás
+    dimensiones). Retorna {moneda: {member_id: Decimal}}.
+    """
+    graph = load_hierarchy(hierarchy_id)
+    result = {}
+    for moneda, amounts in leaf_amounts(graph.dim_code, pov).items():
+        values = rollup_values(graph, amounts)
+        result[moneda] = {mid: from_minor_units(v, moneda) for mid, v in values.items()}
+    return result
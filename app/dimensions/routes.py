@@ -1,7 +1,14 @@
-from flask import Blueprint, request, jsonify
+import time
+from flask import Blueprint, request, jsonify, make_response
 from app.extensions import db
-from .models import Dimension, Hierarchy, Member, HierarchyEdge, MemberAlias, MemberProperty
-from sqlalchemy import and_
+from .models import Dimension, Hierarchy, Member, HierarchyEdge, HierarchyClosure, MemberAlias, MemberProperty
+from .utils import member_resolver
+from .services import DimensionError, OP_SIGN, edge_factor
+from .formulas import FormulaError, validate_formula
+from .closure import (closure_add_edge, closure_remove_edge, creates_cycle, descendants, ancestors,
+                      set_primary_edge, sync_shared_flag)
+from .tree import TREE_FORMATS, bump_versions, nested_tree, tree_etag
+from sqlalchemy import and_, select
 
 bp = Blueprint('dimensions_api', __name__, url_prefix='/api')
 
@@ -54,6 +61,7 @@ def delete_dimension(dim_id):
     # borrar jerarquías/edges
     hiers = Hierarchy.query.filter_by(dimension_id=dim_id).all()
     for h in hiers:
+        HierarchyClosure.query.filter_by(hierarchy_id=h.id).delete()
         HierarchyEdge.query.filter_by(hierarchy_id=h.id).delete()
     Hierarchy.query.filter_by(dimension_id=dim_id).delete()
     # borrar miembros y sus extras
@@ -63,8 +71,10 @@ def delete_dimension(dim_id):
         MemberProperty.query.filter_by(member_id=m.id).delete()
     Member.query.filter_by(dimension_id=dim_id).delete()
     # borrar dimensión
+    dim_code = d.code
     db.session.delete(d)
     db.session.commit()
+    member_resolver.invalidate(dim_code)
     return jsonify({'ok': True})
 
 # ---------- MEMBERS ----------
@@ -73,7 +83,7 @@ def list_members(dim_id):
     mems = Member.query.filter_by(dimension_id=dim_id).order_by(Member.code).all()
     return jsonify([{
         'id': m.id, 'code': m.code, 'name': m.name,
-        'agg_op': m.agg_op, 'data_type': m.data_type,
+        'agg_op': m.agg_op, 'data_type': m.data_type, 'formula': m.formula,
         'is_shared': m.is_shared, 'is_active': m.is_active
     } for m in mems])
 
@@ -95,9 +105,107 @@ def create_member(dim_id):
     m = Member(dimension_id=dim_id, code=code, name=name, agg_op=agg_op,
                data_type=data_type, is_shared=False, is_active=True)
     db.session.add(m)
+    db.session.flush()
+    try:
+        m.formula = validate_formula(m, data.get('formula'))
+    except FormulaError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     db.session.commit()
+    member_resolver.invalidate(d.code, code)
     return jsonify({'id': m.id}), 201
 
+@bp.post('/dimensions/<int:dim_id>/members/bulk')
+def create_members_bulk(dim_id):
+    """
+    Alta masiva: [{"code", "name", "agg_op", "data_type", "formula"}, ...]
+    (o {"members": [...]}). Los códigos existentes se leen en una sola
+    consulta y los nuevos se insertan con executemany en una transacción.
+    Reporta por línea: creado, omitido (ya existe / repetido) o invalido.
+    """
+    from sqlalchemy import insert
+    from .formulas import FORMULA_TYPE, Formula, build_graph, formula_cache
+    d = db.session.get(Dimension, dim_id)
+    if not d:
+        return jsonify({'error': 'dimension no existe'}), 404
+    data = request.get_json(silent=True)
+    items = data.get('members') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'se espera una lista de miembros'}), 400
+
+    existing = set(db.session.execute(
+        select(Member.code).where(Member.dimension_id == dim_id)).scalars().all())
+    cols = Member.__table__.c
+    seen, rows, lineas, formulas = set(), [], [], []
+    for n, it in enumerate(items, start=1):
+        it = it if isinstance(it, dict) else {}
+        code = str(it.get('code') or '').strip()
+        name = str(it.get('name') or '').strip()
+        agg_op = str(it.get('agg_op') or '').strip() or None
+        data_type = str(it.get('data_type') or '').strip() or None
+        formula = str(it.get('formula') or '').strip() or None
+        linea = {'fila': n, 'code': code}
+        if not code or not name:
+            linea.update(estado='invalido', error='code y name son requeridos')
+        elif len(code) > cols.code.type.length or len(name) > cols.name.type.length:
+            linea.update(estado='invalido', error='code o name demasiado largo')
+        elif agg_op is not None and agg_op not in OP_SIGN:
+            linea.update(estado='invalido', error=f"agg_op debe ser {' '.join(OP_SIGN)}")
+        elif code in existing:
+            linea.update(estado='omitido', error=f'ya existe member {code} en dimension {d.code}')
+        elif code in seen:
+            linea.update(estado='omitido', error='repetido en el lote')
+        else:
+            member = {'dimension_id': dim_id, 'code': code, 'name': name, 'agg_op': agg_op,
+                      'data_type': data_type, 'formula': None, 'is_shared': False, 'is_active': True}
+            try:
+                if (data_type or '').lower() == FORMULA_TYPE:
+                    if not formula:
+                        raise FormulaError("los miembros 'formula' requieren formula")
+                    f = Formula(formula, code)
+                    member['formula'] = f.text
+                    formulas.append((linea, f))
+                elif formula:
+                    raise FormulaError("solo los miembros data_type 'formula' llevan fórmula")
+            except FormulaError as e:
+                linea.update(estado='invalido', error=str(e))
+            else:
+                seen.add(code)
+                rows.append(member)
+                linea['estado'] = 'creado'
+        lineas.append(linea)
+
+    # referencias de las fórmulas: miembros existentes o del mismo lote
+    for linea, f in formulas:
+        missing = sorted(c for c in f.refs if c not in existing | seen)
+        if missing:
+            linea.update(estado='invalido', error=f"member no existe en la dimensión: {', '.join(missing)}")
+    invalid = {l['code'] for l in lineas if l['estado'] == 'invalido'}
+    rows = [r for r in rows if r['code'] not in invalid]
+
+    if rows:
+        db.session.execute(insert(Member.__table__), rows)
+        if formulas:
+            try:
+                build_graph(dim_id)  # ciclos entre las fórmulas del lote
+            except FormulaError as e:
+                db.session.rollback()
+                return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        # el insert no pasa por el flush: las fórmulas pueden referenciar los nuevos
+        formula_cache.invalidate([dim_id])
+        member_resolver.invalidate(d.code)
+
+    resumen = {k: sum(l['estado'] == k for l in lineas) for k in ('creado', 'omitido', 'invalido')}
+    status = 201 if resumen['creado'] else (400 if resumen['invalido'] else 200)
+    return jsonify({'ok': not resumen['invalido'], 'creados': resumen['creado'],
+                    'omitidos': resumen['omitido'], 'invalidos': resumen['invalido'],
+                    'lineas': lineas}), status
+
+@bp.get('/dimensions/resolver/stats')
+def resolver_stats():
+    return jsonify(member_resolver.stats())
+
 #@bp.put('/members-legacy/<int:mem_id>')
 #def update_member(mem_id):
 #    m = db.session.get(Member, mem_id)
@@ -147,6 +255,9 @@ def create_edge(hier_id):
 
     if not child_id:
         return jsonify({'error': 'child_member_id es requerido'}), 400
+    child = db.session.get(Member, child_id)
+    if not child:
+        return jsonify({'error': 'child member no existe'}), 404
 
     # evitar duplicados por constraint lógico
     dup = HierarchyEdge.query.filter_by(
@@ -156,31 +267,319 @@ def create_edge(hier_id):
     ).first()
     if dup:
         return jsonify({'error': 'ya existe ese vínculo'}), 400
+    if creates_cycle(hier_id, parent_id, child_id):
+        return jsonify({'error': 'el vínculo crea un ciclo: el padre cuelga del hijo'}), 400
+
+    # miembro compartido: el primer padre es el primario, los siguientes
+    # son referencias (salvo is_primary explícito, que mueve el primario)
+    has_primary = parent_id is not None and HierarchyEdge.query.filter(
+        HierarchyEdge.hierarchy_id == hier_id,
+        HierarchyEdge.child_member_id == child_id,
+        HierarchyEdge.parent_member_id.is_not(None),
+        HierarchyEdge.is_primary.is_(True),
+    ).first() is not None
+    want_primary = data.get('is_primary')
+    want_primary = not has_primary if want_primary is None else bool(want_primary)
 
     e = HierarchyEdge(hierarchy_id=hier_id, parent_member_id=parent_id,
                       child_member_id=child_id, order_nbr=int(order_nbr),
-                      unary_op=unary_op)
+                      unary_op=unary_op, is_primary=want_primary and not has_primary)
     db.session.add(e)
+    db.session.flush()
+    closure_add_edge(hier_id, parent_id, child_id, edge_factor(unary_op, child.agg_op), e.is_primary)
+    if want_primary and has_primary:
+        set_primary_edge(e)
+    sync_shared_flag(child_id)
     db.session.commit()
-    return jsonify({'id': e.id}), 201
+    return jsonify({'id': e.id, 'is_primary': e.is_primary}), 201
+
+def _parse_edge_rows():
+    """
+    Cuerpo de la importación de vínculos: arreglo JSON de
+    {"parent", "child", "order", "unary"} (códigos) o CSV
+    parent,child,order,unary (encabezado opcional). Retorna [(fila, dict)].
+    """
+    import csv, io, json
+    raw = request.get_data(as_text=True) or ''
+    body = raw.lstrip()
+    if request.args.get('format') != 'csv' and body.startswith(('[', '{')):
+        data = json.loads(body)
+        items = data.get('edges') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError('se espera una lista de vínculos')
+        return [(n, it if isinstance(it, dict) else {}) for n, it in enumerate(items, start=1)]
+    rows = []
+    for n, rec in enumerate(csv.reader(io.StringIO(raw)), start=1):
+        if not rec or not any(x.strip() for x in rec):
+            continue
+        if n == 1 and rec[0].strip().lower() in ('parent', 'padre'):
+            continue
+        rec = [x.strip() for x in rec] + [''] * 4
+        rows.append((n, {'parent': rec[0], 'child': rec[1], 'order': rec[2], 'unary': rec[3]}))
+    return rows
+
+def find_cycle_or_orphans(edges, check_parents=None) -> tuple[list[int], list[int]]:
+    """
+    Chequeo lineal (Kahn) sobre el grafo combinado [(padre|None, hijo)]:
+    retorna (miembros en ciclos, padres que no cuelgan de la jerarquía).
+    check_parents limita los huérfanos a esos padres (p. ej. los nuevos).
+    """
+    from collections import defaultdict
+    children, indeg, placed = defaultdict(list), defaultdict(int), set()
+    for parent, child in edges:
+        placed.add(child)
+        indeg.setdefault(child, 0)
+        if parent is not None:
+            indeg.setdefault(parent, 0)
+            children[parent].append(child)
+            indeg[child] += 1
+    ready = [m for m, d in indeg.items() if d == 0]
+    seen = 0
+    while ready:
+        m = ready.pop()
+        seen += 1
+        for ch in children.get(m, ()):
+            indeg[ch] -= 1
+            if indeg[ch] == 0:
+                ready.append(ch)
+    cycle = []
+    if seen < len(indeg):
+        # lo que queda son los ciclos y lo que cuelga de ellos: se podan
+        # hacia atrás los que no tienen hijos dentro del resto
+        rest = {m for m, d in indeg.items() if d > 0}
+        outdeg = {m: sum(ch in rest for ch in children.get(m, ())) for m in rest}
+        parents = defaultdict(list)
+        for parent, child in edges:
+            if parent in rest and child in rest:
+                parents[child].append(parent)
+        leaves = [m for m, d in outdeg.items() if d == 0]
+        while leaves:
+            m = leaves.pop()
+            rest.discard(m)
+            for p in parents.get(m, ()):
+                outdeg[p] -= 1
+                if outdeg[p] == 0:
+                    leaves.append(p)
+        cycle = sorted(rest)
+    orphans = sorted(p for p in children if p not in placed
+                     and (check_parents is None or p in check_parents))
+    return cycle, orphans
+
+@bp.post('/hierarchies/<int:hier_id>/edges/bulk')
+def create_edges_bulk(hier_id):
+    """
+    Importación masiva de vínculos por código (JSON o CSV, ver
+    _parse_edge_rows; parent vacío = raíz). Resuelve los códigos en una
+    pasada, omite los vínculos ya existentes o repetidos (reimportar es
+    idempotente: 200 sin insertar), hace un único chequeo de ciclos y
+    padres huérfanos sobre el grafo combinado y luego inserta en lote y
+    reconstruye la clausura una vez. Con ciclos o huérfanos no se inserta
+    nada.
+    """
+    from sqlalchemy import insert, update
+    from .closure import rebuild_closure
+    from .utils import resolve_member_codes
+    t0 = time.perf_counter()
+    h = db.session.get(Hierarchy, hier_id)
+    if not h:
+        return jsonify({'error': 'hierarchy no existe'}), 404
+    try:
+        items = _parse_edge_rows()
+    except ValueError as e:
+        return jsonify({'error': f'cuerpo inválido: {e}'}), 400
+    if not items:
+        return jsonify({'error': 'no hay vínculos para importar'}), 400
+
+    dim_code = h.dimension.code
+    ids = resolve_member_codes(dim_code, {str(it.get(k) or '').strip()
+                                          for _, it in items for k in ('parent', 'child')})
+    existing = db.session.execute(
+        select(HierarchyEdge.parent_member_id, HierarchyEdge.child_member_id, HierarchyEdge.is_primary)
+        .where(HierarchyEdge.hierarchy_id == hier_id)).all()
+    pairs = {(p, c) for p, c, _ in existing}
+    previos = set(pairs)
+    with_primary = {c for p, c, prim in existing if p is not None and prim}
+
+    rows, errores, omitidos = [], [], []
+    for n, it in items:
+        parent_code = str(it.get('parent') or '').strip()
+        child_code = str(it.get('child') or '').strip()
+        unary = str(it.get('unary') or '+').strip()
+        parent_id = ids.get(parent_code) if parent_code else None
+        child_id = ids.get(child_code)
+        try:
+            order_nbr = int(it.get('order') or 0)
+        except (TypeError, ValueError):
+            order_nbr = None
+        if not child_code:
+            errores.append({'fila': n, 'error': 'child es requerido'})
+        elif child_id is None or (parent_code and parent_id is None):
+            missing = child_code if child_id is None else parent_code
+            errores.append({'fila': n, 'error': f'member no existe en {dim_code}: {missing}'})
+        elif parent_id == child_id:
+            errores.append({'fila': n, 'error': 'un miembro no puede ser su propio padre'})
+        elif unary not in OP_SIGN:
+            errores.append({'fila': n, 'error': f"unary debe ser {' '.join(OP_SIGN)}"})
+        elif order_nbr is None:
+            errores.append({'fila': n, 'error': 'order debe ser entero'})
+        elif (parent_id, child_id) in pairs:
+            # reimportar el mismo archivo es idempotente: no es un error
+            motivo = 'ya existe ese vínculo' if (parent_id, child_id) in previos else 'repetido en el lote'
+            omitidos.append({'fila': n, 'motivo': motivo})
+        else:
+            pairs.add((parent_id, child_id))
+            # como en create_edge: el primer padre es el primario, los demás referencias
+            primary = parent_id is None or child_id not in with_primary
+            if parent_id is not None:
+                with_primary.add(child_id)
+            rows.append({'hierarchy_id': hier_id, 'parent_member_id': parent_id,
+                         'child_member_id': child_id, 'order_nbr': order_nbr,
+                         'unary_op': unary, 'is_primary': primary})
+
+    # los huérfanos previos (create_edge los admite) no bloquean la importación
+    cycle, orphans = find_cycle_or_orphans(pairs, {r['parent_member_id'] for r in rows})
+    if cycle or orphans:
+        codes = dict(db.session.execute(
+            select(Member.id, Member.code).where(Member.id.in_(cycle + orphans))).all())
+        return jsonify({
+            'ok': False,
+            'error': 'la importación deja ciclos o padres fuera de la jerarquía; no se insertó nada',
+            'ciclo': [codes.get(m) for m in cycle],
+            'huerfanos': [codes.get(m) for m in orphans],
+            'errores': errores,
+            'omitidos': omitidos,
+        }), 400
+
+    closure_rows = None
+    if rows:
+        db.session.execute(insert(HierarchyEdge.__table__), rows)
+        shared = {r['child_member_id'] for r in rows if not r['is_primary']}
+        if shared:
+            db.session.execute(update(Member).where(Member.id.in_(shared)).values(is_shared=True))
+        closure_rows = rebuild_closure(hier_id)
+        # el insert masivo no pasa por el flush del ORM
+        bump_versions([hier_id])
+        db.session.commit()
+    return jsonify({
+        'ok': not errores,
+        'insertados': len(rows),
+        'omitidos': omitidos,
+        'errores': errores,
+        'clausura': closure_rows,
+        'segundos': round(time.perf_counter() - t0, 4),
+    }), 201 if rows else (400 if errores else 200)
 
 @bp.get('/hierarchies/<int:hier_id>/tree')
 def get_tree(hier_id):
-    edges = HierarchyEdge.query.filter_by(hierarchy_id=hier_id).order_by(HierarchyEdge.order_nbr).all()
-    return jsonify([{
-        'id': e.id,
-        'hierarchy_id': e.hierarchy_id,
-        'parent_member_id': e.parent_member_id,
-        'child_member_id': e.child_member_id,
-        'order_nbr': e.order_nbr,
-        'unary_op': e.unary_op
-    } for e in edges])
+    """
+    Vínculos de la jerarquía: lista plana (por defecto) o, con
+    ?format=nested, el árbol armado en el servidor (ver tree.nested_tree).
+    ETag fuerte por versión de la jerarquía: con If-None-Match vigente
+    responde 304 sin leer vínculos.
+    """
+    fmt = (request.args.get('format') or 'flat').lower()
+    if fmt not in TREE_FORMATS:
+        return jsonify({'error': f"format debe ser {' o '.join(TREE_FORMATS)}"}), 400
+    version = db.session.execute(select(Hierarchy.version).where(Hierarchy.id == hier_id)).scalar()
+    if version is None:
+        return jsonify({'error': 'hierarchy no existe'}), 404
+    etag = tree_etag(hier_id, version, fmt)
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+    elif fmt == 'nested':
+        try:
+            resp = jsonify({'id': hier_id, 'version': version, 'nodes': nested_tree(hier_id)})
+        except DimensionError as e:
+            return jsonify({'error': str(e)}), 409
+    else:
+        edges = HierarchyEdge.query.filter_by(hierarchy_id=hier_id).order_by(HierarchyEdge.order_nbr).all()
+        resp = jsonify([{
+            'id': e.id,
+            'hierarchy_id': e.hierarchy_id,
+            'parent_member_id': e.parent_member_id,
+            'child_member_id': e.child_member_id,
+            'order_nbr': e.order_nbr,
+            'unary_op': e.unary_op,
+            'is_primary': e.is_primary
+        } for e in edges])
+    # el navegador revalida siempre con el ETag (304 sin cuerpo si no cambió)
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
 
 @bp.delete('/edges/<int:edge_id>')
 def delete_edge(edge_id):
     e = db.session.get(HierarchyEdge, edge_id)
     if not e:
         return jsonify({'error': 'edge no existe'}), 404
+    hier_id, parent_id, child_id = e.hierarchy_id, e.parent_member_id, e.child_member_id
+    factor, was_primary = edge_factor(e.unary_op, e.child.agg_op), e.is_primary
     db.session.delete(e)
+    db.session.flush()
+    closure_remove_edge(hier_id, parent_id, child_id, factor, was_primary)
+    if was_primary and parent_id is not None:
+        # el vínculo de referencia más antiguo pasa a ser el primario
+        nxt = HierarchyEdge.query.filter(
+            HierarchyEdge.hierarchy_id == hier_id,
+            HierarchyEdge.child_member_id == child_id,
+            HierarchyEdge.parent_member_id.is_not(None),
+        ).order_by(HierarchyEdge.id).first()
+        if nxt:
+            set_primary_edge(nxt)
+    sync_shared_flag(child_id)
     db.session.commit()
     return jsonify({'ok': True})
+
+@bp.post('/edges/<int:edge_id>/primary')
+def make_primary_edge(edge_id):
+    """Hace primario el vínculo; el primario anterior del hijo pasa a referencia."""
+    e = db.session.get(HierarchyEdge, edge_id)
+    if not e:
+        return jsonify({'error': 'edge no existe'}), 404
+    if e.parent_member_id is None:
+        return jsonify({'error': 'un vínculo raíz no tiene padre'}), 400
+    prev = set_primary_edge(e)
+    db.session.commit()
+    return jsonify({'ok': True, 'id': e.id, 'anterior': prev.id if prev else None})
+
+@bp.get('/hierarchies/<int:hier_id>/members/<int:mem_id>/descendants')
+def member_descendants(hier_id, mem_id):
+    return jsonify([{'member_id': mid, 'depth': depth}
+                    for mid, depth in descendants(hier_id, mem_id)])
+
+@bp.get('/hierarchies/<int:hier_id>/members/<int:mem_id>/ancestors')
+def member_ancestors(hier_id, mem_id):
+    return jsonify([{'member_id': mid, 'depth': depth}
+                    for mid, depth in ancestors(hier_id, mem_id)])
+
+@bp.get('/hierarchies/<int:hier_id>/rollup')
+def rollup(hier_id):
+    """
+    Consolida los hechos por la jerarquía y devuelve el valor de cada
+    miembro. Punto de vista por query string: usuario_id, moneda y
+    <dim>_id / <dim>_code de las demás dimensiones.
+    """
+    from .rollup import rollup_hierarchy
+    t0 = time.perf_counter()
+    try:
+        values = rollup_hierarchy(hier_id, request.args)
+    except DimensionError as e:
+        return jsonify({'error': str(e)}), 404 if 'no existe' in str(e) else 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    ids = {mid for vals in values.values() for mid in vals}
+    mems = {m.id: m for m in Member.query.filter(Member.id.in_(ids)).all()} if ids else {}
+    return jsonify({
+        'hierarchy_id': hier_id,
+        'pov': request.args.to_dict(),
+        'monedas': {
+            (moneda or ''): [{
+                'member_id': mid,
+                'code': mems[mid].code if mid in mems else None,
+                'name': mems[mid].name if mid in mems else None,
+                'value': str(v),
+            } for mid, v in sorted(vals.items())]
+            for moneda, vals in values.items()
+        },
+        'ms': round((time.perf_counter() - t0) * 1000, 2),
+    })
@@ -1,42 +1,58 @@
+from sqlalchemy import select
 from app.extensions import db
 from .models import HierarchyEdge
 
 class DimensionError(Exception):
     pass
 
-# Detección de ciclos DFS en una jerarquía
-# Retorna True si hay ciclo
+# Operadores de consolidación: + suma, - resta, ~ ignora
+OP_SIGN = {'+': 1, '-': -1, '~': 0}
+
+def edge_factor(unary_op: str | None, child_agg_op: str | None) -> int:
+    """
+    Aporte de un hijo a su padre: signo del vínculo (unary_op) por el
+    del miembro hijo (agg_op). Cualquier '~' anula el aporte.
+    """
+    return OP_SIGN.get((unary_op or '+').strip(), 1) * OP_SIGN.get((child_agg_op or '+').strip(), 1)
+
+def graph_has_cycle(children: dict) -> bool:
+    """
+    DFS con pila explícita sobre {padre: [hijos]} (sin límite de recursión
+    en jerarquías profundas): cada entrada es (nodo, iterador de hijos pendientes).
+    """
+    WHITE, GRAY, BLACK = 0, 1, 2
+    color = {}
+    nodes = set(children) | {c for lst in children.values() for c in lst}
+    for n in nodes:
+        if color.get(n, WHITE) != WHITE:
+            continue
+        color[n] = GRAY
+        stack = [(n, iter(children.get(n, ())))]
+        while stack:
+            u, it = stack[-1]
+            for v in it:
+                c = color.get(v, WHITE)
+                if c == GRAY:
+                    return True
+                if c == WHITE:
+                    color[v] = GRAY
+                    stack.append((v, iter(children.get(v, ()))))
+                    break
+            else:
+                color[u] = BLACK
+                stack.pop()
+    return False
+
+# Detección de ciclos DFS en una jerarquía (auditoría completa; al crear
+# un vínculo basta closure.creates_cycle). Retorna True si hay ciclo
 
 def has_cycle(hierarchy_id: int) -> bool:
     from collections import defaultdict
 
     children = defaultdict(list)
-    for e in HierarchyEdge.query.filter_by(hierarchy_id=hierarchy_id).all():
-        if e.parent_member_id is not None:
-            children[e.parent_member_id].append(e.child_member_id)
-
-    WHITE, GRAY, BLACK = 0, 1, 2
-    color = {}
-
-    def dfs(u):
-        color[u] = GRAY
-        for v in children.get(u, []):
-            if color.get(v, WHITE) == GRAY:
-                return True
-            if color.get(v, WHITE) == WHITE and dfs(v):
-                return True
-        color[u] = BLACK
-        return False
-
-    # Nodos raíz posibles: padres que no son hijos de nadie
-    all_parents = set(children.keys())
-    all_children = {c for lst in children.values() for c in lst}
-    roots = list(all_parents - all_children)
-
-    # También verificar componentes sueltos
-    nodes = set(all_parents) | all_children
-
-    for n in (roots or list(nodes)):
-        if color.get(n, WHITE) == WHITE and dfs(n):
-            return True
-    return False
\ No newline at end of file
+    for parent_id, child_id in db.session.execute(
+            select(HierarchyEdge.parent_member_id, HierarchyEdge.child_member_id)
+            .where(HierarchyEdge.hierarchy_id == hierarchy_id,
+                   HierarchyEdge.parent_member_id.is_not(None))):
+        children[parent_id].append(child_id)
+    return graph_has_cycle(children)
@@ -0,0 +1,88 @@
+from collections import defaultdict
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session
+from app.extensions import db
+from .models import Hierarchy, HierarchyEdge, Member
+from .services import DimensionError, graph_has_cycle
+
+# Árbol de una jerarquía para la UI y su versión: Hierarchy.version sube
+# en el mismo flush que cambia un vínculo (o el código/nombre de un
+# miembro que aparece en él), así el ETag (jerarquía, versión, formato)
+# identifica exactamente el contenido y un GET condicional no lee vínculos.
+
+TREE_FORMATS = ('flat', 'nested')
+# Atributos de Member que viajan en el árbol anidado
+_MEMBER_FIELDS = ('code', 'name')
+
+
+def tree_etag(hierarchy_id: int, version: int, fmt: str) -> str:
+    return f'h{hierarchy_id}-v{version}-{fmt}'
+
+
+def bump_versions(hierarchy_ids, session=None) -> None:
+    """Sube la versión de las jerarquías (se escribe en el próximo flush)."""
+    session = session or db.session
+    for hid in hierarchy_ids:
+        h = session.get(Hierarchy, hid)
+        if h is not None and h not in session.new and h not in session.deleted:
+            h.version = Hierarchy.version + 1
+
+
+def nested_tree(hierarchy_id: int) -> list[dict]:
+    """
+    Árbol anidado en una pasada sobre los vínculos (con código y nombre
+    del hijo), ordenado por order_nbr. Un miembro compartido aparece bajo
+    cada padre con sus mismos hijos. Los padres que no cuelgan de la
+    jerarquía (create_edge los admite) van como raíces sin vínculo.
+    """
+    rows = db.session.execute(
+        select(HierarchyEdge.id, HierarchyEdge.parent_member_id, HierarchyEdge.child_member_id,
+               HierarchyEdge.order_nbr, HierarchyEdge.unary_op, HierarchyEdge.is_primary,
+               Member.code, Member.name)
+        .join(Member, Member.id == HierarchyEdge.child_member_id)
+        .where(HierarchyEdge.hierarchy_id == hierarchy_id)
+        .order_by(HierarchyEdge.order_nbr, HierarchyEdge.id)).all()
+    kids, placed = defaultdict(list), set()
+    for edge_id, parent_id, child_id, order_nbr, unary_op, is_primary, code, name in rows:
+        kids[parent_id].append({
+            'edge_id': edge_id, 'member_id': child_id, 'code': code, 'name': name,
+            'order_nbr': order_nbr, 'unary_op': unary_op or '+', 'is_primary': is_primary,
+            'children': kids[child_id],
+        })
+        placed.add(child_id)
+    # los hijos se comparten por referencia: un ciclo (datos previos al
+    # chequeo de create_edge) haría infinito el árbol
+    if graph_has_cycle({p: [n['member_id'] for n in ns] for p, ns in kids.items() if p is not None}):
+        raise DimensionError('la jerarquía tiene ciclos; no se puede anidar')
+    loose = sorted(p for p, ns in kids.items() if p is not None and p not in placed and ns)
+    roots = kids[None]
+    if loose:
+        for mid, code, name in db.session.execute(
+                select(Member.id, Member.code, Member.name).where(Member.id.in_(loose))
+                .order_by(Member.code)):
+            roots.append({'edge_id': None, 'member_id': mid, 'code': code, 'name': name,
+                          'order_nbr': None, 'unary_op': None, 'is_primary': None,
+                          'children': kids[mid]})
+    return roots
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_tree_versions(session, flush_context, instances):
+    hier_ids, members = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, HierarchyEdge):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            hier_ids.add(obj.hierarchy_id)
+        elif isinstance(obj, Member) and obj in session.dirty:
+            state = inspect(obj)
+            if any(state.attrs[f].history.has_changes() for f in _MEMBER_FIELDS):
+                members.add(obj.id)
+    with session.no_autoflush:
+        if members:
+            hier_ids.update(session.execute(
+                select(HierarchyEdge.hierarchy_id).distinct()
+                .where(or_(HierarchyEdge.child_member_id.in_(members),
+                           HierarchyEdge.parent_member_id.in_(members)))).scalars())
+        if hier_ids:
+            bump_versions(hier_ids, session)
@@ -1,4 +1,10 @@
-from decimal import Decimal, InvalidOperation
+import threading
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.generations import bump_generation, current_generation
 from .models import Dimension, Member
 
 def parse_decimal_comma(s: str) -> Decimal | None:
@@ -18,17 +24,199 @@ def parse_decimal_comma(s: str) -> Decimal | None:
     except (InvalidOperation, ValueError):
         raise ValueError(f"monto inválido: {s}")
 
+def parse_decimal_dot(s: str) -> Decimal | None:
+    """
+    Monto con punto decimal, como lo muestran y envían los formularios de
+    presupuesto y real ('1500.00'). Vacío -> None.
+    """
+    if s is None or not str(s).strip():
+        return None
+    s = str(s).strip().replace(' ', '')
+    try:
+        return Decimal(s)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"monto inválido: {s}")
+
+# Decimales de la unidad menor por moneda (ISO 4217); el resto usa 2.
+MINOR_UNIT_DECIMALS = {'CLP': 0, 'JPY': 0, 'KRW': 0, 'PYG': 0, 'ISK': 0, 'UYI': 0,
+                       'CLF': 4, 'BHD': 3, 'KWD': 3, 'OMR': 3, 'TND': 3}
+DEFAULT_MINOR_UNIT_DECIMALS = 2
+
+def minor_unit_decimals(moneda: str | None) -> int:
+    return MINOR_UNIT_DECIMALS.get((moneda or '').upper(), DEFAULT_MINOR_UNIT_DECIMALS)
+
+def to_minor_units(monto: Decimal, moneda: str | None) -> int:
+    """
+    Decimal -> entero en unidades menores de la moneda (centavos, o pesos
+    para CLP). Redondea half-up al número de decimales de la moneda.
+    """
+    exp = Decimal(1).scaleb(-minor_unit_decimals(moneda))
+    return int(Decimal(monto).quantize(exp, rounding=ROUND_HALF_UP).scaleb(minor_unit_decimals(moneda)))
+
+def from_minor_units(n: int | None, moneda: str | None) -> Decimal | None:
+    """Entero en unidades menores -> Decimal con la escala de la moneda."""
+    if n is None:
+        return None
+    return Decimal(int(n)).scaleb(-minor_unit_decimals(moneda))
+
+class MemberResolver:
+    """
+    Cache de proceso (dim_code, member_code) -> members.id con expulsión LRU.
+    Solo guarda aciertos: un código inexistente se vuelve a consultar.
+    Debe invalidarse cuando se crean, modifican o eliminan members; los
+    demás procesos se enteran por la generación MEMBERS_GENERATION, que
+    sube al renombrar o borrar (ver _bump_members_generation).
+    """
+
+    def __init__(self, maxsize: int = 50_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def sync(self, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                self._data.clear()
+                self.generation = generation
+
+    def get(self, dim_code: str, mem_code: str) -> int | None:
+        key = (dim_code, mem_code)
+        with self._lock:
+            mid = self._data.get(key)
+            if mid is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return mid
+
+    def put(self, dim_code: str, mem_code: str, mid: int, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return  # leído antes de un cambio de otro proceso
+            self._data[(dim_code, mem_code)] = mid
+            self._data.move_to_end((dim_code, mem_code))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, dim_code: str | None = None, mem_code: str | None = None) -> None:
+        """Sin argumentos vacía todo; con dim_code solo esa dimensión."""
+        with self._lock:
+            if dim_code is None:
+                self._data.clear()
+            elif mem_code is not None:
+                self._data.pop((dim_code, mem_code), None)
+            else:
+                for key in [k for k in self._data if k[0] == dim_code]:
+                    del self._data[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+
+member_resolver = MemberResolver()
+MEMBERS_GENERATION = 'members'
+
+@event.listens_for(Session, 'before_flush')
+def _bump_members_generation(session, flush_context, instances):
+    # Un alta no invalida aciertos cacheados; un borrado o un cambio de
+    # código (del miembro o de su dimensión) sí, en todos los procesos.
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, (Member, Dimension)):
+            continue
+        fields = ('code', 'dimension_id') if isinstance(obj, Member) else ('code',)
+        state = inspect(obj)
+        if obj in session.deleted or any(state.attrs[f].history.has_changes() for f in fields):
+            bump_generation(MEMBERS_GENERATION, session)
+            return
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_members_generation_bulk(orm_execute_state):
+    # Query.delete() masivo (p. ej. al borrar una dimensión) no pasa por el flush
+    mapper = orm_execute_state.bind_mapper
+    if orm_execute_state.is_delete and mapper is not None and mapper.class_ in (Member, Dimension):
+        bump_generation(MEMBERS_GENERATION, orm_execute_state.session)
+
 def get_member_id(dim_code: str, mem_code: str | None) -> int | None:
     """
     Busca members.id por dimension.code + member.code.
-    Retorna None si mem_code es falsy.
+    Retorna None si mem_code es falsy. Usa member_resolver como cache.
     """
     if not mem_code:
         return None
-    d = Dimension.query.filter_by(code=str(dim_code)).first()
+    dim_code, mem_code = str(dim_code), str(mem_code)
+    generation = current_generation(MEMBERS_GENERATION)
+    member_resolver.sync(generation)
+    mid = member_resolver.get(dim_code, mem_code)
+    if mid is not None:
+        return mid
+    d = Dimension.query.filter_by(code=dim_code).first()
     if not d:
         raise ValueError(f"dimension no existe: {dim_code}")
-    m = Member.query.filter_by(dimension_id=d.id, code=str(mem_code)).first()
+    m = Member.query.filter_by(dimension_id=d.id, code=mem_code).first()
     if not m:
         raise ValueError(f"member no existe en {dim_code}: {mem_code}")
+    member_resolver.put(dim_code, mem_code, m.id, generation)
     return m.id
+
+def ensure_member_ids(dim_code: str, mem_codes, names: dict | None = None) -> dict[str, int]:
+    """
+    Como resolve_member_codes, pero crea (sin commit) los members que
+    falten. `names` permite dar nombre a los nuevos (por defecto el código).
+    """
+    found = resolve_member_codes(dim_code, mem_codes)
+    missing = {str(c) for c in mem_codes if c} - found.keys()
+    if not missing:
+        return found
+    d = Dimension.query.filter_by(code=str(dim_code)).first()
+    for code in sorted(missing):
+        m = Member(dimension_id=d.id, code=code, name=(names or {}).get(code) or code,
+                   agg_op='+', is_shared=False, is_active=True)
+        db.session.add(m)
+        db.session.flush()  # al cache recién cuando exista confirmado
+        found[code] = m.id
+    return found
+
+def resolve_member_codes(dim_code: str, mem_codes) -> dict[str, int]:
+    """
+    Resuelve varios member.code de una dimensión: primero desde
+    member_resolver y los faltantes en una sola consulta.
+    Retorna {code: members.id}; los códigos inexistentes no aparecen.
+    """
+    dim_code = str(dim_code)
+    codes = {str(c) for c in mem_codes if c}
+    generation = current_generation(MEMBERS_GENERATION)
+    member_resolver.sync(generation)
+    found = {}
+    for code in codes:
+        mid = member_resolver.get(dim_code, code)
+        if mid is not None:
+            found[code] = mid
+    missing = codes - found.keys()
+    if not missing:
+        return found
+    d = Dimension.query.filter_by(code=dim_code).first()
+    if not d:
+        raise ValueError(f"dimension no existe: {dim_code}")
+    rows = (Member.query.with_entities(Member.code, Member.id)
+            .filter(Member.dimension_id == d.id, Member.code.in_(missing))
+            .all())
+    for code, mid in rows:
+        member_resolver.put(dim_code, code, mid, generation)
+        found[code] = mid
+    return found
@@ -0,0 +1,419 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from sqlalchemy import select, delete, func, event, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.generations import bump_generation, current_generation
+from app.models import HechoFinanciero, AggCell
+from app.dimensions.models import Dimension, Hierarchy, HierarchyClosure
+from app.facts import balances
+from app.facts.timeintel import PREFIX_GENERATION, prefix_cache
+
+# Clave de una celda; None en una dimensión = total de esa dimensión.
+# La moneda no se totaliza (no se suman montos de monedas distintas):
+# None = hechos sin moneda.
+AGG_KEY = ('usuario_id', 'scenario_id', 'time_id', 'account_id', 'entity_id', 'moneda')
+# Dimensiones que consolidan por su jerarquía primaria: columna -> dimension.code
+AGG_DIMS = {'time_id': 'TIME', 'account_id': 'ACCOUNT', 'entity_id': 'ENTITY'}
+# Generación compartida del LRU (ver app/generations.py)
+AGG_GENERATION = 'agg_cell'
+
+
+class AggCache:
+    """
+    LRU de proceso delante de agg_cell: clave de celda -> value_minor.
+    Las invalidaciones llegan como predicados {columna: valores}; una
+    columna ausente del predicado acepta cualquier valor. Las de otros
+    procesos llegan como un cambio de generación: sync() lo vacía.
+    """
+
+    def __init__(self, maxsize: int = 20_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = None
+        self.hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidated = 0
+        self.compute_ms_total = 0.0
+        self.compute_ms_last = None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: tuple) -> int | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def sync(self, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                self.invalidated += len(self._data)
+                self._data.clear()
+                self.generation = generation
+
+    def put(self, key: tuple, value: int, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return  # leído antes de una invalidación de otro proceso
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, preds: list[dict]) -> None:
+        with self._lock:
+            for pred in preds:
+                checks = [(AGG_KEY.index(c), vals) for c, vals in pred.items()]
+                stale = [k for k in self._data if all(k[i] in vals for i, vals in checks)]
+                for k in stale:
+                    del self._data[k]
+                self.invalidated += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidated += len(self._data)
+            self._data.clear()
+
+    def record_table_hit(self) -> None:
+        with self._lock:
+            self.table_hits += 1
+
+    def record_compute(self, ms: float) -> None:
+        with self._lock:
+            self.misses += 1
+            self.compute_ms_total += ms
+            self.compute_ms_last = ms
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.table_hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'generation': self.generation,
+                'hits': self.hits,
+                'table_hits': self.table_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidated': self.invalidated,
+                'hit_ratio': round((self.hits + self.table_hits) / total, 4) if total else None,
+                'compute_ms_last': round(self.compute_ms_last, 3) if self.compute_ms_last is not None else None,
+                'compute_ms_avg': round(self.compute_ms_total / self.misses, 3) if self.misses else None,
+            }
+
+
+agg_cache = AggCache()
+
+
+def cell_key(usuario_id, scenario_id=None, time_id=None, account_id=None,
+             entity_id=None, moneda=None) -> tuple:
+    return (int(usuario_id), scenario_id, time_id, account_id, entity_id, moneda or None)
+
+
+def primary_hierarchies(session=None) -> dict[str, int]:
+    """{columna de hecho: id de la jerarquía primaria} de las dimensiones en AGG_DIMS."""
+    session = session or db.session
+    rows = session.execute(
+        select(Dimension.code, func.min(Hierarchy.id))
+        .join(Hierarchy, Hierarchy.dimension_id == Dimension.id)
+        .where(Dimension.code.in_(AGG_DIMS.values()), Hierarchy.is_primary.is_(True))
+        .group_by(Dimension.code)
+    ).all()
+    by_code = dict(rows)
+    return {col: by_code[code] for col, code in AGG_DIMS.items() if code in by_code}
+
+
+def _key_conds(key: tuple) -> list:
+    # mismas expresiones que uq_agg_cell para usar el índice
+    c = AggCell
+    u, s, t, a, e, m = key
+    return [c.usuario_id == u,
+            func.ifnull(c.scenario_id, 0) == (s or 0),
+            func.ifnull(c.time_id, 0) == (t or 0),
+            func.ifnull(c.account_id, 0) == (a or 0),
+            func.ifnull(c.entity_id, 0) == (e or 0),
+            func.ifnull(c.moneda, '') == (m or '')]
+
+
+def compute_cell(key: tuple, hierarchies: dict | None = None) -> int:
+    """
+    Calcula una celda desde hecho_financiero en un solo SELECT: cada
+    dimensión consolidada se une a hierarchy_closure (descendientes con
+    su signo); un miembro fuera de la jerarquía se filtra por igualdad.
+    """
+    values = dict(zip(AGG_KEY, key))
+    if values['scenario_id'] is not None and balances.is_enabled():
+        # modo incremental: la celda ya está consolidada en agg_balance
+        return balances.balance_value(values)
+
+    hierarchies = primary_hierarchies() if hierarchies is None else hierarchies
+    t = HechoFinanciero.__table__
+    factor = 1
+    conds = [t.c.usuario_id == values['usuario_id']]
+    if values['scenario_id'] is not None:
+        conds.append(t.c.scenario_id == values['scenario_id'])
+    conds.append(t.c.moneda.is_(None) if values['moneda'] is None else t.c.moneda == values['moneda'])
+
+    joins = []
+    for col in AGG_DIMS:
+        mid = values[col]
+        if mid is None:
+            continue
+        h = hierarchies.get(col)
+        in_closure = h is not None and db.session.execute(
+            select(HierarchyClosure.id).where(
+                HierarchyClosure.hierarchy_id == h, HierarchyClosure.ancestor_id == mid,
+                HierarchyClosure.descendant_id == mid).limit(1)
+        ).first() is not None
+        if not in_closure:
+            conds.append(t.c[col] == mid)
+            continue
+        cl = HierarchyClosure.__table__.alias(f'cl_{col}')
+        joins.append((cl, (cl.c.hierarchy_id == h) & (cl.c.ancestor_id == mid)
+                      & (cl.c.descendant_id == t.c[col]) & (cl.c.sign != 0)
+                      & (cl.c.primary_paths > 0)))
+        factor = factor * cl.c.sign * cl.c.primary_paths
+
+    src = t
+    for cl, on in joins:
+        src = src.join(cl, on)
+    stmt = select(func.coalesce(func.sum(t.c.monto_minor * factor), 0)).select_from(src).where(*conds)
+    return int(db.session.execute(stmt).scalar() or 0)
+
+
+def cell_currencies(usuario_id: int, scenario_id: int | None = None) -> list:
+    """Monedas de los hechos del usuario (None = sin moneda), para pedir una celda por cada una."""
+    t = HechoFinanciero.__table__
+    stmt = select(t.c.moneda).distinct().where(t.c.usuario_id == usuario_id)
+    if scenario_id is not None:
+        stmt = stmt.where(t.c.scenario_id == scenario_id)
+    return sorted(db.session.execute(stmt).scalars(), key=lambda m: m or '')
+
+
+def get_cell(key: tuple) -> tuple[int, str]:
+    """
+    Valor de una celda (unidades menores) y su fuente: 'lru', 'tabla' o
+    'calculo'. Lo calculado se materializa en agg_cell sin commit.
+    El LRU solo se usa si nadie invalidó desde que se llenó (generación).
+    """
+    generation = current_generation(AGG_GENERATION)
+    agg_cache.sync(generation)
+    value = agg_cache.get(key)
+    if value is not None:
+        return value, 'lru'
+    value = db.session.execute(select(AggCell.value_minor).where(*_key_conds(key))).scalar()
+    if value is not None:
+        agg_cache.record_table_hit()
+        agg_cache.put(key, value, generation)
+        return value, 'tabla'
+
+    t0 = time.perf_counter()
+    value = compute_cell(key)
+    agg_cache.record_compute((time.perf_counter() - t0) * 1000)
+    try:
+        with db.session.begin_nested():
+            db.session.execute(
+                sqlite_insert(AggCell).values(**dict(zip(AGG_KEY, key)), value_minor=value)
+                .on_conflict_do_nothing())
+    except OperationalError:
+        # base ocupada por un escritor: se sirve igual, sin materializar
+        # ni cachear (el LRU solo guarda celdas que están en agg_cell)
+        return value, 'calculo'
+    agg_cache.put(key, value, generation)
+    return value, 'calculo'
+
+
+def refresh_cells() -> int:
+    """Recalcula todas las celdas materializadas (sin commit). Retorna cuántas."""
+    hierarchies = primary_hierarchies()
+    cells = db.session.execute(select(AggCell)).scalars().all()
+    for cell in cells:
+        cell.value_minor = compute_cell(tuple(getattr(cell, c) for c in AGG_KEY), hierarchies)
+    bump_generation(AGG_GENERATION)
+    agg_cache.clear()
+    return len(cells)
+
+
+# ---------- invalidación ----------
+
+def _ancestors_or_self(session, hierarchy_id: int, member_ids: set) -> set:
+    rows = session.execute(
+        select(HierarchyClosure.ancestor_id).distinct()
+        .where(HierarchyClosure.hierarchy_id == hierarchy_id,
+               HierarchyClosure.descendant_id.in_(member_ids))
+    ).scalars().all()
+    return set(rows) | set(member_ids)
+
+
+def _delete_cells(session, pred: dict) -> None:
+    c = AggCell
+    conds = []
+    for col, vals in pred.items():
+        if col == 'usuario_id':
+            conds.append(c.usuario_id.in_(vals))
+        else:
+            empty = '' if col == 'moneda' else 0
+            conds.append(func.ifnull(getattr(c, col), empty).in_([empty if v is None else v for v in vals]))
+    session.execute(delete(c).where(*conds))
+
+
+def _invalidate(session, preds: list[dict]) -> None:
+    for pred in preds:
+        _delete_cells(session, pred)
+    agg_cache.discard(preds)
+    # tras el commit se repite sobre el LRU: un lector concurrente pudo
+    # cachear el valor anterior entre el DELETE y el commit
+    session.info.setdefault('agg_pending', []).extend(preds)
+
+
+def invalidate_facts(rows, session=None) -> None:
+    """
+    Invalida las celdas a las que aportan los hechos `rows` (dicts o
+    filas con las columnas de AGG_KEY): por usuario, las combinaciones de
+    {escenario, total} x {ancestros o el propio miembro, total} en cada
+    dimensión consolidada x moneda.
+    """
+    session = session or db.session
+    by_user = defaultdict(lambda: {c: set() for c in AGG_KEY[1:]})
+    for r in rows:
+        get = r.get if isinstance(r, dict) else (lambda c, r=r: getattr(r, c))
+        vals = by_user[get('usuario_id')]
+        for c in AGG_KEY[1:]:
+            vals[c].add(get(c))
+    if not by_user:
+        return
+    # sumas prefijas de tiempo (YTD/QTD/R12): por usuario y escenario
+    scenario_preds = [{'usuario_id': {u}, 'scenario_id': vals['scenario_id'] | {None}}
+                      for u, vals in by_user.items()]
+    bump_generation(PREFIX_GENERATION, session)
+    prefix_cache.discard(scenario_preds)
+    session.info.setdefault('prefix_pending', []).extend(scenario_preds)
+    with_cells = set(session.execute(
+        select(AggCell.usuario_id).distinct().where(AggCell.usuario_id.in_(list(by_user)))
+    ).scalars().all())
+    # los LRU de todos los procesos se vacían por generación; agg_cell
+    # solo hace falta tocarla si el usuario tiene celdas
+    bump_generation(AGG_GENERATION, session)
+    if not with_cells:
+        return
+
+    hierarchies = primary_hierarchies(session)
+    preds = []
+    for u, vals in by_user.items():
+        pred = {'usuario_id': {u}}
+        for c, ids in vals.items():
+            if c == 'moneda':
+                pred[c] = ids
+                continue
+            real = {i for i in ids if i is not None}
+            if real and c in hierarchies:
+                real = _ancestors_or_self(session, hierarchies[c], real)
+            pred[c] = real | {None}
+        preds.append(pred)
+    _invalidate(session, preds)
+
+
+def invalidate_hierarchy(hierarchy_id: int, member_ids=None, session=None) -> None:
+    """
+    Cambió la estructura de una jerarquía: invalida las celdas de
+    `member_ids` y sus ancestros (o todas las de esa dimensión si es None).
+    Para agg_cell solo importan las jerarquías primarias de AGG_DIMS; las
+    sumas prefijas se descartan siempre.
+    """
+    session = session or db.session
+    # los arreglos prefijos del cubo traen la consolidación ya aplicada, y
+    # sus claves pueden usar cualquier jerarquía de eje (no solo primarias)
+    bump_generation(PREFIX_GENERATION, session)
+    prefix_cache.clear()
+    cols = [c for c, h in primary_hierarchies(session).items() if h == hierarchy_id]
+    if not cols:
+        return
+    col = cols[0]
+    incremental = balances.is_enabled(session)
+    if member_ids is None:
+        session.execute(delete(AggCell).where(getattr(AggCell, col).is_not(None)))
+        bump_generation(AGG_GENERATION, session)
+        agg_cache.clear()
+        if incremental:
+            balances.rebuild_balances(session=session)
+        return
+    affected = _ancestors_or_self(session, hierarchy_id, set(member_ids))
+    bump_generation(AGG_GENERATION, session)
+    _invalidate(session, [{col: affected}])
+    if incremental:
+        balances.rebuild_balances(col, affected, session=session)
+
+
+def invalidate_all(session=None) -> None:
+    session = session or db.session
+    session.execute(delete(AggCell))
+    bump_generation(AGG_GENERATION, session)
+    bump_generation(PREFIX_GENERATION, session)
+    agg_cache.clear()
+    prefix_cache.clear()
+    if balances.is_enabled(session):
+        balances.rebuild_balances(session=session)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_orm_writes(session, flush_context):
+    # Escrituras vía ORM (POST /api/facts, presupuesto): se invalidan
+    # tanto los valores nuevos como los anteriores de cada hecho.
+    rows = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, HechoFinanciero):
+            continue
+        rows.append({c: getattr(obj, c) for c in AGG_KEY})
+        if obj in session.dirty:
+            state = inspect(obj)
+            old = {c: (state.attrs[c].history.deleted or [getattr(obj, c)])[0] for c in AGG_KEY}
+            rows.append(old)
+    if rows:
+        invalidate_facts(rows, session)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_bulk_writes(orm_execute_state):
+    # Query.delete() / update() masivos no pasan por el flush: se leen
+    # antes las intersecciones que van a cambiar.
+    if not (orm_execute_state.is_delete or orm_execute_state.is_update):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not HechoFinanciero:
+        return
+    t = HechoFinanciero.__table__
+    stmt = select(*(t.c[c] for c in AGG_KEY)).distinct()
+    where = orm_execute_state.statement.whereclause
+    if where is not None:
+        stmt = stmt.where(where)
+    session = orm_execute_state.session
+    rows = [dict(r._mapping) for r in session.execute(stmt, orm_execute_state.parameters)]
+    if rows:
+        invalidate_facts(rows, session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _discard_pending(session):
+    preds = session.info.pop('agg_pending', None)
+    if preds:
+        agg_cache.discard(preds)
+    preds = session.info.pop('prefix_pending', None)
+    if preds:
+        prefix_cache.discard(preds)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop('agg_pending', None)
+    session.info.pop('prefix_pending', None)
@@ -0,0 +1,229 @@
+import json
+from collections import defaultdict
+from datetime import datetime
+from fractions import Fraction
+from sqlalchemy import insert, select, func
+from app.extensions import db
+from app.models import HechoFinanciero, AllocationRun
+from app.dimensions.models import MemberProperty
+from app.dimensions.utils import from_minor_units, get_member_id, parse_decimal_comma, resolve_member_codes
+from app.facts.aggregates import invalidate_facts
+from app.facts.timeintel import time_code
+
+# Dimensiones entre cuyos miembros se puede repartir -> columna del hecho
+DESTINOS = {'COSTCENTER': 'costcenter_id', 'ENTITY': 'entity_id'}
+# Columnas que identifican un grupo de montos del origen
+_ORIGEN_COLS = ('account_id', 'entity_id', 'costcenter_id', 'time_id', 'moneda')
+
+# Asignación: el monto de cada grupo del origen (intersección x mes x
+# moneda) se reparte según la matriz de participaciones {mes: [p_j]} de
+# los miembros destino, armada una sola vez; el redondeo usa resto mayor
+# para que lo asignado sume exactamente el origen. Los hechos resultantes
+# llevan allocation_run_id y se insertan en un solo executemany.
+
+
+def largest_remainder(total: int, shares: list[Fraction]) -> list[int]:
+    """Reparte un entero según participaciones (suman 1) sin perder unidades."""
+    sign = -1 if total < 0 else 1
+    quotas = [abs(total) * s for s in shares]
+    parts = [int(q) for q in quotas]
+    faltan = abs(total) - sum(parts)
+    for j in sorted(range(len(quotas)), key=lambda j: quotas[j] - parts[j], reverse=True)[:faltan]:
+        parts[j] += 1
+    return [sign * p for p in parts]
+
+
+def _shares(weights: list) -> list[Fraction] | None:
+    if any(w < 0 for w in weights):
+        raise ValueError('el driver tiene valores negativos')
+    weights = [Fraction(w) for w in weights]
+    total = sum(weights)
+    if not total:
+        return None
+    return [w / total for w in weights]
+
+
+def _times(origen: dict) -> dict[str, int]:
+    """Meses del origen: times explícitos (deben existir) o los meses cargados del año."""
+    codes = origen.get('times') or []
+    if isinstance(codes, str):
+        codes = [codes]
+    if codes:
+        times = resolve_member_codes('TIME', codes)
+        missing = [c for c in codes if c not in times]
+        if missing:
+            raise ValueError(f"member no existe en TIME: {', '.join(missing)}")
+        return times
+    if not origen.get('año'):
+        raise ValueError('origen requiere times o año')
+    times = resolve_member_codes('TIME', [time_code(int(origen['año']), m) for m in range(1, 13)])
+    if not times:
+        raise ValueError(f"no hay meses TIME para {origen['año']}")
+    return times
+
+
+def _driver_matrix(driver: dict, usuario_id: int, scenario_id: int, column: str,
+                   target_ids: list[int], time_ids: list[int]) -> dict[int, list]:
+    """
+    {time_id: [peso por destino]}. Desde hechos (driver.account_code: la
+    cuenta sumada en cada miembro destino y mes, en una sola consulta) o
+    desde MemberProperty (driver.propiedad: mismo peso todos los meses).
+    """
+    if driver.get('propiedad'):
+        props = dict(db.session.execute(
+            select(MemberProperty.member_id, MemberProperty.prop_val)
+            .where(MemberProperty.member_id.in_(target_ids),
+                   MemberProperty.prop_key == str(driver['propiedad']))).all())
+        vector = [parse_decimal_comma(props.get(mid)) or 0 for mid in target_ids]
+        return {tid: vector for tid in time_ids}
+
+    if not driver.get('account_code'):
+        raise ValueError('driver requiere account_code o propiedad')
+    account_id = get_member_id('ACCOUNT', driver['account_code'])
+    if driver.get('scenario_code'):
+        scenario_id = get_member_id('SCENARIO', driver['scenario_code'])
+    t = HechoFinanciero.__table__
+    stmt = (select(t.c[column], t.c.time_id, func.sum(t.c.monto_minor))
+            .where(t.c.usuario_id == usuario_id, t.c.account_id == account_id,
+                   t.c.scenario_id == scenario_id, t.c.allocation_run_id.is_(None),
+                   t.c[column].in_(target_ids), t.c.time_id.in_(time_ids))
+            .group_by(t.c[column], t.c.time_id))
+    pos = {mid: j for j, mid in enumerate(target_ids)}
+    matrix = {tid: [0] * len(target_ids) for tid in time_ids}
+    for mid, tid, total in db.session.execute(stmt):
+        matrix[tid][pos[mid]] = int(total or 0)
+    return matrix
+
+
+def run_allocation(spec: dict) -> dict:
+    """
+    Ejecuta una asignación (sin commit). Especificación:
+      {"usuario_id": 1, "nombre": "Arriendo",
+       "origen": {"account_code": "ARRIENDO", "scenario_code": "ACTUAL",
+                  "entity_code": "HQ", "costcenter_code": "COMUN",
+                  "año": 2025 | "times": ["2025M01", ...], "moneda": "CLP"},
+       "destino": {"dimension": "COSTCENTER", "members": ["level0(CC)"],
+                   "account_code": "ARRIENDO_ASIG"},
+       "driver": {"account_code": "DOTACION", "scenario_code": "ACTUAL"}
+                 | {"propiedad": "dotacion"},
+       "contrapartida": true}
+    entity_code / costcenter_code / moneda del origen son filtros
+    opcionales; destino.account_code por defecto es la cuenta de origen.
+    Con contrapartida se registra el monto negativo en el origen.
+    """
+    from app.cube.query import build_axis
+
+    usuario_id = int(spec['usuario_id'])
+    origen, destino, driver = spec['origen'], spec['destino'], spec['driver']
+    if not all(isinstance(x, dict) for x in (origen, destino, driver)):
+        raise ValueError('origen, destino y driver deben ser objetos')
+    dim = str(destino.get('dimension') or '').strip().upper()
+    if dim not in DESTINOS:
+        raise ValueError(f"destino.dimension debe ser {' o '.join(DESTINOS)}")
+    column = DESTINOS[dim]
+    axis = build_axis({**destino, 'dimension': dim})
+    target_ids = axis.ids
+
+    account_id = get_member_id('ACCOUNT', origen['account_code'])
+    scenario_id = get_member_id('SCENARIO', origen['scenario_code'])
+    dest_account_id = get_member_id('ACCOUNT', destino['account_code']) \
+        if destino.get('account_code') else account_id
+    times = _times(origen)
+    time_ids = list(times.values())
+
+    # montos del origen agrupados (solo hechos cargados, no asignados)
+    t = HechoFinanciero.__table__
+    conds = [t.c.usuario_id == usuario_id, t.c.account_id == account_id,
+             t.c.scenario_id == scenario_id, t.c.time_id.in_(time_ids),
+             t.c.allocation_run_id.is_(None)]
+    for col, field, dim_code in (('entity_id', 'entity_code', 'ENTITY'),
+                                 ('costcenter_id', 'costcenter_code', 'COSTCENTER')):
+        if origen.get(field):
+            conds.append(t.c[col] == get_member_id(dim_code, origen[field]))
+    if origen.get('moneda'):
+        conds.append(t.c.moneda == str(origen['moneda']).strip())
+    cols = [t.c[c] for c in _ORIGEN_COLS]
+    categoria, grupos = {}, []
+    for *key, cat, total in db.session.execute(
+            select(*cols, func.max(t.c.categoria_id), func.sum(t.c.monto_minor))
+            .where(*conds).group_by(*cols)):
+        categoria[tuple(key)] = cat
+        grupos.append((dict(zip(_ORIGEN_COLS, key)), int(total or 0)))
+    grupos = [(g, total) for g, total in grupos if total]
+    if not grupos:
+        raise ValueError('no hay montos para asignar en el origen')
+
+    # matriz de participaciones por mes, una vez para todos los grupos
+    shares = {tid: _shares(w) for tid, w in
+              _driver_matrix(driver, usuario_id, scenario_id, column, target_ids, time_ids).items()}
+    sin_driver = sorted(code for code, tid in times.items()
+                        if shares[tid] is None and any(g['time_id'] == tid for g, _ in grupos))
+    grupos = [(g, total) for g, total in grupos if shares[g['time_id']] is not None]
+    if not grupos:
+        raise ValueError('el driver suma cero en todos los meses del origen')
+
+    run = AllocationRun(usuario_id=usuario_id, nombre=spec.get('nombre'),
+                        parametros=json.dumps(spec, ensure_ascii=False, default=str))
+    db.session.add(run)
+    db.session.flush()
+
+    # intersección destino -> unidades menores (varios grupos pueden caer
+    # en la misma, p. ej. origen en varios centros de costo)
+    celdas, cat_of = defaultdict(int), {}
+    for g, total in grupos:
+        cat = categoria[tuple(g.values())]
+        base = {**g, 'account_id': dest_account_id}
+        for mid, part in zip(target_ids, largest_remainder(total, shares[g['time_id']])):
+            k = tuple({**base, column: mid}.values())
+            celdas[k] += part
+            cat_of.setdefault(k, cat)
+        if spec.get('contrapartida', True):
+            celdas[tuple(g.values())] -= total
+            cat_of.setdefault(tuple(g.values()), cat)
+
+    rows = [{**dict(zip(_ORIGEN_COLS, k)), 'usuario_id': usuario_id, 'scenario_id': scenario_id,
+             'categoria_id': cat_of[k], 'allocation_run_id': run.id, 'monto_minor': v,
+             'monto': from_minor_units(v, k[-1])}
+            for k, v in celdas.items() if v]
+    if rows:
+        db.session.execute(insert(t), rows)
+        invalidate_facts(rows)
+    run.filas = len(rows)
+
+    asignado = defaultdict(int)
+    for g, total in grupos:
+        asignado[g['moneda']] += total
+    return {
+        'id': run.id,
+        'filas': len(rows),
+        'grupos_origen': len(grupos),
+        'destinos': len(target_ids),
+        'sin_driver': sin_driver,
+        'asignado': {(cur or ''): from_minor_units(v, cur) for cur, v in asignado.items()},
+    }
+
+
+def reverse_allocation(run_id: int) -> int:
+    """Revierte una corrida borrando sus hechos (sin commit). Retorna filas borradas."""
+    run = db.session.get(AllocationRun, int(run_id))
+    if not run:
+        raise LookupError(f'asignación no existe: {run_id}')
+    if run.estado == 'revertida':
+        raise ValueError('la asignación ya fue revertida')
+    n = HechoFinanciero.query.filter_by(allocation_run_id=run.id).delete(synchronize_session=False)
+    run.estado = 'revertida'
+    run.revertido = datetime.utcnow()
+    return n
+
+
+def run_to_dict(run: AllocationRun) -> dict:
+    return {
+        'id': run.id,
+        'usuario_id': run.usuario_id,
+        'nombre': run.nombre,
+        'estado': run.estado,
+        'filas': run.filas,
+        'parametros': json.loads(run.parametros),
+        'creado': run.creado.isoformat() if run.creado else None,
+        'revertido': run.revertido.isoformat() if run.revertido else None,
+    }
@@ -0,0 +1,168 @@
+from sqlalchemy import text, bindparam
+from app.extensions import db
+
+# Modo incremental: triggers sobre hecho_financiero empujan el delta de
+# cada INSERT / UPDATE / DELETE a agg_balance en la misma transacción,
+# para cada ancestro (con su signo) de cuenta, entidad y período, más el
+# total (NULL). Cubre todas las rutas de escritura: ORM, executemany,
+# upsert y borrados masivos.
+
+BALANCE_DIMS = (('account_id', 'ACCOUNT'), ('entity_id', 'ENTITY'), ('time_id', 'TIME'))
+TRIGGERS = ('trg_agg_hecho_ins', 'trg_agg_hecho_upd', 'trg_agg_hecho_del')
+
+_CONFLICT_TARGET = ("usuario_id, ifnull(scenario_id, 0), ifnull(moneda, ''), "
+                    "ifnull(account_id, 0), ifnull(entity_id, 0), ifnull(time_id, 0)")
+_COLS = 'usuario_id, scenario_id, moneda, account_id, entity_id, time_id, value_minor'
+
+
+def _primary_hierarchy_sql(dim_code: str) -> str:
+    return ("(SELECT MIN(h.id) FROM hierarchies h JOIN dimensions d ON d.id = h.dimension_id "
+            f"WHERE d.code = '{dim_code}' AND h.is_primary)")
+
+
+def _ancestors_of_sql(dim_code: str, expr: str) -> str:
+    """(anc, f): ancestros o el propio miembro `expr` con su factor neto, más el total."""
+    h = _primary_hierarchy_sql(dim_code)
+    return f"""
+        SELECT c.ancestor_id AS anc, SUM(c.sign * c.primary_paths) AS f FROM hierarchy_closure c
+         WHERE c.hierarchy_id = {h} AND c.descendant_id = {expr} AND c.sign <> 0 AND c.primary_paths > 0
+         GROUP BY c.ancestor_id
+        UNION ALL
+        SELECT {expr}, 1 WHERE {expr} IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM hierarchy_closure c
+             WHERE c.hierarchy_id = {h} AND c.descendant_id = {expr} AND c.depth = 0)
+        UNION ALL
+        SELECT NULL, 1"""
+
+
+def _push_sql(row: str, sign: int) -> str:
+    """Suma sign * monto de la fila NEW/OLD a todas sus celdas consolidadas."""
+    a, e, t = (_ancestors_of_sql(dim, f'{row}.{col}') for col, dim in BALANCE_DIMS)
+    return f"""
+    INSERT INTO agg_balance ({_COLS})
+    SELECT {row}.usuario_id, {row}.scenario_id, {row}.moneda, a.anc, e.anc, t.anc,
+           {sign} * {row}.monto_minor * a.f * e.f * t.f
+      FROM ({a}) a, ({e}) e, ({t}) t
+     WHERE {row}.monto_minor IS NOT NULL
+    ON CONFLICT ({_CONFLICT_TARGET}) DO UPDATE SET value_minor = value_minor + excluded.value_minor;"""
+
+
+def trigger_ddl() -> list[str]:
+    cols = 'usuario_id, scenario_id, moneda, account_id, entity_id, time_id, monto_minor'
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS trg_agg_hecho_ins AFTER INSERT ON hecho_financiero "
+        f"BEGIN {_push_sql('NEW', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_agg_hecho_upd AFTER UPDATE OF {cols} ON hecho_financiero "
+        f"BEGIN {_push_sql('OLD', -1)} {_push_sql('NEW', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_agg_hecho_del AFTER DELETE ON hecho_financiero "
+        f"BEGIN {_push_sql('OLD', -1)} END",
+    ]
+
+
+def _all_ancestors_sql(dim_code: str) -> str:
+    """(d, anc, f) para todos los miembros de la dimensión; d = 0 representa NULL."""
+    h = _primary_hierarchy_sql(dim_code)
+    return f"""
+        SELECT c.descendant_id AS d, c.ancestor_id AS anc, SUM(c.sign * c.primary_paths) AS f
+          FROM hierarchy_closure c
+         WHERE c.hierarchy_id = {h} AND c.sign <> 0 AND c.primary_paths > 0
+         GROUP BY c.descendant_id, c.ancestor_id
+        UNION ALL
+        SELECT m.id, m.id, 1 FROM members m JOIN dimensions d ON d.id = m.dimension_id
+         WHERE d.code = '{dim_code}' AND NOT EXISTS (
+             SELECT 1 FROM hierarchy_closure c
+              WHERE c.hierarchy_id = {h} AND c.descendant_id = m.id AND c.depth = 0)
+        UNION ALL
+        SELECT m.id, NULL, 1 FROM members m JOIN dimensions d ON d.id = m.dimension_id
+         WHERE d.code = '{dim_code}'
+        UNION ALL
+        SELECT 0, NULL, 1"""
+
+
+def _recompute_select(only: str | None = None) -> str:
+    """
+    Saldos consolidados calculados desde cero en un GROUP BY. Con `only`
+    (columna de BALANCE_DIMS) se limita a los ancestros :ids de esa dimensión.
+    """
+    joins, where = [], ['f.monto_minor IS NOT NULL']
+    for alias, (col, dim) in zip(('a', 'e', 't'), BALANCE_DIMS):
+        joins.append(f"JOIN ({_all_ancestors_sql(dim)}) {alias} ON {alias}.d = ifnull(f.{col}, 0)")
+        if col == only:
+            where.append(f"{alias}.anc IN :ids")
+    return f"""
+    SELECT f.usuario_id, f.scenario_id, f.moneda, a.anc, e.anc, t.anc,
+           SUM(f.monto_minor * a.f * e.f * t.f)
+      FROM hecho_financiero f
+      {' '.join(joins)}
+     WHERE {' AND '.join(where)}
+     GROUP BY f.usuario_id, f.scenario_id, f.moneda, a.anc, e.anc, t.anc"""
+
+
+def is_enabled(session=None) -> bool:
+    session = session or db.session
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :n"), {'n': TRIGGERS[0]}
+    ).first() is not None
+
+
+def rebuild_balances(only: str | None = None, member_ids=None, session=None) -> None:
+    """
+    Recalcula agg_balance desde hecho_financiero (sin commit). Con `only`
+    y `member_ids` solo las filas cuyos miembros de esa dimensión están en
+    `member_ids` (p. ej. tras cambiar la jerarquía bajo ellos).
+    """
+    session = session or db.session
+    if only is None:
+        session.execute(text("DELETE FROM agg_balance"))
+        session.execute(text(f"INSERT INTO agg_balance ({_COLS}) {_recompute_select()}"))
+        return
+    ids = list(member_ids)
+    session.execute(text(f"DELETE FROM agg_balance WHERE {only} IN :ids")
+                    .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+    session.execute(text(f"INSERT INTO agg_balance ({_COLS}) {_recompute_select(only)}")
+                    .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+
+
+def enable(session=None) -> None:
+    """Crea los triggers y carga agg_balance desde cero (sin commit)."""
+    session = session or db.session
+    for ddl in trigger_ddl():
+        session.execute(text(ddl))
+    rebuild_balances(session=session)
+
+
+def disable(session=None) -> None:
+    """Elimina los triggers y vacía agg_balance (sin commit)."""
+    session = session or db.session
+    for name in TRIGGERS:
+        session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    session.execute(text("DELETE FROM agg_balance"))
+
+
+def verify_balances(limit: int = 20, session=None) -> dict:
+    """
+    Compara agg_balance con un recálculo completo. Retorna
+    {'filas', 'diferencias', 'ejemplos': [...]} (las filas en 0 no cuentan).
+    """
+    session = session or db.session
+    key = ('usuario_id', 'scenario_id', 'moneda', 'account_id', 'entity_id', 'time_id')
+    expected = {tuple(r[:6]): int(r[6]) for r in session.execute(text(_recompute_select()))}
+    actual = {tuple(r[:6]): int(r[6]) for r in session.execute(text(f"SELECT {_COLS} FROM agg_balance"))}
+    diffs = []
+    for k in expected.keys() | actual.keys():
+        exp, act = expected.get(k, 0), actual.get(k, 0)
+        if exp != act:
+            diffs.append({**dict(zip(key, k)), 'esperado': exp, 'incremental': act})
+    return {'filas': len(actual), 'diferencias': len(diffs), 'ejemplos': diffs[:limit]}
+
+
+def balance_value(key: dict, session=None) -> int:
+    """Saldo de una celda exacta (0 si no hay filas)."""
+    session = session or db.session
+    v = session.execute(text(f"""
+        SELECT value_minor FROM agg_balance
+         WHERE usuario_id = :usuario_id AND ifnull(scenario_id, 0) = ifnull(:scenario_id, 0)
+           AND ifnull(moneda, '') = ifnull(:moneda, '') AND ifnull(account_id, 0) = ifnull(:account_id, 0)
+           AND ifnull(entity_id, 0) = ifnull(:entity_id, 0) AND ifnull(time_id, 0) = ifnull(:time_id, 0)
+    """), key).scalar()
+    return int(v or 0)
@@ -0,0 +1,222 @@
+import threading
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+from sqlalchemy import select, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.generations import bump_generation
+from app.models import ExchangeRate
+from app.dimensions.models import Member
+from app.dimensions.utils import from_minor_units, to_minor_units, resolve_member_codes
+from app.facts.timeintel import PREFIX_GENERATION, prefix_cache
+
+# Conversión a moneda de reporte: los hechos se agrupan por (período,
+# moneda) y cada grupo se multiplica por la tasa de su período, tomada de
+# una matriz {(origen, destino): tasa} cargada una vez por período y tipo.
+# Los hechos sin moneda se consideran ya expresados en la moneda de reporte.
+
+TIPOS = ('promedio', 'cierre')
+
+
+class RateCache:
+    """
+    LRU de proceso de matrices de tasas por (time_id, tipo). Incluye las
+    inversas de los pares cargados. Se invalida por período al guardar tasas.
+    """
+
+    def __init__(self, maxsize: int = 1_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def matrices(self, time_ids, tipo: str, session=None) -> dict:
+        """{time_id: {(origen, destino): tasa}}; los faltantes en una sola consulta."""
+        session = session or db.session
+        out, missing = {}, []
+        with self._lock:
+            for tid in set(time_ids):
+                m = self._data.get((tid, tipo))
+                if m is None:
+                    missing.append(tid)
+                else:
+                    self._data.move_to_end((tid, tipo))
+                    out[tid] = m
+            self.hits += len(out)
+            self.misses += len(missing)
+        if not missing:
+            return out
+        loaded = {tid: {} for tid in missing}
+        r = ExchangeRate
+        rows = session.execute(
+            select(r.time_id, r.moneda_origen, r.moneda_destino, r.tasa)
+            .where(r.time_id.in_(missing), r.tipo == tipo)
+        ).all()
+        for tid, origen, destino, tasa in rows:
+            loaded[tid][(origen, destino)] = Decimal(tasa)
+        for matrix in loaded.values():
+            for (origen, destino), tasa in list(matrix.items()):
+                if tasa and (destino, origen) not in matrix:
+                    matrix[(destino, origen)] = 1 / tasa
+        with self._lock:
+            for tid, matrix in loaded.items():
+                self._data[(tid, tipo)] = matrix
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        out.update(loaded)
+        return out
+
+    def discard(self, time_ids) -> None:
+        time_ids = set(time_ids)
+        with self._lock:
+            for k in [k for k in self._data if k[0] in time_ids]:
+                del self._data[k]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'hit_ratio': round(self.hits / total, 4) if total else None}
+
+
+rate_cache = RateCache()
+
+
+class Converter:
+    """
+    Etapa de conversión de un corte de hechos a `destino`. `convert`
+    recibe grupos (valor_minor, moneda, time_id) y retorna el valor en
+    unidades menores de `destino`, o None si falta la tasa (queda
+    registrado en `missing`).
+    """
+
+    def __init__(self, destino: str, tipo: str = 'promedio', session=None):
+        self.destino = str(destino or '').strip().upper()
+        if not self.destino:
+            raise ValueError('moneda de reporte requerida')
+        self.tipo = (tipo or 'promedio').lower()
+        if self.tipo not in TIPOS:
+            raise ValueError(f"tipo de cambio debe ser {' o '.join(TIPOS)}")
+        self.session = session or db.session
+        self.missing = set()
+        self._matrices = {}
+
+    @property
+    def signature(self) -> tuple:
+        return (self.destino, self.tipo)
+
+    def preload(self, time_ids) -> None:
+        need = [tid for tid in set(time_ids) if tid is not None and tid not in self._matrices]
+        if need:
+            self._matrices.update(rate_cache.matrices(need, self.tipo, self.session))
+
+    def rate(self, moneda: str | None, time_id: int | None) -> Decimal | None:
+        if not moneda or moneda.upper() == self.destino:
+            return Decimal(1)
+        if time_id is None:
+            return None
+        if time_id not in self._matrices:
+            self.preload([time_id])
+        return self._matrices[time_id].get((moneda.upper(), self.destino))
+
+    def convert(self, value_minor: int, moneda: str | None, time_id: int | None) -> int | None:
+        tasa = self.rate(moneda, time_id)
+        if tasa is None:
+            self.missing.add((moneda, time_id))
+            return None
+        return to_minor_units(from_minor_units(value_minor, moneda) * tasa, self.destino)
+
+    def convert_rows(self, rows, n: int) -> dict:
+        """
+        Filas (*claves[n], moneda, time_id, total) -> {(destino, *claves): total}
+        sumando los grupos convertidos; los grupos sin tasa se omiten.
+        """
+        rows = list(rows)
+        self.preload(r[n + 1] for r in rows)
+        out = defaultdict(int)
+        for row in rows:
+            v = self.convert(int(row[n + 2] or 0), row[n], row[n + 1])
+            if v is not None:
+                out[(self.destino, *row[:n])] += v
+        return out
+
+    def missing_report(self) -> list[dict]:
+        ids = {tid for _, tid in self.missing if tid is not None}
+        codes = dict(self.session.execute(
+            select(Member.id, Member.code).where(Member.id.in_(ids))).all()) if ids else {}
+        return [{'moneda': m, 'time': codes.get(tid)} for m, tid in sorted(self.missing, key=str)]
+
+
+def save_rates(items: list[dict], session=None) -> dict:
+    """
+    Upsert de tasas [{origen, destino, time, tipo, tasa}] (sin commit).
+    Las matrices de los períodos tocados se descartan tras el commit.
+    """
+    session = session or db.session
+    times = resolve_member_codes('TIME', {str(i.get('time') or '') for i in items})
+    values, errores = [], []
+    for idx, it in enumerate(items):
+        origen = str(it.get('origen') or '').strip().upper()
+        destino = str(it.get('destino') or '').strip().upper()
+        tipo = str(it.get('tipo') or 'promedio').lower()
+        tid = times.get(str(it.get('time') or ''))
+        try:
+            tasa = Decimal(str(it.get('tasa')).replace(',', '.'))
+        except Exception:
+            tasa = None
+        if not origen or not destino or origen == destino:
+            errores.append({'idx': idx, 'error': 'origen y destino requeridos y distintos'})
+        elif tid is None:
+            errores.append({'idx': idx, 'error': f"time no existe: {it.get('time')}"})
+        elif tipo not in TIPOS:
+            errores.append({'idx': idx, 'error': f"tipo debe ser {' o '.join(TIPOS)}"})
+        elif tasa is None or not tasa.is_finite() or tasa <= 0:
+            errores.append({'idx': idx, 'error': 'tasa inválida'})
+        else:
+            values.append({'moneda_origen': origen, 'moneda_destino': destino, 'time_id': tid,
+                           'tipo': tipo, 'tasa': tasa})
+    if values:
+        stmt = sqlite_insert(ExchangeRate).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['moneda_origen', 'moneda_destino', 'time_id', 'tipo'],
+            set_={'tasa': stmt.excluded.tasa, 'actualizado': db.func.current_timestamp()})
+        session.execute(stmt)
+        _mark_pending(session, {v['time_id'] for v in values})
+    return {'guardadas': len(values), 'errores': errores}
+
+
+# ---------- invalidación ----------
+
+def _mark_pending(session, time_ids) -> None:
+    session.info.setdefault('fx_pending', set()).update(time_ids)
+    # las sumas prefijas convertidas de los demás procesos
+    bump_generation(PREFIX_GENERATION, session)
+
+
+@event.listens_for(Session, 'after_flush')
+def _rates_flushed(session, flush_context):
+    # tasas escritas vía ORM
+    tids = {obj.time_id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+            if isinstance(obj, ExchangeRate)}
+    if tids:
+        _mark_pending(session, tids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _discard_rates(session):
+    tids = session.info.pop('fx_pending', None)
+    if tids:
+        rate_cache.discard(tids)
+        # las sumas prefijas convertidas traen estas tasas aplicadas
+        prefix_cache.clear()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rates(session):
+    session.info.pop('fx_pending', None)
@@ -0,0 +1,113 @@
+import csv
+import json
+import time
+from itertools import islice
+from app.extensions import db
+from app.facts.services import fact_row_from_payload, bulk_resolver, insert_fact_rows, upsert_fact_rows
+
+CHUNK_SIZE = 5000
+MAX_ERRORS = 100  # errores detallados que se conservan; el resto solo se cuenta
+
+
+def _iter_records(fh, fmt: str):
+    """
+    Genera (n° de fila, dict) leyendo el archivo línea a línea.
+    CSV usa la primera fila como encabezado (delimitador ',' o ';').
+    """
+    if fmt == 'csv':
+        first = fh.readline()
+        delimiter = ';' if first.count(';') > first.count(',') else ','
+        header = next(csv.reader([first], delimiter=delimiter))
+        reader = csv.DictReader(fh, fieldnames=[h.strip() for h in header], delimiter=delimiter)
+        for n, rec in enumerate(reader, start=2):
+            yield n, {k: (v if v != '' else None) for k, v in rec.items()}
+    else:
+        for n, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield n, json.loads(line)
+            except ValueError as e:
+                yield n, e
+
+
+def load_facts_file(path: str, fmt: str | None = None, chunk_size: int = CHUNK_SIZE,
+                    usuario_id: int | None = None, upsert: bool = False, echo=print) -> dict:
+    """
+    Carga hechos desde CSV o NDJSON en bloques de `chunk_size` filas.
+    Cada bloque resuelve sus códigos en lote, se inserta con executemany
+    y hace commit, así la memoria no depende del tamaño del archivo.
+    `usuario_id` se usa cuando la fila no trae la columna.
+    Con `upsert` las filas existentes se actualizan por intersección y
+    las idénticas se omiten.
+    """
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    t0 = time.perf_counter()
+    total = inserted = updated = unchanged = n_errors = 0
+    errors = []
+
+    def add_errors(errs):
+        nonlocal n_errors
+        n_errors += len(errs)
+        errors.extend(errs[:max(0, MAX_ERRORS - len(errors))])
+
+    with open(path, encoding='utf-8-sig', newline='') as fh:
+        records = _iter_records(fh, fmt)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            total += len(chunk)
+
+            items, chunk_errors = [], []
+            for n, rec in chunk:
+                if isinstance(rec, Exception):
+                    chunk_errors.append({'fila': n, 'error': f'json inválido: {rec}'})
+                    continue
+                if not isinstance(rec, dict):
+                    chunk_errors.append({'fila': n, 'error': 'se espera un objeto'})
+                    continue
+                if usuario_id is not None and not rec.get('usuario_id'):
+                    rec['usuario_id'] = usuario_id
+                items.append((n, rec))
+
+            resolve = bulk_resolver([rec for _, rec in items])
+            rows = []
+            for n, rec in items:
+                try:
+                    rows.append((n, fact_row_from_payload(rec, resolve)))
+                except KeyError as e:
+                    chunk_errors.append({'fila': n, 'error': f'falta campo requerido: {e}'})
+                except (TypeError, ValueError) as e:
+                    chunk_errors.append({'fila': n, 'error': str(e)})
+
+            if upsert:
+                counts = upsert_fact_rows(rows)
+                insert_errors = counts['errores']
+                inserted += counts['insertados']
+                updated += counts['actualizados']
+                unchanged += counts['sin_cambios']
+            else:
+                ids, insert_errors = insert_fact_rows(rows)
+                inserted += len(ids)
+            db.session.commit()
+            db.session.expunge_all()
+            add_errors(chunk_errors + insert_errors)
+
+            elapsed = time.perf_counter() - t0
+            echo(f"… {total} filas leídas, {inserted} insertadas, {updated} actualizadas, "
+                 f"{n_errors} con error ({(total - n_errors) / elapsed:,.0f} filas/s)")
+
+    elapsed = time.perf_counter() - t0
+    processed = total - n_errors
+    return {
+        'leidas': total,
+        'insertadas': inserted,
+        'actualizadas': updated,
+        'sin_cambios': unchanged,
+        'con_error': n_errors,
+        'errores': errors,
+        'segundos': round(elapsed, 3),
+        'filas_por_segundo': round(processed / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -0,0 +1,206 @@
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import select, func
+from app.extensions import db
+from app.generations import current_generation
+from app.models import HechoFinanciero, Categoria
+from app.dimensions.models import Member
+from app.dimensions.utils import (resolve_member_codes, ensure_member_ids, from_minor_units,
+                                  to_minor_units)
+from app.facts.fx import Converter
+from app.facts.services import upsert_fact_rows
+from app.facts.timeintel import (FUNCIONES, PREFIX_GENERATION, prefix_cache, prefix_sums,
+                                 time_code, window, years_needed)
+
+MESES = tuple(range(1, 13))
+BUDGET_SCENARIO = 'AOP'
+ACTUAL_SCENARIO = 'ACTUAL'
+# filas del pivot -> columna de hecho_financiero
+PIVOT_ROWS = {'categoria': 'categoria_id', 'account': 'account_id'}
+
+
+def _monthly_prefix(usuario_id: int, año: int, col: str, scenario_ids: list[int],
+                    moneda: str | None, fx: Converter | None = None) -> tuple[dict, frozenset]:
+    """
+    Sumas prefijas mensuales {scenario_id: {(fila, moneda): [13]}} de un
+    usuario y año desde un único GROUP BY (índice ix_hecho_usr_scn_time),
+    cacheadas en prefix_cache hasta la próxima escritura del usuario en esos
+    escenarios. Las unidades menores de monedas distintas no se suman: con
+    `fx` cada (mes, moneda) se convierte antes de acumular y la clave lleva
+    la moneda de reporte. Retorna (sumas, grupos sin tasa).
+    """
+    key = (int(usuario_id), frozenset(scenario_ids), 'pivot', col, moneda, int(año),
+           fx.signature if fx else None)
+
+    def build():
+        times = resolve_member_codes('TIME', [time_code(año, m) for m in MESES])
+        month_of = {tid: int(code[-2:]) for code, tid in times.items()}
+        monthly = defaultdict(lambda: defaultdict(lambda: [0] * 12))
+        missing = set(fx.missing) if fx else set()
+        if scenario_ids and month_of:
+            t = HechoFinanciero.__table__
+            conds = [t.c.usuario_id == int(usuario_id),
+                     t.c.scenario_id.in_(list(scenario_ids)),
+                     t.c.time_id.in_(list(month_of))]
+            if moneda:
+                conds.append(t.c.moneda == moneda)
+            stmt = (select(t.c[col], t.c.scenario_id, t.c.time_id, t.c.moneda, func.sum(t.c.monto_minor))
+                    .where(*conds).group_by(t.c[col], t.c.scenario_id, t.c.time_id, t.c.moneda))
+            if fx:
+                fx.preload(month_of)
+            for row_id, scenario_id, time_id, cur, total in db.session.execute(stmt):
+                total = fx.convert(int(total or 0), cur, time_id) if fx else int(total or 0)
+                if total is not None:
+                    key = (row_id, fx.destino if fx else cur)
+                    monthly[scenario_id][key][month_of[time_id] - 1] += total
+        sin_tasa = frozenset(fx.missing - missing) if fx else frozenset()
+        return {sid: {rid: prefix_sums(v) for rid, v in by_row.items()}
+                for sid, by_row in monthly.items()}, sin_tasa
+
+    return prefix_cache.get_or_build(key, build, current_generation(PREFIX_GENERATION))
+
+
+def budget_actual_grid(usuario_id: int, año: int, budget: str = BUDGET_SCENARIO,
+                       actual: str = ACTUAL_SCENARIO, rows: str = 'categoria',
+                       moneda: str | None = None, vista: str = 'mes',
+                       moneda_reporte: str | None = None, tipo_cambio: str | None = None) -> dict:
+    """
+    Grilla fila x mes de presupuesto, real y variación (real - presupuesto)
+    de un usuario y año. `rows` es 'categoria' (todas las del usuario,
+    aunque no tengan datos) o 'account' (las cuentas con datos). `vista`
+    es 'mes' o un acumulado a cada mes: 'ytd', 'qtd' o 'r12' (restas de
+    sumas prefijas; r12 usa además el año anterior). Los totales son
+    siempre los del año. Hay una fila por (fila, moneda), con `moneda` y
+    los montos en la escala de esa moneda; las filas sin datos van con la
+    moneda del filtro (o sin moneda). Con `moneda_reporte` los montos se
+    convierten con la tasa (`tipo_cambio`) de cada mes y hay una sola moneda.
+    """
+    if rows not in PIVOT_ROWS:
+        raise ValueError(f"filas debe ser {' o '.join(PIVOT_ROWS)}")
+    fn = str(vista or 'mes').upper()
+    if fn not in FUNCIONES:
+        raise ValueError(f"vista debe ser {', '.join(f.lower() for f in FUNCIONES)}")
+    col = PIVOT_ROWS[rows]
+    año = int(año)
+    scenarios = resolve_member_codes('SCENARIO', [budget, actual])
+    kind_of = {scenarios[code]: kind for code, kind in ((actual, 'real'), (budget, 'presupuesto'))
+               if code in scenarios}
+    fx = Converter(moneda_reporte, tipo_cambio) if moneda_reporte else None
+    prefix = {}
+    for y in years_needed(fn, año):
+        prefix[y], sin_tasa = _monthly_prefix(usuario_id, y, col, sorted(kind_of), moneda, fx)
+        if fx:
+            fx.missing |= sin_tasa
+    moneda = fx.destino if fx else moneda
+
+    empty = [0] * 13
+    totals = defaultdict(lambda: {'presupuesto': [0] * 12, 'real': [0] * 12,
+                                  'anual': {'presupuesto': 0, 'real': 0}})
+    for sid, kind in kind_of.items():
+        this, prev = prefix[año].get(sid, {}), prefix.get(año - 1, {}).get(sid, {})
+        for key in this.keys() | prev.keys():
+            p, pp = this.get(key, empty), prev.get(key)
+            cell = totals[key]
+            cell[kind] = [window(fn, m, p, pp) for m in MESES]
+            cell['anual'][kind] = p[12]
+
+    # monedas de cada fila; sin datos, la moneda del filtro
+    currencies = defaultdict(set)
+    for row_id, cur in totals:
+        currencies[row_id].add(cur)
+
+    def with_currencies(row_id, nombre, tipo):
+        curs = sorted(currencies.get(row_id) or {moneda}, key=lambda c: (c is not None, c or ''))
+        return [(row_id, cur, nombre, tipo) for cur in curs]
+
+    if rows == 'categoria':
+        labels = [(c.id, c.nombre, c.tipo) for c in
+                  Categoria.query.filter_by(usuario_id=int(usuario_id)).order_by(Categoria.id)]
+        known = {cid for cid, _, _ in labels}
+        if None in currencies:
+            labels.append((None, None, None))
+        labels += [(rid, None, None) for rid in sorted(currencies) if rid is not None and rid not in known]
+    else:
+        ids = [rid for rid in currencies if rid is not None]
+        mems = {m.id: m for m in Member.query.filter(Member.id.in_(ids))} if ids else {}
+        labels = [(rid, mems[rid].code if rid in mems else None, None) for rid in sorted(ids)]
+        if None in currencies:
+            labels.append((None, None, None))
+
+    filas = []
+    for row_id, cur, nombre, tipo in (x for label in labels for x in with_currencies(*label)):
+        cell = totals.get((row_id, cur)) or {'presupuesto': [0] * 12, 'real': [0] * 12,
+                                             'anual': {'presupuesto': 0, 'real': 0}}
+        variacion = [r - p for p, r in zip(cell['presupuesto'], cell['real'])]
+        anual = cell['anual']
+        filas.append({
+            'id': row_id,
+            'nombre': nombre,
+            'tipo': tipo,
+            'moneda': cur,
+            'presupuesto': [from_minor_units(v, cur) for v in cell['presupuesto']],
+            'real': [from_minor_units(v, cur) for v in cell['real']],
+            'variacion': [from_minor_units(v, cur) for v in variacion],
+            'total_presupuesto': from_minor_units(anual['presupuesto'], cur),
+            'total_real': from_minor_units(anual['real'], cur),
+            'total_variacion': from_minor_units(anual['real'] - anual['presupuesto'], cur),
+        })
+    return {
+        'año': int(año),
+        'filas_por': rows,
+        'escenarios': {'presupuesto': budget, 'real': actual},
+        'vista': fn.lower(),
+        **({'moneda_reporte': fx.destino, 'sin_tasa': fx.missing_report()} if fx else {}),
+        'meses': list(MESES),
+        'filas': filas,
+    }
+
+
+def page_rows(grid: dict) -> list[dict]:
+    """
+    Una fila por categoría en la moneda que editan /presupuesto y /real
+    (la de save_month_values: sin moneda). Una categoría con datos solo en
+    otras monedas va en cero: sus montos no se mezclan con los de la página.
+    """
+    zero = [from_minor_units(0, None)] * len(MESES)
+    out = {}
+    for fila in grid['filas']:
+        if fila['id'] is None or fila['nombre'] is None:
+            continue
+        if fila['moneda'] is None:
+            out[fila['id']] = fila
+        else:
+            out.setdefault(fila['id'], {**fila, 'moneda': None, 'presupuesto': zero, 'real': zero})
+    return list(out.values())
+
+
+def save_month_values(usuario_id: int, scenario_code: str, año: int,
+                      values: dict[tuple[int, int], Decimal]) -> dict:
+    """
+    Guarda montos {(categoria_id, mes): monto} como hechos del escenario,
+    por upsert sobre la intersección (sin commit). Cada categoría se
+    registra en ACCOUNT como CAT<id> para que su intersección sea propia.
+    """
+    if not values:
+        return {'insertados': 0, 'actualizados': 0, 'sin_cambios': 0, 'errores': []}
+    cat_ids = sorted({cid for cid, _ in values})
+    names = {f'CAT{c.id}': c.nombre for c in Categoria.query.filter(Categoria.id.in_(cat_ids))}
+    accounts = ensure_member_ids('ACCOUNT', [f'CAT{cid}' for cid in cat_ids], names)
+    scenario_id = ensure_member_ids('SCENARIO', [scenario_code])[scenario_code]
+    times = ensure_member_ids('TIME', {time_code(año, mes) for _, mes in values})
+
+    rows = []
+    for n, ((cid, mes), monto) in enumerate(sorted(values.items())):
+        rows.append((n, {
+            'usuario_id': int(usuario_id),
+            'categoria_id': cid,
+            'account_id': accounts[f'CAT{cid}'],
+            'entity_id': None,
+            'costcenter_id': None,
+            'scenario_id': scenario_id,
+            'time_id': times[time_code(año, mes)],
+            'moneda': None,
+            'monto': monto,
+            'monto_minor': to_minor_units(monto, None),
+        }))
+    return upsert_fact_rows(rows)
@@ -1,7 +1,20 @@
-from flask import Blueprint, request, jsonify
+import json
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from app.extensions import db
 from app.models import HechoFinanciero
-from app.dimensions.utils import parse_decimal_comma, get_member_id
+from app.models import AggCell, ExchangeRate
+from app.dimensions.utils import from_minor_units, get_member_id
+from app.facts.services import (DIM_FIELDS, fact_filters, fact_row_from_payload, bulk_resolver,
+                                insert_fact_rows, upsert_fact_rows, integrity_message)
+from app.facts.aggregates import AGG_KEY, agg_cache, cell_currencies, cell_key, get_cell
+from app.facts.writer import FactRowError
+from app.facts.fx import TIPOS, rate_cache, save_rates
+
+PAGE_SIZE = 1000
 
 facts_bp = Blueprint('facts', __name__, url_prefix='/api')
 
@@ -10,34 +23,20 @@ def create_fact():
     data = request.get_json() or {}
 
     try:
-        usuario_id = int(data['usuario_id'])
-        monto = parse_decimal_comma(data['monto'])
-        if monto is None:
-            return jsonify({'ok': False, 'error': 'monto requerido'}), 400
-
-        categoria_id = data.get('categoria_id')
-        if categoria_id is not None:
-            categoria_id = int(categoria_id)
-
-        moneda = (data.get('moneda') or '').strip() or None
-
-        account_id    = get_member_id('ACCOUNT',    data.get('account_code'))
-        entity_id     = get_member_id('ENTITY',     data.get('entity_code'))
-        costcenter_id = get_member_id('COSTCENTER', data.get('costcenter_code'))
-        scenario_id   = get_member_id('SCENARIO',   data.get('scenario_code'))
-        time_id       = get_member_id('TIME',       data.get('time_code'))
-
-        hf = HechoFinanciero(
-            usuario_id=usuario_id,
-            categoria_id=categoria_id,
-            account_id=account_id,
-            entity_id=entity_id,
-            costcenter_id=costcenter_id,
-            scenario_id=scenario_id,
-            time_id=time_id,
-            moneda=moneda,
-            monto=monto
-        )
+        row = fact_row_from_payload(data)
+
+        # Modo write-behind: el hilo escritor agrupa y confirma; esperamos
+        # el commit antes de responder.
+        writer = current_app.extensions.get('fact_writer')
+        if writer:
+            # soltar la transacción de lectura (lock SHARED de SQLite)
+            # para no bloquear el commit del escritor
+            db.session.rollback()
+            fut = writer.submit(row)
+            new_id = fut.result(timeout=current_app.config.get('FACTS_WRITE_BEHIND_TIMEOUT', 30))
+            return jsonify({'id': new_id}), 201
+
+        hf = HechoFinanciero(**row)
         db.session.add(hf)
         db.session.commit()
         return jsonify({'id': hf.id}), 201
@@ -45,9 +44,332 @@ def create_fact():
     except KeyError as e:
         db.session.rollback()
         return jsonify({'ok': False, 'error': f'falta campo requerido: {e}'}), 400
+    except FactRowError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': integrity_message(e)}), 409
+    except FutureTimeout:
+        return jsonify({'ok': False, 'error': 'timeout esperando al escritor de hechos'}), 503
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': f'error inesperado: {e}'}), 500
+
+
+@facts_bp.get('/facts/writer/stats')
+def fact_writer_stats():
+    writer = current_app.extensions.get('fact_writer')
+    if not writer:
+        return jsonify({'activo': False})
+    return jsonify({'activo': True, **writer.stats()})
+
+
+def _parse_bulk_body():
+    """
+    Acepta un arreglo JSON o NDJSON (un hecho por línea).
+    Retorna (items, errores_de_parseo); las líneas NDJSON inválidas se
+    reportan como error de esa fila sin abortar el resto.
+    """
+    raw = request.get_data(as_text=True) or ''
+    body = raw.lstrip()
+    if body.startswith('['):
+        items = json.loads(body)
+        return list(enumerate(items, start=1)), []
+
+    items, errors = [], []
+    for n, line in enumerate(body.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append((n, json.loads(line)))
+        except ValueError as e:
+            errors.append({'fila': n, 'error': f'json inválido: {e}'})
+    return items, errors
+
+
+@facts_bp.post('/facts/bulk')
+def create_facts_bulk():
+    """
+    Carga masiva de hechos: arreglo JSON o NDJSON.
+    Resuelve códigos de dimensión por lote, inserta con executemany en
+    una sola transacción y reporta errores por fila sin abortar el lote.
+    Con ?mode=upsert inserta o actualiza por intersección dimensional y
+    reporta insertados / actualizados / sin_cambios.
+    """
+    t0 = time.perf_counter()
+    mode = (request.args.get('mode') or 'insert').lower()
+    if mode not in ('insert', 'upsert'):
+        return jsonify({'ok': False, 'error': 'mode debe ser insert o upsert'}), 400
+    try:
+        items, errors = _parse_bulk_body()
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': f'json inválido: {e}'}), 400
+    received = len(items) + len(errors)
+
+    try:
+        resolve = bulk_resolver([it for _, it in items])
+        rows = []
+        for n, it in items:
+            try:
+                if not isinstance(it, dict):
+                    raise ValueError('se esperaba un objeto')
+                rows.append((n, fact_row_from_payload(it, resolve)))
+            except KeyError as e:
+                errors.append({'fila': n, 'error': f'falta campo requerido: {e}'})
+            except (TypeError, ValueError) as e:
+                errors.append({'fila': n, 'error': str(e)})
+
+        counts = {}
+        if mode == 'upsert':
+            counts = upsert_fact_rows(rows)
+            insert_errors = counts.pop('errores')
+            inserted = counts['insertados']
+        else:
+            ids, insert_errors = insert_fact_rows(rows)
+            inserted = len(ids)
+        errors.extend(insert_errors)
+        db.session.commit()
     except ValueError as e:
         db.session.rollback()
         return jsonify({'ok': False, 'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'ok': False, 'error': f'error inesperado: {e}'}), 500
+
+    elapsed = time.perf_counter() - t0
+    errors.sort(key=lambda e: e['fila'])
+    processed = sum(counts.values()) if counts else inserted
+    return jsonify({
+        'ok': not errors,
+        'modo': mode,
+        'recibidos': received,
+        'insertados': inserted,
+        **counts,
+        'errores': errors,
+        'segundos': round(elapsed, 4),
+        'filas_por_segundo': round(processed / elapsed, 1) if elapsed > 0 else None,
+    }), (201 if processed else 400)
+
+
+def _fact_to_dict(r) -> dict:
+    return {
+        'id': r.id,
+        'usuario_id': r.usuario_id,
+        'categoria_id': r.categoria_id,
+        'account_id': r.account_id,
+        'entity_id': r.entity_id,
+        'costcenter_id': r.costcenter_id,
+        'scenario_id': r.scenario_id,
+        'time_id': r.time_id,
+        'moneda': r.moneda,
+        'monto': str(from_minor_units(r.monto_minor, r.moneda)
+                     if r.monto_minor is not None else r.monto),
+        'monto_minor': r.monto_minor,
+    }
+
+
+@facts_bp.get('/facts')
+def list_facts():
+    """
+    Exporta hechos filtrados en streaming, paginando por id (keyset, sin OFFSET).
+    Parámetros: filtros (ver fact_filters), after_id (cursor), limit
+    (máximo de filas; sin límite exporta todo) y format=json|ndjson.
+    En JSON la respuesta trae next_after_id para pedir la página siguiente.
+    """
+    try:
+        conds = fact_filters(request.args)
+        after_id = int(request.args.get('after_id') or 0)
+        limit = request.args.get('limit', type=int)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    fmt = (request.args.get('format') or 'json').lower()
+    if fmt not in ('json', 'ndjson'):
+        return jsonify({'ok': False, 'error': 'format debe ser json o ndjson'}), 400
+
+    t = HechoFinanciero.__table__
+
+    def rows():
+        last_id, sent = after_id, 0
+        while limit is None or sent < limit:
+            page = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - sent)
+            batch = db.session.execute(
+                select(t).where(t.c.id > last_id, *conds).order_by(t.c.id).limit(page)
+            ).all()
+            if not batch:
+                return
+            for r in batch:
+                yield r
+            last_id, sent = batch[-1].id, sent + len(batch)
+            if len(batch) < page:
+                return
+
+    def generate_ndjson():
+        for r in rows():
+            yield json.dumps(_fact_to_dict(r)) + '\n'
+
+    def generate_json():
+        yield '{"items": ['
+        last_id, n = None, 0
+        for r in rows():
+            yield (',' if n else '') + json.dumps(_fact_to_dict(r))
+            last_id, n = r.id, n + 1
+        next_after_id = last_id if limit is not None and n == limit else None
+        yield f'], "count": {n}, "next_after_id": {json.dumps(next_after_id)}}}'
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+
+@facts_bp.get('/facts/agg')
+def get_agg_cell():
+    """
+    Celda consolidada por (usuario, escenario, período, cuenta, entidad,
+    moneda). Cada dimensión va como <dim>_id o <dim>_code; si se omite
+    se toma el total. Las monedas no se suman: sin `moneda` responde un
+    valor por cada moneda del usuario en `monedas`. Cada celda sale del
+    LRU, de agg_cell o se calcula y materializa.
+    """
+    t0 = time.perf_counter()
+    args = request.args
+    try:
+        if not args.get('usuario_id'):
+            raise KeyError('usuario_id')
+        members = {}
+        for col, dim_code, field in DIM_FIELDS:
+            if col not in AGG_KEY:
+                continue
+            members[col] = int(args[col]) if args.get(col) else get_member_id(dim_code, args.get(field))
+        # la clave sin moneda (AGG_KEY termina en moneda)
+        dims = dict(zip(AGG_KEY[:-1], cell_key(args['usuario_id'], **members)))
+        moneda = (args.get('moneda') or '').strip()
+        monedas = [moneda] if moneda else cell_currencies(dims['usuario_id'], dims['scenario_id'])
+        cells = []
+        for m in monedas:
+            key = cell_key(args['usuario_id'], moneda=m, **members)
+            cells.append((key, *get_cell(key)))
+        db.session.commit()
+    except KeyError as e:
+        return jsonify({'ok': False, 'error': f'falta campo requerido: {e}'}), 400
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    values = [{'moneda': key[-1], 'value': str(from_minor_units(value, key[-1])),
+               'value_minor': value, 'fuente': source} for key, value, source in cells]
+    ms = round((time.perf_counter() - t0) * 1000, 3)
+    if moneda:
+        return jsonify({**dims, **values[0], 'ms': ms})
+    return jsonify({**dims, 'monedas': values, 'ms': ms})
+
+
+@facts_bp.get('/facts/agg/stats')
+def agg_stats():
+    from app.facts.timeintel import prefix_cache
+    return jsonify({**agg_cache.stats(),
+                    'celdas_materializadas': db.session.query(AggCell).count(),
+                    'sumas_prefijas': prefix_cache.stats(),
+                    'tasas': rate_cache.stats()})
+
+
+@facts_bp.get('/rates')
+def list_rates():
+    """Tasas de cambio. Filtros: time (código TIME), tipo, origen, destino."""
+    from app.dimensions.models import Member
+    q = (db.session.query(ExchangeRate, Member.code)
+         .join(Member, Member.id == ExchangeRate.time_id))
+    if request.args.get('time'):
+        q = q.filter(Member.code == request.args['time'])
+    if request.args.get('tipo'):
+        q = q.filter(ExchangeRate.tipo == request.args['tipo'].lower())
+    for arg, col in (('origen', ExchangeRate.moneda_origen), ('destino', ExchangeRate.moneda_destino)):
+        if request.args.get(arg):
+            q = q.filter(col == request.args[arg].upper())
+    q = q.order_by(Member.code, ExchangeRate.moneda_origen, ExchangeRate.moneda_destino)
+    return jsonify([{
+        'origen': r.moneda_origen, 'destino': r.moneda_destino, 'time': code,
+        'tipo': r.tipo, 'tasa': str(r.tasa),
+    } for r, code in q.all()])
+
+
+@facts_bp.post('/rates')
+def upsert_rates():
+    """
+    Carga o actualiza tasas: [{"origen": "USD", "destino": "CLP",
+    "time": "2025M01", "tipo": "promedio", "tasa": "950,25"}, ...].
+    """
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list) or not items:
+        return jsonify({'ok': False, 'error': f"se espera una lista de tasas (tipo: {' | '.join(TIPOS)})"}), 400
+    result = save_rates(items)
+    db.session.commit()
+    return jsonify({'ok': not result['errores'], **result}), 200 if result['guardadas'] else 400
+
+
+@facts_bp.post('/allocations')
+def create_allocation():
+    """
+    Asigna el monto de una intersección origen entre miembros COSTCENTER o
+    ENTITY según un driver (hechos o MemberProperty). Ver run_allocation
+    para el formato del cuerpo. Los hechos generados se revierten con
+    POST /api/allocations/<id>/revert.
+    """
+    from app.facts.allocation import run_allocation
+    from app.dimensions.services import DimensionError
+    t0 = time.perf_counter()
+    data = request.get_json(silent=True) or {}
+    try:
+        result = run_allocation(data)
+        db.session.commit()
+    except KeyError as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': f'falta campo requerido: {e}'}), 400
+    except (DimensionError, TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    result['asignado'] = {cur: str(v) for cur, v in result['asignado'].items()}
+    return jsonify({'ok': True, **result, 'ms': round((time.perf_counter() - t0) * 1000, 2)}), 201
+
+
+@facts_bp.get('/allocations')
+def list_allocations():
+    """Corridas de asignación. Filtros: usuario_id, estado."""
+    from app.models import AllocationRun
+    from app.facts.allocation import run_to_dict
+    q = AllocationRun.query
+    if request.args.get('usuario_id'):
+        q = q.filter_by(usuario_id=int(request.args['usuario_id']))
+    if request.args.get('estado'):
+        q = q.filter_by(estado=request.args['estado'])
+    return jsonify([run_to_dict(r) for r in q.order_by(AllocationRun.id.desc()).all()])
+
+
+@facts_bp.get('/allocations/<int:run_id>')
+def get_allocation(run_id):
+    from app.models import AllocationRun
+    from app.facts.allocation import run_to_dict
+    run = db.session.get(AllocationRun, run_id)
+    if not run:
+        return jsonify({'ok': False, 'error': 'asignación no existe'}), 404
+    return jsonify(run_to_dict(run))
+
+
+@facts_bp.post('/allocations/<int:run_id>/revert')
+def revert_allocation(run_id):
+    """Borra los hechos de la corrida y la marca como revertida."""
+    from app.facts.allocation import reverse_allocation
+    try:
+        borrados = reverse_allocation(run_id)
+        db.session.commit()
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 409
+    return jsonify({'ok': True, 'id': run_id, 'borrados': borrados})
@@ -0,0 +1,192 @@
+from sqlalchemy import insert, select, func, text, bindparam
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import HechoFinanciero
+from app.dimensions.utils import parse_decimal_comma, get_member_id, resolve_member_codes, to_minor_units
+from app.facts.aggregates import invalidate_facts
+
+# columna en hecho_financiero, código de dimensión, campo del payload
+DIM_FIELDS = (
+    ('account_id',    'ACCOUNT',    'account_code'),
+    ('entity_id',     'ENTITY',     'entity_code'),
+    ('costcenter_id', 'COSTCENTER', 'costcenter_code'),
+    ('scenario_id',   'SCENARIO',   'scenario_code'),
+    ('time_id',       'TIME',       'time_code'),
+)
+
+BATCH_SIZE = 1000
+
+# Intersección dimensional de un hecho; coincide con el índice único
+# uq_hecho_interseccion (los NULL se normalizan con ifnull).
+INTERSECTION_KEY = ('usuario_id', 'account_id', 'entity_id', 'costcenter_id',
+                    'scenario_id', 'time_id', 'moneda', 'allocation_run_id')
+_CONFLICT_TARGET = ("usuario_id, ifnull(account_id, 0), ifnull(entity_id, 0), "
+                    "ifnull(costcenter_id, 0), ifnull(scenario_id, 0), "
+                    "ifnull(time_id, 0), ifnull(moneda, ''), ifnull(allocation_run_id, 0)")
+_FACT_COLS = INTERSECTION_KEY + ('categoria_id', 'monto', 'monto_minor')
+
+# Solo actualiza si algo cambió: las filas idénticas no se reescriben.
+UPSERT_SQL = text(f"""
+    INSERT INTO hecho_financiero ({', '.join(_FACT_COLS)})
+    VALUES ({', '.join(':' + c for c in _FACT_COLS)})
+    ON CONFLICT ({_CONFLICT_TARGET}) DO UPDATE
+    SET monto = excluded.monto, monto_minor = excluded.monto_minor,
+        categoria_id = excluded.categoria_id
+    WHERE hecho_financiero.monto_minor IS NOT excluded.monto_minor
+       OR hecho_financiero.categoria_id IS NOT excluded.categoria_id
+""").bindparams(bindparam('monto', type_=HechoFinanciero.__table__.c.monto.type))
+
+
+def fact_row_from_payload(data: dict, resolve=None) -> dict:
+    """
+    Valida un hecho (mismo formato que POST /api/facts) y lo convierte
+    en un dict de columnas listo para insertar.
+    `resolve(dim_code, mem_code)` permite inyectar una resolución ya
+    precargada; por defecto usa get_member_id.
+    Lanza KeyError / ValueError igual que create_fact.
+    """
+    resolve = resolve or get_member_id
+
+    usuario_id = int(data['usuario_id'])
+    monto = parse_decimal_comma(data['monto'])
+    if monto is None:
+        raise ValueError('monto requerido')
+
+    categoria_id = data.get('categoria_id')
+    if categoria_id is not None:
+        categoria_id = int(categoria_id)
+
+    moneda = (data.get('moneda') or '').strip() or None
+
+    row = {
+        'usuario_id': usuario_id,
+        'categoria_id': categoria_id,
+        'moneda': moneda,
+        'monto': monto,
+        'monto_minor': to_minor_units(monto, moneda),
+    }
+    for col, dim_code, field in DIM_FIELDS:
+        row[col] = resolve(dim_code, data.get(field))
+    return row
+
+
+def bulk_resolver(items: list[dict]):
+    """
+    Precarga los member ids de todos los códigos presentes en `items`
+    (una consulta por dimensión) y retorna una función compatible con
+    get_member_id que ya no toca la base.
+    """
+    cache = {}
+    for _, dim_code, field in DIM_FIELDS:
+        codes = {str(it.get(field)) for it in items
+                 if isinstance(it, dict) and it.get(field)}
+        cache[dim_code] = resolve_member_codes(dim_code, codes)
+
+    def resolve(dim_code: str, mem_code: str | None) -> int | None:
+        if not mem_code:
+            return None
+        mid = cache[dim_code].get(str(mem_code))
+        if mid is None:
+            raise ValueError(f"member no existe en {dim_code}: {mem_code}")
+        return mid
+
+    return resolve
+
+
+def insert_fact_rows(rows: list[tuple[int, dict]], batch_size: int = BATCH_SIZE) -> tuple[dict[int, int], list[dict]]:
+    """
+    Inserta filas ya validadas en lotes (INSERT multi-VALUES ... RETURNING
+    id), dentro de la transacción actual (no hace commit).
+    `rows` es una lista de (n° de fila, columnas). Si un lote falla por
+    integridad se reintenta fila a fila para aislar las filas malas.
+    Retorna ({n° de fila: id insertado}, errores).
+    """
+    t = HechoFinanciero.__table__
+    stmt = insert(t).returning(t.c.id, sort_by_parameter_order=True)
+    ids = {}
+    errors = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        try:
+            with db.session.begin_nested():
+                new_ids = db.session.execute(stmt, [r for _, r in batch]).scalars().all()
+            ids.update(zip((idx for idx, _ in batch), new_ids))
+        except IntegrityError:
+            for idx, r in batch:
+                try:
+                    with db.session.begin_nested():
+                        ids[idx] = db.session.execute(stmt, [r]).scalar_one()
+                except IntegrityError as e:
+                    errors.append({'fila': idx, 'error': integrity_message(e)})
+    invalidate_facts(r for idx, r in rows if idx in ids)
+    return ids, errors
+
+
+def integrity_message(e: IntegrityError) -> str:
+    if 'UNIQUE' in str(e.orig):
+        return 'ya existe un hecho en esa intersección (usa mode=upsert)'
+    return f'violación de integridad: {e.orig}'
+
+
+def upsert_fact_rows(rows: list[tuple[int, dict]], batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Inserta o actualiza por intersección dimensional con
+    INSERT ... ON CONFLICT DO UPDATE, en lotes y sin commit.
+    Las filas cuyo monto y categoría no cambian no se tocan.
+    Retorna {'insertados', 'actualizados', 'sin_cambios', 'errores'}.
+    """
+    t = HechoFinanciero.__table__
+    res = {'insertados': 0, 'actualizados': 0, 'sin_cambios': 0, 'errores': []}
+
+    def run(params: list[dict]) -> tuple[int, int]:
+        # Dentro de la transacción (SQLite serializa escrituras) los ids
+        # nuevos son > max_id, así se separan inserciones de updates.
+        max_id = db.session.execute(select(func.coalesce(func.max(t.c.id), 0))).scalar()
+        with db.session.begin_nested():
+            changed = db.session.execute(UPSERT_SQL, params).rowcount
+        new = db.session.execute(select(func.count()).where(t.c.id > max_id)).scalar()
+        return new, changed - new
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        params = [{c: r.get(c) for c in _FACT_COLS} for _, r in batch]
+        try:
+            new, upd = run(params)
+            ok = len(batch)
+        except IntegrityError:
+            new = upd = ok = 0
+            for (idx, _), p in zip(batch, params):
+                try:
+                    n, u = run([p])
+                    new, upd, ok = new + n, upd + u, ok + 1
+                except IntegrityError as e:
+                    res['errores'].append({'fila': idx, 'error': integrity_message(e)})
+        res['insertados'] += new
+        res['actualizados'] += upd
+        res['sin_cambios'] += ok - new - upd
+        if new or upd:
+            failed = {e['fila'] for e in res['errores']}
+            invalidate_facts(r for idx, r in batch if idx not in failed)
+    return res
+
+
+def fact_filters(args, skip: tuple = ()) -> list:
+    """
+    Condiciones sobre hecho_financiero a partir de parámetros: usuario_id,
+    moneda y por cada dimensión <dim>_id o <dim>_code (p. ej. account_id=3
+    o account_code=500100). `skip` omite columnas de dimensión.
+    """
+    t = HechoFinanciero.__table__
+    conds = []
+    if args.get('usuario_id'):
+        conds.append(t.c.usuario_id == int(args['usuario_id']))
+    if args.get('moneda'):
+        conds.append(t.c.moneda == args['moneda'].strip())
+    for col, dim_code, field in DIM_FIELDS:
+        if col in skip:
+            continue
+        if args.get(col):
+            conds.append(t.c[col] == int(args[col]))
+        elif args.get(field):
+            conds.append(t.c[col] == get_member_id(dim_code, args[field]))
+    return conds
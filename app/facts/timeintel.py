@@ -0,0 +1,132 @@
+import re
+import threading
+from collections import OrderedDict
+
+# Miembros TIME mensuales: YYYYMmm (p. ej. 2025M08)
+TIME_CODE = re.compile(r'^(\d{4})M(\d{2})$')
+# Miembros dinámicos: YTD(2025M05), QTD(2025M05), R12(2025M05)
+DYNAMIC_TIME = re.compile(r'^\s*(YTD|QTD|R12)\s*\(\s*(\d{4}M\d{2})\s*\)\s*$', re.I)
+FUNCIONES = ('MES', 'YTD', 'QTD', 'R12')
+
+
+def time_code(año: int, mes: int) -> str:
+    """Código del member TIME de un mes (p. ej. 2025M08)."""
+    return f'{int(año)}M{int(mes):02d}'
+
+
+def parse_time_code(code: str) -> tuple[int, int] | None:
+    m = TIME_CODE.match(str(code or '').strip())
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        return None
+    return int(m.group(1)), int(m.group(2))
+
+
+def parse_dynamic(spec: str) -> tuple[str, int, int] | None:
+    """'YTD(2025M05)' -> ('YTD', 2025, 5); None si no es un miembro dinámico."""
+    m = DYNAMIC_TIME.match(str(spec or ''))
+    if not m:
+        return None
+    ym = parse_time_code(m.group(2))
+    return (m.group(1).upper(), *ym) if ym else None
+
+
+def prefix_sums(monthly) -> list[int]:
+    """[m1..m12] -> [0, m1, m1+m2, ...] (13 posiciones)."""
+    out = [0]
+    for v in monthly:
+        out.append(out[-1] + v)
+    return out
+
+
+def years_needed(fn: str, año: int) -> tuple[int, ...]:
+    return (año - 1, año) if fn == 'R12' else (año,)
+
+
+def window(fn: str, mes: int, prefix: list[int], prev: list[int] | None = None) -> int:
+    """
+    Valor acumulado de un mes como resta de sumas prefijas (O(1)).
+    `prev` es el arreglo del año anterior (solo R12).
+    """
+    if fn == 'MES':
+        return prefix[mes] - prefix[mes - 1]
+    if fn == 'YTD':
+        return prefix[mes]
+    if fn == 'QTD':
+        return prefix[mes] - prefix[3 * ((mes - 1) // 3)]
+    if fn == 'R12':
+        prev = prev or [0] * 13
+        return prefix[mes] + prev[12] - prev[mes]
+    raise ValueError(f'función de tiempo desconocida: {fn}')
+
+
+class PrefixSumCache:
+    """
+    LRU de proceso de arreglos de sumas prefijas mensuales.
+    La clave empieza con (usuario_id, escenarios) donde escenarios es un
+    frozenset de scenario_id o None (= todos); el resto la define quien
+    construye. Se invalida con los mismos predicados que agg_cell y, entre
+    procesos, por la generación compartida PREFIX_GENERATION que recibe
+    get_or_build (ver app/generations.py).
+    """
+
+    def __init__(self, maxsize: int = 2_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key: tuple, build, generation: int):
+        with self._lock:
+            if generation != self.generation:
+                self._data.clear()
+                self.generation = generation
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        with self._lock:
+            if generation != self.generation:
+                return value  # otro hilo vio una invalidación durante build()
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def discard(self, preds: list[dict]) -> None:
+        with self._lock:
+            for pred in preds:
+                users = pred.get('usuario_id')
+                scenarios = pred.get('scenario_id')
+                stale = [k for k in self._data
+                         if (users is None or k[0] in users)
+                         and (scenarios is None or k[1] is None or k[1] & scenarios)]
+                for k in stale:
+                    del self._data[k]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+
+prefix_cache = PrefixSumCache()
+PREFIX_GENERATION = 'sumas_prefijas'
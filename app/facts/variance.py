@@ -0,0 +1,145 @@
+from decimal import Decimal
+from sqlalchemy import select, func
+from app.extensions import db
+from app.models import HechoFinanciero, Categoria
+from app.dimensions.models import Member
+from app.dimensions.utils import resolve_member_codes, from_minor_units, to_minor_units
+from app.facts.timeintel import time_code
+
+# Signo favorable de la variación (comparado - base) por Categoria.tipo:
+# +1 = más es mejor (ingresos, ahorro), -1 = menos es mejor (gastos)
+SIGNO_FAVORABLE = {'ingreso': 1, 'ahorro': 1, 'gasto_fijo': -1, 'gasto_variable': -1}
+# Niveles de comparación -> columnas de hecho_financiero que forman la clave
+NIVELES = {
+    'interseccion': ('categoria_id', 'account_id', 'entity_id', 'costcenter_id', 'time_id', 'moneda'),
+    'categoria': ('categoria_id', 'moneda'),
+    'account': ('account_id', 'moneda'),
+}
+
+
+def favorable_sign(tipo: str | None) -> int | None:
+    if not tipo:
+        return None
+    if tipo in SIGNO_FAVORABLE:
+        return SIGNO_FAVORABLE[tipo]
+    return -1 if tipo.startswith('gasto') else None
+
+
+def _pct(var: int, base: int) -> Decimal | None:
+    if not base:
+        return None
+    return (Decimal(var) * 100 / abs(base)).quantize(Decimal('0.01'))
+
+
+def compare_scenarios(usuario_id: int, base: str, compare: str, año: int, meses=None,
+                      nivel: str = 'interseccion', moneda: str | None = None,
+                      umbral_abs: Decimal | None = None, umbral_pct: Decimal | None = None,
+                      solo_alertas: bool = False) -> dict:
+    """
+    Compara dos escenarios (p. ej. AOP vs ACTUAL) de un usuario en los
+    meses del año. Ambos escenarios se leen en un único GROUP BY, se
+    alinean por clave (`nivel`) y en una sola pasada se calcula variación
+    (compare - base), variación %, si es favorable según el tipo de la
+    categoría y si supera los umbrales (todos los indicados).
+    (Sin NumPy en el proyecto: la alineación es un dict clave -> [base, comparado].)
+    """
+    if nivel not in NIVELES:
+        raise ValueError(f"nivel debe ser {', '.join(NIVELES)}")
+    meses = sorted({int(m) for m in (meses or range(1, 13))})
+    if any(not 1 <= m <= 12 for m in meses):
+        raise ValueError('mes fuera de rango (1-12)')
+    keys = NIVELES[nivel]
+    scenarios = resolve_member_codes('SCENARIO', [base, compare])
+    if base not in scenarios or compare not in scenarios:
+        missing = [c for c in (base, compare) if c not in scenarios]
+        raise ValueError(f"escenario no existe: {', '.join(missing)}")
+    base_id, comp_id = scenarios[base], scenarios[compare]
+    times = resolve_member_codes('TIME', [time_code(año, m) for m in meses])
+
+    # intersección -> [base, comparado] en unidades menores
+    aligned = {}
+    if times:
+        t = HechoFinanciero.__table__
+        conds = [t.c.usuario_id == int(usuario_id),
+                 t.c.scenario_id.in_([base_id, comp_id]),
+                 t.c.time_id.in_(list(times.values()))]
+        if moneda:
+            conds.append(t.c.moneda == moneda)
+        cols = [t.c[k] for k in keys]
+        stmt = (select(*cols, t.c.scenario_id, func.sum(t.c.monto_minor))
+                .where(*conds).group_by(*cols, t.c.scenario_id))
+        n = len(keys)
+        for row in db.session.execute(stmt):
+            pair = aligned.setdefault(tuple(row[:n]), [0, 0])
+            pair[0 if row[n] == base_id else 1] += int(row[n + 1] or 0)
+
+    # tipo de cada clave: por su categoría, o por la cuenta CAT<id> de la categoría
+    ids = {k[0] for k in aligned if k[0] is not None}
+    if ids and keys[0] == 'account_id':
+        codes = db.session.execute(select(Member.id, Member.code).where(Member.id.in_(ids))).all()
+        cat_of = {mid: int(code[3:]) for mid, code in codes if code.startswith('CAT') and code[3:].isdigit()}
+    else:
+        cat_of = {i: i for i in ids}
+    tipos = {}
+    if cat_of:
+        by_cat = dict(db.session.execute(
+            select(Categoria.id, Categoria.tipo).where(Categoria.id.in_(set(cat_of.values())))).all())
+        tipos = {k: by_cat.get(cid) for k, cid in cat_of.items()}
+    time_of = {tid: code for code, tid in times.items()}
+    cur_idx = keys.index('moneda')
+    abs_minor = {}
+
+    filas = []
+    resumen = {'filas': 0, 'favorables': 0, 'desfavorables': 0, 'alertas': 0}
+    totals = {}
+    for key, (b, c) in aligned.items():
+        cur = key[cur_idx]
+        var = c - b
+        pct = _pct(var, b)
+        sign = favorable_sign(tipos.get(key[0]))
+        favorable = None if sign is None or var == 0 else var * sign > 0
+        if umbral_abs is not None and cur not in abs_minor:
+            abs_minor[cur] = abs(to_minor_units(Decimal(umbral_abs), cur))
+        alerta = (umbral_abs is not None or umbral_pct is not None) \
+            and (umbral_abs is None or abs(var) >= abs_minor[cur]) \
+            and (umbral_pct is None or (pct is not None and abs(pct) >= umbral_pct))
+
+        resumen['filas'] += 1
+        resumen['favorables'] += favorable is True
+        resumen['desfavorables'] += favorable is False
+        resumen['alertas'] += bool(alerta)
+        tot = totals.setdefault(cur, [0, 0])
+        tot[0] += b
+        tot[1] += c
+        if solo_alertas and not alerta:
+            continue
+        fila = dict(zip(keys, key))
+        if 'time_id' in fila:
+            fila['time'] = time_of.get(fila['time_id'])
+        fila['tipo'] = tipos.get(key[0])
+        fila.update({
+            'base': from_minor_units(b, cur),
+            'comparado': from_minor_units(c, cur),
+            'variacion': from_minor_units(var, cur),
+            'variacion_pct': pct,
+            'favorable': favorable,
+            'alerta': bool(alerta),
+        })
+        filas.append(fila)
+
+    filas.sort(key=lambda f: abs(f['variacion']), reverse=True)  # mayores desvíos primero
+    resumen['totales'] = {
+        (cur or ''): {'base': from_minor_units(b, cur), 'comparado': from_minor_units(c, cur),
+                      'variacion': from_minor_units(c - b, cur), 'variacion_pct': _pct(c - b, b)}
+        for cur, (b, c) in totals.items()
+    }
+    return {
+        'base': base,
+        'comparado': compare,
+        'año': int(año),
+        'meses': meses,
+        'nivel': nivel,
+        'filas': filas,
+        'resumen': resumen,
+    }
+
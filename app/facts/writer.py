@@ -0,0 +1,127 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.extensions import db
+from app.facts.services import insert_fact_rows
+
+
+class FactRowError(ValueError):
+    """Error de una fila encolada (p. ej. intersección duplicada)."""
+
+
+class FactWriter:
+    """
+    Write-behind para inserción de hechos: las escrituras se encolan y un
+    único hilo escritor las agrupa en transacciones de hasta `max_rows`
+    filas o cada `max_wait_ms` ms. Cada submit retorna un Future que se
+    resuelve con el id insertado recién después del commit.
+    """
+
+    def __init__(self, app, max_rows: int = 500, max_wait_ms: int = 20):
+        self.app = app
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_started(self):
+        # arranque perezoso: con gunicorn el hilo debe nacer en cada worker
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='fact-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, row: dict) -> Future:
+        self._ensure_started()
+        fut = Future()
+        self._queue.put((row, fut))
+        return fut
+
+    def stop(self, timeout: float = 5.0):
+        """Drena lo pendiente y detiene el hilo."""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                ids, errors = insert_fact_rows([(i, row) for i, (row, _) in enumerate(batch)],
+                                               batch_size=self.max_rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                for _, fut in batch:
+                    fut.set_exception(e)
+                return
+            finally:
+                db.session.remove()
+        self.batches += 1
+        self.rows += len(ids)
+        failed = {e['fila']: e['error'] for e in errors}
+        for i, (_, fut) in enumerate(batch):
+            if i in ids:
+                fut.set_result(ids[i])
+            else:
+                fut.set_exception(FactRowError(failed.get(i, 'fila no insertada')))
+
+    def stats(self) -> dict:
+        return {
+            'pendientes': self._queue.qsize(),
+            'lotes': self.batches,
+            'filas': self.rows,
+            'filas_por_lote': round(self.rows / self.batches, 1) if self.batches else None,
+        }
+
+
+def init_app(app):
+    """
+    Activa el modo write-behind si FACTS_WRITE_BEHIND está encendido.
+    El writer queda en app.extensions['fact_writer'].
+    """
+    if not app.config.get('FACTS_WRITE_BEHIND'):
+        return None
+    writer = FactWriter(
+        app,
+        max_rows=app.config.get('FACTS_WRITE_BEHIND_MAX_ROWS', 500),
+        max_wait_ms=app.config.get('FACTS_WRITE_BEHIND_MAX_MS', 20),
+    )
+    app.extensions['fact_writer'] = writer
+    atexit.register(writer.stop)
+    return writer
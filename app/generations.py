@@ -0,0 +1,45 @@
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.extensions import db
+
+# Generaciones compartidas de los caches de proceso (agg_cache,
+# prefix_cache, member_resolver). Con varios workers (gunicorn) la
+# invalidación local solo llega al proceso que escribió: quien invalida
+# además sube la generación del cache en la misma transacción, y cada
+# proceso la compara al leer (una vez por transacción) y se vacía si
+# cambió.
+
+
+class CacheGeneration(db.Model):
+    __tablename__ = 'cache_generation'
+    name = db.Column(db.String(40), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+
+def current_generation(name: str, session=None) -> int:
+    """Generación de `name` vista por la transacción actual (0 si nunca subió)."""
+    session = session or db.session
+    seen = session.info.setdefault('generations', {})
+    if name not in seen:
+        seen[name] = session.execute(
+            select(CacheGeneration.generation).where(CacheGeneration.name == name)
+        ).scalar() or 0
+    return seen[name]
+
+
+def bump_generation(name: str, session=None) -> None:
+    """Sube la generación de `name` (sin commit: viaja con la invalidación)."""
+    session = session or db.session
+    session.execute(
+        sqlite_insert(CacheGeneration).values(name=name, generation=1)
+        .on_conflict_do_update(index_elements=['name'],
+                               set_={'generation': CacheGeneration.generation + 1}))
+    # lo que se lea después en esta transacción ya ve la nueva
+    session.info.get('generations', {}).pop(name, None)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_generations(session):
+    session.info.pop('generations', None)
@@ -1,6 +1,9 @@
 from flask_login import UserMixin
 from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import event
 from app.extensions import db
+from app.dimensions.utils import to_minor_units
 
 class Usuario(UserMixin, db.Model):
     __tablename__ = "usuario"
@@ -37,7 +40,144 @@ class HechoFinanciero(db.Model):
     time_id       = db.Column(db.Integer, db.ForeignKey('members.id'),   nullable=True)
 
     moneda = db.Column(db.String(10))
+    # Hechos generados por una asignación (ver app/facts/allocation.py);
+    # NULL en los hechos cargados.
+    allocation_run_id = db.Column(db.Integer, db.ForeignKey('allocation_run.id'), nullable=True)
     monto = db.Column(db.Numeric(18, 2), nullable=False)
+    # Monto en unidades menores de la moneda (entero de 64 bits). Es la
+    # columna que se suma: SUM/GROUP BY corre sobre enteros en SQLite.
+    monto_minor = db.Column(db.BigInteger)
+
+    __table_args__ = (
+        # Patrones de acceso: presupuesto/real por escenario y período,
+        # consultas de hechos por cuenta y período.
+        db.Index('ix_hecho_usr_scn_time', 'usuario_id', 'scenario_id', 'time_id', 'categoria_id', 'account_id', 'monto_minor'),
+        db.Index('ix_hecho_usr_acc_time', 'usuario_id', 'account_id', 'time_id'),
+        # FKs (también evitan scans al borrar members / categorías)
+        db.Index('ix_hecho_categoria', 'categoria_id'),
+        db.Index('ix_hecho_account', 'account_id'),
+        db.Index('ix_hecho_entity', 'entity_id'),
+        db.Index('ix_hecho_costcenter', 'costcenter_id'),
+        db.Index('ix_hecho_scenario', 'scenario_id'),
+        db.Index('ix_hecho_time', 'time_id'),
+        db.Index('ix_hecho_allocation_run', 'allocation_run_id'),
+    )
+
+# Intersección dimensional única. IFNULL hace que los NULL cuenten como
+# valor, así INSERT ... ON CONFLICT puede apuntar a este índice. Cada
+# corrida de asignación tiene su propia capa de la intersección.
+db.Index(
+    'uq_hecho_interseccion',
+    HechoFinanciero.usuario_id,
+    db.func.ifnull(HechoFinanciero.account_id, 0),
+    db.func.ifnull(HechoFinanciero.entity_id, 0),
+    db.func.ifnull(HechoFinanciero.costcenter_id, 0),
+    db.func.ifnull(HechoFinanciero.scenario_id, 0),
+    db.func.ifnull(HechoFinanciero.time_id, 0),
+    db.func.ifnull(HechoFinanciero.moneda, ''),
+    db.func.ifnull(HechoFinanciero.allocation_run_id, 0),
+    unique=True,
+)
+
+@event.listens_for(HechoFinanciero, 'before_insert')
+@event.listens_for(HechoFinanciero, 'before_update')
+def _sync_monto_minor(mapper, connection, target):
+    # Mantiene monto_minor al día cuando se escribe vía ORM
+    if target.monto is not None:
+        target.monto_minor = to_minor_units(Decimal(str(target.monto)), target.moneda)
+
+class AggCell(db.Model):
+    """
+    Celda consolidada materializada: suma de hechos bajo (usuario,
+    escenario, período, cuenta, entidad, moneda) según las jerarquías
+    primarias. NULL en una dimensión significa "todas". Es un cache: sin
+    FKs a members, se invalida desde app/facts/aggregates.py.
+    """
+    __tablename__ = 'agg_cell'
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, nullable=False)
+    scenario_id = db.Column(db.Integer)
+    time_id = db.Column(db.Integer)
+    account_id = db.Column(db.Integer)
+    entity_id = db.Column(db.Integer)
+    moneda = db.Column(db.String(10))
+    value_minor = db.Column(db.BigInteger, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+db.Index(
+    'uq_agg_cell',
+    AggCell.usuario_id,
+    db.func.ifnull(AggCell.scenario_id, 0),
+    db.func.ifnull(AggCell.time_id, 0),
+    db.func.ifnull(AggCell.account_id, 0),
+    db.func.ifnull(AggCell.entity_id, 0),
+    db.func.ifnull(AggCell.moneda, ''),
+    unique=True,
+)
+
+class AggBalance(db.Model):
+    """
+    Saldo consolidado mantenido por deltas (modo incremental, ver
+    app/facts/balances.py): una fila por usuario, escenario, moneda y cada
+    combinación de ancestros (o total, NULL) de cuenta, entidad y período.
+    """
+    __tablename__ = 'agg_balance'
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, nullable=False)
+    scenario_id = db.Column(db.Integer)
+    moneda = db.Column(db.String(10))
+    account_id = db.Column(db.Integer)
+    entity_id = db.Column(db.Integer)
+    time_id = db.Column(db.Integer)
+    value_minor = db.Column(db.BigInteger, nullable=False, default=0)
+
+db.Index(
+    'uq_agg_balance',
+    AggBalance.usuario_id,
+    db.func.ifnull(AggBalance.scenario_id, 0),
+    db.func.ifnull(AggBalance.moneda, ''),
+    db.func.ifnull(AggBalance.account_id, 0),
+    db.func.ifnull(AggBalance.entity_id, 0),
+    db.func.ifnull(AggBalance.time_id, 0),
+    unique=True,
+)
+
+class AllocationRun(db.Model):
+    """
+    Corrida de asignación: reparte el monto de una intersección origen
+    entre miembros COSTCENTER o ENTITY según un driver. Sus hechos llevan
+    allocation_run_id, así la corrida se revierte borrándolos.
+    """
+    __tablename__ = 'allocation_run'
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    nombre = db.Column(db.String(128))
+    parametros = db.Column(db.Text, nullable=False)  # JSON de la especificación
+    estado = db.Column(db.String(20), nullable=False, default='aplicada')  # aplicada | revertida
+    filas = db.Column(db.Integer, nullable=False, default=0)
+    creado = db.Column(db.DateTime, default=datetime.utcnow)
+    revertido = db.Column(db.DateTime)
+
+class ExchangeRate(db.Model):
+    """
+    Tipo de cambio de un período (member TIME): 1 moneda_origen =
+    tasa moneda_destino. `tipo` distingue la tasa promedio (resultados)
+    de la de cierre (saldos). Ver app/facts/fx.py.
+    """
+    __tablename__ = 'exchange_rate'
+    id = db.Column(db.Integer, primary_key=True)
+    moneda_origen = db.Column(db.String(10), nullable=False)
+    moneda_destino = db.Column(db.String(10), nullable=False)
+    time_id = db.Column(db.Integer, db.ForeignKey('members.id'), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False, default='promedio')  # promedio | cierre
+    tasa = db.Column(db.Numeric(24, 10), nullable=False)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('moneda_origen', 'moneda_destino', 'time_id', 'tipo', name='uq_exchange_rate'),
+        # la matriz de tasas se carga por período y tipo
+        db.Index('ix_exchange_rate_periodo', 'time_id', 'tipo'),
+    )
 
 class Presupuesto(db.Model):
     __tablename__ = 'presupuesto'
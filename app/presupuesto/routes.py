@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime
+from decimal import Decimal
 from app.models import db, Categoria, HechoFinanciero
+from app.dimensions.utils import parse_decimal_dot
+from app.facts.pivot import budget_actual_grid, page_rows, save_month_values, BUDGET_SCENARIO
 
 presupuesto_bp = Blueprint("presupuesto", __name__)
 
@@ -12,27 +15,17 @@ def presupuesto():
     año = request.args.get("año", año_actual, type=int)
     años = list(range(año_actual - 1, año_actual + 2))  # ej: [2024, 2025, 2026]
 
-    categorias = Categoria.query.filter_by(usuario_id=current_user.id).all()
-    hechos = HechoFinanciero.query.filter_by(
-        usuario_id=current_user.id,
-        año=año,
-        tipo="presupuesto"
-    ).all()
-
+    # grilla categoría x mes en un solo GROUP BY
+    grid = budget_actual_grid(current_user.id, año)
 
     data = {}
     data_ids = {}
     data_tipos = {}
 
-    for cat in categorias:
-        data[cat.nombre] = {mes: 0 for mes in range(1, 13)}
-        data_ids[cat.nombre] = cat.id
-        data_tipos[cat.nombre] = cat.tipo  # tipo = ingreso / gasto
-
-    for h in hechos:
-        nombre = next((c.nombre for c in categorias if c.id == h.categoria_id), None)
-        if nombre:
-            data[nombre][h.mes] = h.monto
+    for fila in page_rows(grid):
+        data[fila["nombre"]] = dict(zip(grid["meses"], fila["presupuesto"]))
+        data_ids[fila["nombre"]] = fila["id"]
+        data_tipos[fila["nombre"]] = fila["tipo"]  # tipo = ingreso / gasto
 
     return render_template(
         "presupuesto.html",
@@ -49,16 +42,8 @@ def guardar_presupuesto():
     año = int(request.form.get("año"))
     tipo_actual = request.form.get("tipo_actual")
 
-    # 🔹 Elimina presupuestos existentes del año y tipo
-    categorias = Categoria.query.filter_by(usuario_id=current_user.id, tipo=tipo_actual).all()
-    categoria_ids = [c.id for c in categorias]
-    if categoria_ids:
-        HechoFinanciero.query.filter(
-            HechoFinanciero.usuario_id == current_user.id,
-            HechoFinanciero.año == año,
-            HechoFinanciero.escenario == "presupuesto",
-            HechoFinanciero.categoria_id.in_(categoria_ids)
-        ).delete(synchronize_session=False)
+    categorias = {c.nombre: c for c in Categoria.query.filter_by(usuario_id=current_user.id)}
+    valores = {}
 
     # 🔹 Procesa todos los datos del formulario
     for key in request.form:
@@ -66,12 +51,17 @@ def guardar_presupuesto():
             partes = key.split("][")
             nombre = partes[0].split("[")[1]
             mes = int(partes[1].rstrip("]"))
-            monto = float(request.form[key] or 0)
+            try:
+                monto = parse_decimal_dot(request.form[key]) or Decimal(0)  # vacío = 0
+            except ValueError as e:
+                db.session.rollback()
+                flash(f"{nombre} / mes {mes}: {e}", "error")
+                return redirect(url_for("presupuesto.presupuesto", año=año))
 
             if not nombre or nombre.strip() == "":
                 continue
 
-            categoria = Categoria.query.filter_by(nombre=nombre, usuario_id=current_user.id).first()
+            categoria = categorias.get(nombre)
             if not categoria:
                 categoria = Categoria(
                     nombre=nombre.strip(),
@@ -80,18 +70,12 @@ def guardar_presupuesto():
                 )
                 db.session.add(categoria)
                 db.session.flush()  # Para obtener el id
+                categorias[nombre] = categoria
 
-            nuevo = HechoFinanciero(
-                usuario_id=current_user.id,
-                categoria_id=categoria.id,
-                año=año,
-                mes=mes,
-                tipo=tipo_actual,
-                escenario="presupuesto",
-                monto=monto
-            )
-            db.session.add(nuevo)
+            valores[(categoria.id, mes)] = monto
 
+    # 🔹 Upsert por intersección (escenario AOP, mes YYYYMmm)
+    save_month_values(current_user.id, BUDGET_SCENARIO, año, valores)
     db.session.commit()
     flash("Presupuesto actualizado.", "success")
     return redirect(url_for("presupuesto.presupuesto"))
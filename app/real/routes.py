@@ -1,69 +1,39 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from datetime import datetime
-from app.models import db, Categoria, HechoFinanciero
-import os
+from decimal import Decimal
+from app.models import db, Categoria
+from app.dimensions.utils import parse_decimal_dot
+from app.facts.pivot import budget_actual_grid, page_rows, save_month_values, BUDGET_SCENARIO, ACTUAL_SCENARIO, MESES
 
 real_bp = Blueprint("real", __name__)
 
 @real_bp.route("/real", strict_slashes=False)
 @login_required
 def vista_real():
-    print("🔥 ENTRO A LA FUNCIÓN REAL")
-    print("📂 FUNCION REAL DESDE:", os.path.abspath(__file__))
-
-    # Obtener año desde la URL o usar el actual por defecto
-    año_param = request.args.get("año")
-    mes_param = request.args.get("mes")
-    año_actual = datetime.utcnow().year
-
-    # AÑOS DISPONIBLES
-    años = db.session.query(Presupuesto.año.distinct()) \
-        .filter(Presupuesto.usuario_id == current_user.id) \
-        .order_by(Presupuesto.año).all()
-    años = [a[0] for a in años]
-
-    if not años:
-        return render_template("real.html", data=[], año=None, mes=None, años=[], meses=[], mensaje="No hay años disponibles con presupuesto.")
-
-    año = int(año_param) if año_param and int(año_param) in años else años[-1]
-
-    # MESES DISPONIBLES para ese año
-    meses = db.session.query(Presupuesto.mes.distinct()) \
-        .filter(Presupuesto.usuario_id == current_user.id, Presupuesto.año == año) \
-        .order_by(Presupuesto.mes).all()
-    meses = [m[0] for m in meses]
-
-    print("📆 Meses disponibles:", meses)
-
-    if not meses:
-        return render_template("real.html", data=[], año=año, mes=None, años=años, meses=[], mensaje="No hay meses con presupuesto para este año.")
-
-    mes = int(mes_param) if mes_param and int(mes_param) in meses else meses[0]
-
-    # Obtener todas las categorías del usuario
-    categorias = Categoria.query.filter_by(usuario_id=current_user.id).all()
-    presupuestos = Presupuesto.query.filter_by(usuario_id=current_user.id, año=año, mes=mes).all()
+    # Obtener año/mes desde la URL o usar el actual por defecto
+    hoy = datetime.utcnow()
+    años = list(range(hoy.year - 1, hoy.year + 2))
+    meses = list(MESES)
+    año = request.args.get("año", hoy.year, type=int)
+    mes = request.args.get("mes", hoy.month, type=int)
+    if mes not in meses:
+        mes = hoy.month
+
+    # presupuesto, real y diferencia por categoría desde un solo GROUP BY
+    grid = budget_actual_grid(current_user.id, año)
 
     data = {}
     data_ids = {}
     data_tipos = {}
 
-    for cat in categorias:
-        data[cat.nombre] = {
-            "presupuesto": 0,
-            "real": 0,
+    for fila in page_rows(grid):
+        data[fila["nombre"]] = {
+            "presupuesto": fila["presupuesto"][mes - 1],
+            "real": fila["real"][mes - 1],
         }
-        data_ids[cat.nombre] = cat.id
-        data_tipos[cat.nombre] = cat.tipo
-
-    for p in presupuestos:
-        nombre = next((c.nombre for c in categorias if c.id == p.categoria_id), None)
-        if nombre:
-            data[nombre]["presupuesto"] = p.monto_presupuestado
-
-    # 🔍 Aquí podrías integrar datos reales desde Transaccion más adelante
-    print(f"🧾 Año: {año} - Mes: {mes} - Categorías cargadas: {len(data)}")
+        data_ids[fila["nombre"]] = fila["id"]
+        data_tipos[fila["nombre"]] = fila["tipo"]
 
     return render_template(
         "real.html",
@@ -75,12 +45,45 @@ def vista_real():
         data=data,
         data_ids=data_ids,
         data_tipos=data_tipos,
-        mensaje=None
+        mensaje=None if data else "No hay categorías cargadas."
     )
+
 @real_bp.route("/real/guardar", methods=["POST"])
 @login_required
 def guardar_real():
-    # Aquí guardarás tanto presupuesto como real desde los formularios
-    # Por ahora solo imprime lo recibido para depuración
-    print("📥 POST recibido:", dict(request.form))
-    return redirect(url_for('real.vista_real'))
+    año = int(request.form.get("año"))
+    mes = int(request.form.get("mes"))
+    tipo_actual = request.form.get("tipo_actual")
+
+    categorias = {c.nombre: c for c in Categoria.query.filter_by(usuario_id=current_user.id)}
+    valores = {BUDGET_SCENARIO: {}, ACTUAL_SCENARIO: {}}
+
+    # campos presupuesto[<categoría>] y real[<categoría>] del mes
+    for key in request.form:
+        for prefijo, escenario in (("presupuesto[", BUDGET_SCENARIO), ("real[", ACTUAL_SCENARIO)):
+            if not (key.startswith(prefijo) and key.endswith("]")):
+                continue
+            nombre = key[len(prefijo):-1]
+            if nombre == "nueva_categoria":
+                nombre = (request.form.get("nueva_categoria") or "").strip()
+            if not nombre:
+                continue
+            categoria = categorias.get(nombre)
+            if not categoria:
+                categoria = Categoria(nombre=nombre, tipo=tipo_actual, usuario_id=current_user.id)
+                db.session.add(categoria)
+                db.session.flush()
+                categorias[nombre] = categoria
+            try:
+                monto = parse_decimal_dot(request.form[key]) or Decimal(0)  # vacío = 0
+            except ValueError as e:
+                db.session.rollback()
+                flash(f"{nombre}: {e}", "error")
+                return redirect(url_for('real.vista_real', año=año, mes=mes))
+            valores[escenario][(categoria.id, mes)] = monto
+
+    for escenario, vals in valores.items():
+        save_month_values(current_user.id, escenario, año, vals)
+    db.session.commit()
+    flash("Cambios guardados.", "success")
+    return redirect(url_for('real.vista_real', año=año, mes=mes))
@@ -0,0 +1,89 @@
+"""upsert hecho_financiero
+
+Revision ID: 83ff1150c29b
+Revises: 857315defabe
+Create Date: 2026-10-18 08:28:33.620265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '83ff1150c29b'
+down_revision = '857315defabe'
+branch_labels = None
+depends_on = None
+
+
+KEY_EXPRS = [
+    'usuario_id',
+    'ifnull(account_id, 0)',
+    'ifnull(entity_id, 0)',
+    'ifnull(costcenter_id, 0)',
+    'ifnull(scenario_id, 0)',
+    'ifnull(time_id, 0)',
+    "ifnull(moneda, '')",
+]
+
+
+# Con HECHOS_CONSOLIDAR_DUPLICADOS=1 se suman (en el id menor) los hechos
+# repetidos de una intersección que además tienen la misma categoría. Sin
+# la variable, o si la intersección mezcla categorías, la migración se
+# detiene y lista los conflictos para resolverlos a mano: no se pierde nada.
+MERGE_ENV = 'HECHOS_CONSOLIDAR_DUPLICADOS'
+MAX_LISTED = 20
+
+
+def upgrade():
+    import os
+    key = ', '.join(KEY_EXPRS)
+    conn = op.get_bind()
+    dups = conn.execute(sa.text(f"""
+        SELECT {key}, COUNT(*), COUNT(DISTINCT ifnull(categoria_id, 0)), GROUP_CONCAT(id)
+        FROM hecho_financiero
+        GROUP BY {key}
+        HAVING COUNT(*) > 1
+    """)).all()
+    if dups:
+        merge = os.environ.get(MERGE_ENV) == '1'
+        conflicts = [d for d in dups if not merge or d[-2] > 1]
+        if conflicts:
+            lines = [f"  usuario={d[0]} account={d[1]} entity={d[2]} costcenter={d[3]} "
+                     f"scenario={d[4]} time={d[5]} moneda={d[6]!r}: {d[7]} hechos "
+                     f"({d[8]} categorías) ids {d[9]}" for d in conflicts[:MAX_LISTED]]
+            if len(conflicts) > MAX_LISTED:
+                lines.append(f"  ... y {len(conflicts) - MAX_LISTED} más")
+            hint = ("las intersecciones con categorías distintas no se pueden sumar sin perder "
+                    "el detalle por categoría; corrígelas a mano" if merge else
+                    f"corrígelas a mano o, si son duplicados de la misma categoría, "
+                    f"reintenta con {MERGE_ENV}=1 para sumarlos en el id menor")
+            raise RuntimeError(
+                f"hecho_financiero tiene {len(conflicts)} intersecciones repetidas; "
+                f"no se puede crear uq_hecho_interseccion ({hint}):\n" + "\n".join(lines))
+        # solo duplicados de la misma categoría: suma en el id menor y borra el resto
+        print(f"{MERGE_ENV}=1: se consolidan {len(dups)} intersecciones repetidas "
+              f"({sum(d[7] - 1 for d in dups)} hechos sumados en el id menor)")
+        op.execute(f"""
+            CREATE TEMP TABLE _hecho_dups AS
+            SELECT MIN(id) AS keep_id, SUM(monto) AS total
+            FROM hecho_financiero
+            GROUP BY {key}
+            HAVING COUNT(*) > 1
+        """)
+        op.execute("""
+            UPDATE hecho_financiero
+            SET monto = (SELECT total FROM _hecho_dups WHERE keep_id = hecho_financiero.id)
+            WHERE id IN (SELECT keep_id FROM _hecho_dups)
+        """)
+        op.execute(f"""
+            DELETE FROM hecho_financiero
+            WHERE id NOT IN (SELECT MIN(id) FROM hecho_financiero GROUP BY {key})
+        """)
+        op.execute("DROP TABLE _hecho_dups")
+    op.create_index('uq_hecho_interseccion', 'hecho_financiero',
+                    [sa.text(e) for e in KEY_EXPRS], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_hecho_interseccion', table_name='hecho_financiero')
@@ -0,0 +1,38 @@
+"""indices hecho_financiero
+
+Revision ID: 857315defabe
+Revises: 2d7d217ff197
+Create Date: 2026-10-18 08:27:27.638391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '857315defabe'
+down_revision = '2d7d217ff197'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_hecho_usr_scn_time', ['usuario_id', 'scenario_id', 'time_id', 'categoria_id', 'account_id', 'monto']),
+    ('ix_hecho_usr_acc_time', ['usuario_id', 'account_id', 'time_id']),
+    ('ix_hecho_categoria', ['categoria_id']),
+    ('ix_hecho_account', ['account_id']),
+    ('ix_hecho_entity', ['entity_id']),
+    ('ix_hecho_costcenter', ['costcenter_id']),
+    ('ix_hecho_scenario', ['scenario_id']),
+    ('ix_hecho_time', ['time_id']),
+]
+
+
+def upgrade():
+    for name, cols in INDEXES:
+        op.create_index(name, 'hecho_financiero', cols, unique=False)
+
+
+def downgrade():
+    for name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name='hecho_financiero')
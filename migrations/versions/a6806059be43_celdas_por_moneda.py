@@ -0,0 +1,26 @@
+"""celdas_por_moneda
+
+Revision ID: a6806059be43
+Revises: 5fe41ec289fb
+Create Date: 2026-10-18 09:57:55.605482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6806059be43'
+down_revision = '5fe41ec289fb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Las celdas con moneda NULL eran totales de todas las monedas; ahora
+    # NULL es "hechos sin moneda". agg_cell es un cache: se recalculan.
+    op.execute("DELETE FROM agg_cell WHERE moneda IS NULL")
+
+
+def downgrade():
+    op.execute("DELETE FROM agg_cell WHERE moneda IS NULL")
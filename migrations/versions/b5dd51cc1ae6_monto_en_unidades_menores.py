@@ -0,0 +1,62 @@
+"""monto en unidades menores
+
+Revision ID: b5dd51cc1ae6
+Revises: 83ff1150c29b
+Create Date: 2026-10-18 08:30:00.189729
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5dd51cc1ae6'
+down_revision = '83ff1150c29b'
+branch_labels = None
+depends_on = None
+
+
+# Factor a unidades menores según moneda (mismo criterio que
+# app.dimensions.utils.MINOR_UNIT_DECIMALS al momento de esta migración)
+SCALE_SQL = """
+    CASE upper(ifnull(moneda, ''))
+        WHEN 'CLP' THEN 1 WHEN 'JPY' THEN 1 WHEN 'KRW' THEN 1
+        WHEN 'PYG' THEN 1 WHEN 'ISK' THEN 1 WHEN 'UYI' THEN 1
+        WHEN 'CLF' THEN 10000
+        WHEN 'BHD' THEN 1000 WHEN 'KWD' THEN 1000 WHEN 'OMR' THEN 1000 WHEN 'TND' THEN 1000
+        ELSE 100
+    END
+"""
+
+INTERSECTION_KEY_EXPRS = [
+    'usuario_id',
+    'ifnull(account_id, 0)',
+    'ifnull(entity_id, 0)',
+    'ifnull(costcenter_id, 0)',
+    'ifnull(scenario_id, 0)',
+    'ifnull(time_id, 0)',
+    "ifnull(moneda, '')",
+]
+
+
+def upgrade():
+    op.add_column('hecho_financiero', sa.Column('monto_minor', sa.BigInteger(), nullable=True))
+    op.execute(f"UPDATE hecho_financiero SET monto_minor = CAST(ROUND(monto * {SCALE_SQL}, 0) AS INTEGER)")
+
+    # el índice de presupuesto/real pasa a cubrir la columna entera
+    op.drop_index('ix_hecho_usr_scn_time', table_name='hecho_financiero')
+    op.create_index('ix_hecho_usr_scn_time', 'hecho_financiero',
+                    ['usuario_id', 'scenario_id', 'time_id', 'categoria_id', 'account_id', 'monto_minor'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_hecho_usr_scn_time', table_name='hecho_financiero')
+    op.create_index('ix_hecho_usr_scn_time', 'hecho_financiero',
+                    ['usuario_id', 'scenario_id', 'time_id', 'categoria_id', 'account_id', 'monto'],
+                    unique=False)
+    with op.batch_alter_table('hecho_financiero') as batch_op:
+        batch_op.drop_column('monto_minor')
+    # batch recrea la tabla y no refleja índices por expresión
+    op.create_index('uq_hecho_interseccion', 'hecho_financiero',
+                    [sa.text(e) for e in INTERSECTION_KEY_EXPRS], unique=True)
@@ -0,0 +1,97 @@
+"""vinculos primarios
+
+Revision ID: f8f7c9c837d2
+Revises: 450900431f7b
+Create Date: 2026-10-18 08:58:48.363222
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+_SIGN = "CASE trim(ifnull({}, '+')) WHEN '-' THEN -1 WHEN '~' THEN 0 ELSE 1 END"
+
+# Si un hijo ya tenía varios padres, el vínculo más antiguo queda primario
+DEMOTE_SQL = """
+    UPDATE hierarchy_edges SET is_primary = 0
+     WHERE parent_member_id IS NOT NULL
+       AND id > (SELECT MIN(e.id) FROM hierarchy_edges e
+                  WHERE e.hierarchy_id = hierarchy_edges.hierarchy_id
+                    AND e.child_member_id = hierarchy_edges.child_member_id
+                    AND e.parent_member_id IS NOT NULL)
+"""
+
+SHARED_SQL = """
+    UPDATE members SET is_shared = EXISTS (
+        SELECT 1 FROM hierarchy_edges e
+         WHERE e.child_member_id = members.id AND e.parent_member_id IS NOT NULL AND NOT e.is_primary)
+"""
+
+POPULATE_SQL = f"""
+    WITH RECURSIVE
+    nodes(hierarchy_id, member_id) AS (
+        SELECT hierarchy_id, child_member_id FROM hierarchy_edges
+        UNION
+        SELECT hierarchy_id, parent_member_id FROM hierarchy_edges WHERE parent_member_id IS NOT NULL
+    ),
+    factors(hierarchy_id, parent_id, child_id, factor, prim) AS (
+        SELECT e.hierarchy_id, e.parent_member_id, e.child_member_id,
+               {_SIGN.format('e.unary_op')} * {_SIGN.format('m.agg_op')},
+               CASE WHEN e.is_primary THEN 1 ELSE 0 END
+          FROM hierarchy_edges e JOIN members m ON m.id = e.child_member_id
+         WHERE e.parent_member_id IS NOT NULL
+    ),
+    walk(hierarchy_id, ancestor_id, descendant_id, depth, sign, prim) AS (
+        SELECT hierarchy_id, member_id, member_id, 0, 1, 1 FROM nodes
+        UNION ALL
+        SELECT w.hierarchy_id, f.parent_id, w.descendant_id, w.depth + 1, w.sign * f.factor,
+               w.prim * f.prim
+          FROM walk w JOIN factors f
+            ON f.hierarchy_id = w.hierarchy_id AND f.child_id = w.ancestor_id
+         WHERE w.depth < 1000
+    )
+    INSERT INTO hierarchy_closure (hierarchy_id, ancestor_id, descendant_id, depth, sign, paths,
+                                   primary_paths)
+    SELECT hierarchy_id, ancestor_id, descendant_id, depth, sign, COUNT(*), SUM(prim)
+      FROM walk
+     GROUP BY hierarchy_id, ancestor_id, descendant_id, depth, sign
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8f7c9c837d2'
+down_revision = '450900431f7b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('hierarchy_closure', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('primary_paths', sa.Integer(), server_default='1', nullable=False))
+
+    with op.batch_alter_table('hierarchy_edges', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_primary', sa.Boolean(), server_default=sa.text('1'), nullable=False))
+
+    # ### end Alembic commands ###
+    op.execute(DEMOTE_SQL)
+    op.execute(SHARED_SQL)
+    op.execute("DELETE FROM hierarchy_closure")
+    op.execute(POPULATE_SQL)
+    # los consolidados cambian (los compartidos suman una sola vez): se
+    # vacían los caches y los triggers del modo incremental, que usaban
+    # `paths`; reactivar con `flask agg-incremental on`
+    for name in ('trg_agg_hecho_ins', 'trg_agg_hecho_upd', 'trg_agg_hecho_del'):
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.execute("DELETE FROM agg_balance")
+    op.execute("DELETE FROM agg_cell")
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('hierarchy_edges', schema=None) as batch_op:
+        batch_op.drop_column('is_primary')
+
+    with op.batch_alter_table('hierarchy_closure', schema=None) as batch_op:
+        batch_op.drop_column('primary_paths')
+
+    # ### end Alembic commands ###
@@ -0,0 +1,155 @@
+# scripts/bench_ciclos.py
+# Benchmark del chequeo de ciclos al crear vínculos (closure.creates_cycle)
+# frente al DFS recursivo anterior, que cargaba todos los vínculos de la
+# jerarquía en cada inserción. Genera en una base temporal:
+#   - una jerarquía ancha de 100k vínculos (10 hijos por nodo) con su
+#     clausura armada con REBUILD_SQL, y
+#   - una cadena de 100k niveles (solo la auditoría completa has_cycle: su
+#     clausura tendría ~N²/2 filas), y
+#   - una cadena de --profunda niveles con clausura, para verificar que el
+#     chequeo ve ancestros a cualquier profundidad (sin tope en REBUILD_SQL).
+#
+#   python scripts/bench_ciclos.py [--vinculos 100000] [--chequeos 1000] [--profunda 1500] [--keep]
+from pathlib import Path
+from collections import defaultdict
+import argparse, random, sqlite3, sys, tempfile, time
+
+root = Path(__file__).resolve().parents[1] if Path(__file__).parent.name == "scripts" else Path.cwd()
+sys.path.insert(0, str(root))
+from app.dimensions.closure import REBUILD_SQL  # noqa: E402
+from app.dimensions.services import graph_has_cycle  # noqa: E402
+
+OK = "✅"
+ERR = "❌"
+INF = "ℹ️"
+
+def p(ok, msg): print(f"{OK if ok else ERR} {msg}")
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--vinculos", type=int, default=100_000)
+ap.add_argument("--chequeos", type=int, default=1000)
+ap.add_argument("--profunda", type=int, default=1500)
+ap.add_argument("--keep", action="store_true", help="No borra la base sintética.")
+args = ap.parse_args()
+N = args.vinculos
+
+# misma consulta que closure.is_descendant (padre bajo el hijo = ciclo)
+CHECK_SQL = """SELECT id FROM hierarchy_closure
+                WHERE hierarchy_id = ? AND ancestor_id = ? AND descendant_id = ? AND depth > 0 LIMIT 1"""
+
+def recursive_has_cycle(children):
+    """El has_cycle anterior: DFS recursivo sobre todos los vínculos."""
+    WHITE, GRAY, BLACK = 0, 1, 2
+    color = {}
+
+    def dfs(u):
+        color[u] = GRAY
+        for v in children.get(u, []):
+            if color.get(v, WHITE) == GRAY:
+                return True
+            if color.get(v, WHITE) == WHITE and dfs(v):
+                return True
+        color[u] = BLACK
+        return False
+
+    nodes = set(children) | {c for lst in children.values() for c in lst}
+    return any(color.get(n, WHITE) == WHITE and dfs(n) for n in nodes)
+
+def load_children(con, h):
+    children = defaultdict(list)
+    for parent, child in con.execute(
+            "SELECT parent_member_id, child_member_id FROM hierarchy_edges "
+            "WHERE hierarchy_id = ? AND parent_member_id IS NOT NULL", (h,)):
+        children[parent].append(child)
+    return children
+
+tmp = Path(tempfile.mkdtemp()) / "bench_ciclos.db"
+con = sqlite3.connect(tmp)
+con.executescript("""
+    CREATE TABLE members (id INTEGER PRIMARY KEY, agg_op TEXT);
+    CREATE TABLE hierarchy_edges (id INTEGER PRIMARY KEY, hierarchy_id INTEGER, parent_member_id INTEGER,
+        child_member_id INTEGER, unary_op TEXT DEFAULT '+', is_primary BOOLEAN DEFAULT 1);
+    CREATE UNIQUE INDEX uq_edge_unique ON hierarchy_edges (hierarchy_id, parent_member_id, child_member_id);
+    CREATE INDEX ix_edge_child ON hierarchy_edges (hierarchy_id, child_member_id);
+    CREATE TABLE hierarchy_closure (id INTEGER PRIMARY KEY, hierarchy_id INTEGER, ancestor_id INTEGER,
+        descendant_id INTEGER, depth INTEGER, sign INTEGER, paths INTEGER, primary_paths INTEGER,
+        UNIQUE (hierarchy_id, ancestor_id, descendant_id, depth, sign));
+    CREATE INDEX ix_closure_descendant ON hierarchy_closure (hierarchy_id, descendant_id, ancestor_id);
+""")
+WIDE, DEEP, CHAIN = 1, 2, 3
+con.executemany("INSERT INTO members (id, agg_op) VALUES (?, '+')", ((i,) for i in range(N + 1)))
+con.execute("INSERT INTO hierarchy_edges (hierarchy_id, parent_member_id, child_member_id) VALUES (?, NULL, 0)",
+            (WIDE,))
+con.executemany("INSERT INTO hierarchy_edges (hierarchy_id, parent_member_id, child_member_id) VALUES (?, ?, ?)",
+                ((WIDE, (i - 1) // 10, i) for i in range(1, N + 1)))
+con.executemany("INSERT INTO hierarchy_edges (hierarchy_id, parent_member_id, child_member_id) VALUES (?, ?, ?)",
+                ((DEEP, i - 1, i) for i in range(1, N + 1)))
+D = args.profunda
+con.executemany("INSERT INTO hierarchy_edges (hierarchy_id, parent_member_id, child_member_id) VALUES (?, ?, ?)",
+                ((CHAIN, i - 1, i) for i in range(1, D + 1)))
+t0 = time.perf_counter()
+# como rebuild_closure: la profundidad solo se acota por la cantidad de vínculos
+con.execute(str(REBUILD_SQL), {"h": WIDE, "max_depth": N})
+con.commit()
+filas = con.execute("SELECT count(*) FROM hierarchy_closure").fetchone()[0]
+print(f"{INF} base sintética: 2 jerarquías x {N} vínculos + cadena de {D} · clausura ancha {filas} filas "
+      f"en {time.perf_counter() - t0:.1f} s ({tmp})")
+
+try:
+    plan = " ".join(r[-1] for r in con.execute("EXPLAIN QUERY PLAN " + CHECK_SQL, (WIDE, 1, 2)))
+    p("USING" in plan and "INDEX" in plan, f"chequeo por índice: {plan}")
+
+    # pares (padre nuevo, hijo nuevo) al azar; la mitad cierra ciclo (hijo = ancestro del padre)
+    rnd = random.Random(42)
+    pairs = []
+    for k in range(args.chequeos):
+        parent = rnd.randint(1, N)
+        child = rnd.randint(0, N)
+        if k % 2:
+            child = parent
+            for _ in range(rnd.randint(1, 4)):
+                child = (child - 1) // 10 if child else child
+        pairs.append((parent, child))
+
+    t0 = time.perf_counter()
+    nuevo = [p_ == c_ or con.execute(CHECK_SQL, (WIDE, c_, p_)).fetchone() is not None for p_, c_ in pairs]
+    t_nuevo = (time.perf_counter() - t0) / len(pairs)
+
+    # el anterior recargaba todos los vínculos y recorría el grafo en cada inserción
+    muestra = pairs[:20]
+    t0 = time.perf_counter()
+    antes = []
+    for parent, child in muestra:
+        children = load_children(con, WIDE)
+        children[parent].append(child)
+        antes.append(recursive_has_cycle(children))
+    t_antes = (time.perf_counter() - t0) / len(muestra)
+    p(antes == nuevo[:len(muestra)], f"mismo resultado que el DFS completo en {len(muestra)} pares "
+                                     f"({sum(nuevo)} de {len(nuevo)} pares cierran ciclo)")
+    print(f"{INF} por inserción: clausura {t_nuevo * 1000:.3f} ms · DFS completo {t_antes * 1000:.1f} ms "
+          f"· x{t_antes / t_nuevo:.0f}")
+
+    # cadena con clausura: el padre nuevo (la hoja) cuelga D niveles bajo el hijo (la raíz)
+    con.execute(str(REBUILD_SQL), {"h": CHAIN, "max_depth": D})
+    hondo = con.execute(CHECK_SQL, (CHAIN, 0, D)).fetchone() is not None
+    p(hondo, f"cadena de {D} niveles: el chequeo ve el ancestro a profundidad {D}")
+
+    # auditoría completa: pila explícita vs recursión en la cadena profunda
+    for h, nombre in ((WIDE, "ancha"), (DEEP, "cadena")):
+        children = load_children(con, h)
+        t0 = time.perf_counter()
+        sin_ciclo = not graph_has_cycle(children)
+        children[N].append(0)  # la última hoja pasa a ser padre de la raíz
+        con_ciclo = graph_has_cycle(children)
+        p(sin_ciclo and con_ciclo, f"has_cycle iterativo ({nombre}, {N} vínculos): "
+                                   f"{(time.perf_counter() - t0) / 2 * 1000:.0f} ms por recorrido")
+    try:
+        recursive_has_cycle(load_children(con, DEEP))
+        print(f"{INF} DFS recursivo en la cadena: terminó (límite de recursión {sys.getrecursionlimit()})")
+    except RecursionError:
+        print(f"{INF} DFS recursivo en la cadena: RecursionError (límite {sys.getrecursionlimit()})")
+finally:
+    con.close()
+    if not args.keep:
+        tmp.unlink(missing_ok=True)
+        tmp.parent.rmdir()
@@ -0,0 +1,75 @@
+# scripts/bench_consolidacion.py
+# Benchmark de la consolidación ENTITY en paralelo (flask consolidate --workers):
+# genera una base sintética (100 entidades en 3 niveles x 1M hechos por
+# defecto) y consolida con 1, 2, 4... procesos, verificando que todas las
+# corridas den lo mismo que la de un proceso.
+#
+#   python scripts/bench_consolidacion.py [--hechos 1000000] [--workers 1,2,4,8] [--keep]
+from pathlib import Path
+import argparse, os, random, sqlite3, sys, tempfile, time
+
+root = Path(__file__).resolve().parents[1] if Path(__file__).parent.name == "scripts" else Path.cwd()
+sys.path.insert(0, str(root))
+from app.dimensions.consolidate import consolidate  # noqa: E402
+
+OK = "✅"
+ERR = "❌"
+INF = "ℹ️"
+
+def p(ok, msg): print(f"{OK if ok else ERR} {msg}")
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--hechos", type=int, default=1_000_000)
+ap.add_argument("--workers", default=",".join(str(w) for w in (1, 2, 4, 8) if w <= max(os.cpu_count() or 1, 2)))
+ap.add_argument("--keep", action="store_true", help="No borra la base sintética.")
+args = ap.parse_args()
+workers = [int(w) for w in args.workers.split(",") if w.strip()]
+
+# 1 raíz + 9 regiones + 90 hojas = 100 entidades; los hechos van a las hojas
+ROOT, REGIONS = 1, list(range(2, 11))
+edges, leaves, nid = [], [], 11
+for region in REGIONS:
+    edges.append((ROOT, region, 1))
+    for _ in range(10):
+        edges.append((region, nid, 1))
+        leaves.append(nid)
+        nid += 1
+edges.reverse()  # de abajo hacia arriba, como HierarchyGraph.edges
+
+tmp = Path(tempfile.mkdtemp()) / "bench_consolidacion.db"
+con = sqlite3.connect(tmp)
+con.execute("""CREATE TABLE hecho_financiero (id INTEGER PRIMARY KEY, usuario_id INTEGER,
+    account_id INTEGER, entity_id INTEGER, scenario_id INTEGER, time_id INTEGER,
+    moneda TEXT, monto_minor INTEGER)""")
+rnd = random.Random(42)
+t0 = time.perf_counter()
+con.executemany(
+    "INSERT INTO hecho_financiero (usuario_id, account_id, entity_id, scenario_id, time_id, moneda, monto_minor) "
+    "VALUES (1, ?, ?, ?, ?, 'CLP', ?)",
+    ((rnd.randint(1, 50), rnd.choice(leaves), rnd.randint(1, 2), rnd.randint(1, 24),
+      rnd.randint(-100_000, 1_000_000)) for _ in range(args.hechos)))
+con.execute("CREATE INDEX ix_hecho_entity ON hecho_financiero (entity_id)")
+con.commit()
+con.close()
+print(f"{INF} base sintética: {args.hechos} hechos · 100 entidades · {time.perf_counter() - t0:.1f} s ({tmp})")
+print(f"{INF} CPUs disponibles: {os.cpu_count()}")
+
+base = None
+try:
+    for w in workers:
+        res = consolidate(str(tmp), edges, workers=w)
+        if base is None:
+            base = res
+        same = res["valores"] == base["valores"]
+        speedup = base["segundos"] / res["segundos"] if res["segundos"] else 0
+        p(same, f"workers={w}: {res['segundos']:.3f} s · x{speedup:.2f} · "
+                f"{res['particiones']} particiones · {sum(len(v) for v in res['valores'].values())} claves")
+        if not same:
+            sys.exit(1)
+    total = sum(base["valores"][ROOT].values())
+    p(total == sum(sum(v.values()) for m, v in base["valores"].items() if m in leaves),
+      "la raíz suma exactamente las hojas")
+finally:
+    if not args.keep:
+        tmp.unlink(missing_ok=True)
+        tmp.parent.rmdir()
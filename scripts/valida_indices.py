@@ -0,0 +1,73 @@
+# scripts/valida_indices.py
+# Regresión de planes de consulta sobre hecho_financiero: corre EXPLAIN QUERY PLAN
+# de las consultas de presupuesto, real y hechos y falla (exit 1) si alguna
+# recorre la tabla completa en vez de buscar por índice.
+#
+#   python scripts/valida_indices.py [ruta/a/finanzas.db]
+from pathlib import Path
+import sqlite3, sys
+
+OK = "✅"
+ERR = "❌"
+INF = "ℹ️"
+
+def p(ok, msg): print(f"{OK if ok else ERR} {msg}")
+
+root = Path(__file__).resolve().parents[1] if Path(__file__).parent.name == "scripts" else Path.cwd()
+db_path = Path(sys.argv[1]) if len(sys.argv) > 1 else root / "instance" / "finanzas.db"
+
+# (nombre, sql, parámetros) — reflejan las consultas reales de la app
+QUERIES = [
+    ("presupuesto (usuario+escenario+meses)",
+     """SELECT categoria_id, time_id, SUM(monto_minor) FROM hecho_financiero
+        WHERE usuario_id = ? AND scenario_id = ? AND time_id IN (?, ?, ?)
+        GROUP BY categoria_id, time_id""",
+     (1, 1, 1, 2, 3)),
+    ("real (usuario+escenario+mes)",
+     """SELECT categoria_id, SUM(monto_minor) FROM hecho_financiero
+        WHERE usuario_id = ? AND scenario_id = ? AND time_id = ?
+        GROUP BY categoria_id""",
+     (1, 2, 1)),
+    ("hechos por cuenta y período",
+     """SELECT id, monto_minor FROM hecho_financiero
+        WHERE usuario_id = ? AND account_id = ? AND time_id BETWEEN ? AND ?""",
+     (1, 1, 1, 12)),
+    ("hechos API (keyset por id)",
+     """SELECT * FROM hecho_financiero
+        WHERE id > ? AND usuario_id = ? AND account_id = ? ORDER BY id LIMIT 1000""",
+     (0, 1, 1)),
+    ("hechos por escenario",
+     "SELECT id FROM hecho_financiero WHERE scenario_id = ?",
+     (1,)),
+    ("hechos por entidad",
+     "SELECT id FROM hecho_financiero WHERE entity_id = ?",
+     (1,)),
+    ("hechos por centro de costo",
+     "SELECT id FROM hecho_financiero WHERE costcenter_id = ?",
+     (1,)),
+    ("hechos por categoría",
+     "SELECT id FROM hecho_financiero WHERE categoria_id = ?",
+     (1,)),
+]
+
+
+def full_scans(con, sql, params):
+    """Líneas del plan que recorren hecho_financiero completo."""
+    plan = [r[3] for r in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    return [line for line in plan if line.startswith("SCAN hecho_financiero")], plan
+
+
+if not db_path.exists():
+    p(False, f"No existe DB: {db_path} (¿corriste las migraciones?)")
+    sys.exit(1)
+
+con = sqlite3.connect(db_path)
+failed = 0
+for name, sql, params in QUERIES:
+    scans, plan = full_scans(con, sql, params)
+    p(not scans, f"{name}: {' | '.join(plan)}")
+    failed += bool(scans)
+con.close()
+
+print(f"{INF} Terminado: {len(QUERIES) - failed}/{len(QUERIES)} consultas usan índice.")
+sys.exit(1 if failed else 0)